@@ -18,6 +18,10 @@ class StoropsException(Exception):
     message = 'Storops Error.'
 
 
+class UnityException(StoropsException):
+    pass
+
+
 class UnityLunNameInUseError(StoropsException):
     pass
 
@@ -50,6 +54,14 @@ class UnityThinCloneLimitExceededError(StoropsException):
     pass
 
 
+class UnityConsistencyGroupNameInUseError(StoropsException):
+    pass
+
+
+class UnityCGMemberActionNotSupportError(StoropsException):
+    pass
+
+
 class ExtendLunError(Exception):
     pass
 
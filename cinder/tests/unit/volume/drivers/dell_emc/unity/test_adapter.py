@@ -15,6 +15,10 @@
 
 import contextlib
 import functools
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 import mock
@@ -45,6 +49,32 @@ class MockConfig(object):
         self.san_password = 'pass'
         self.driver_ssl_cert_verify = False
         self.driver_ssl_cert_path = None
+        self.force_delete_attached_snapshots = False
+        self.unity_clone_snapshot_share_window = 0
+        self.unity_group_clone_workers = 4
+        self.unity_image_cache_enabled = False
+        self.unity_image_cache_max_count = 16
+        self.unity_warm_lun_sizes = None
+        self.unity_warm_lun_depth = 2
+        self.unity_warm_lun_min_free_percent = 20
+        self.unity_warm_lun_refill_interval = 60
+        self.unity_job_batch_size = 1
+        self.unity_job_batch_window = 0.05
+        self.unity_job_timeout = 300
+        self.unity_move_session_timeout = 86400
+        self.unity_deferred_delete = False
+        self.unity_deferred_delete_rate = 30
+        self.unity_deferred_delete_max_retries = 5
+        self.unity_over_subscription_data_reduction = False
+        self.unity_perf_sample_interval = 0
+        self.unity_perf_smoothing_factor = 0.3
+        self.unity_hot_volume_count = 0
+        self.unity_telemetry_samples = 60
+        self.unity_sp_balanced_placement = False
+        self.unity_sp_balance_refresh_interval = 300
+        self.unity_iscsi_max_portals = 0
+        self.unity_fc_max_targets = 0
+        self.unity_fc_zone_cache_ttl = 0
 
     def safe_get(self, name):
         return getattr(self, name)
@@ -76,7 +106,9 @@ class MockClient(object):
         return test_client.MockResourceList(['pool0', 'pool1'])
 
     @staticmethod
-    def create_lun(name, size, pool, description=None, io_limit_policy=None):
+    def create_lun(name, size, pool, description=None, io_limit_policy=None,
+                   tiering_policy=None, is_compression=False, is_thin=True,
+                   sp=None):
         return test_client.MockResource(_id=name, name=name)
 
     @staticmethod
@@ -111,7 +143,7 @@ class MockClient(object):
         return test_client.MockResource(name=name, _id=src_lun_id)
 
     @staticmethod
-    def get_snap(name=None):
+    def get_snap(name=None, snap_id=None):
         if name in ('snap_50',):  # for thin clone cases
             return name
         snap = test_client.MockResource(name=name, _id=name)
@@ -142,8 +174,12 @@ class MockClient(object):
 
     @staticmethod
     def get_iscsi_target_info(allowed_ports=None):
-        return [{'portal': '1.2.3.4:1234', 'iqn': 'iqn.1-1.com.e:c.a.a0'},
-                {'portal': '1.2.3.5:1234', 'iqn': 'iqn.1-1.com.e:c.a.a1'}]
+        return [{'portal': '1.2.3.4:1234', 'iqn': 'iqn.1-1.com.e:c.a.a0',
+                 'sp': 'spa', 'port': 'spa_eth0', 'ip': '1.2.3.4',
+                 'netmask': '255.255.255.0'},
+                {'portal': '1.2.3.5:1234', 'iqn': 'iqn.1-1.com.e:c.a.a1',
+                 'sp': 'spb', 'port': 'spb_eth0', 'ip': '1.2.3.5',
+                 'netmask': '255.255.255.0'}]
 
     @staticmethod
     def get_fc_target_info(host=None, logged_in_only=False,
@@ -154,14 +190,81 @@ class MockClient(object):
             ret = ['8899AABBCCDDEEFF', '8899AABBCCDDFFEE']
         return ret
 
+    @staticmethod
+    def get_fc_targets(host=None, logged_in_only=False, allowed_ports=None):
+        if host and host.name == 'no_target':
+            ret = {}
+        else:
+            ret = {'8899AABBCCDDEEFF': 'spa', '8899AABBCCDDFFEE': 'spb'}
+        return ret
+
+    @staticmethod
+    def get_owner_sp(lun):
+        return 'spb'
+
     @staticmethod
     def create_lookup_service():
         return {}
 
     @staticmethod
-    def get_io_limit_policy(specs):
+    def get_io_limit_policy(specs, project_id=None):
         return None
 
+    @staticmethod
+    def enable_perf_stats(interval):
+        pass
+
+    @staticmethod
+    def get_lun_contents(pool_ids, order_by=None):
+        return iter([
+            {'id': 'sv_1', 'name': 'volume-1', 'sizeTotal': 3 * units.Gi,
+             'pool': {'id': 'pool_1'}, 'hostAccess': []},
+            {'id': 'sv_2', 'name': 'lun_2', 'sizeTotal': units.Gi + 1,
+             'pool': {'id': 'pool_1'}, 'hostAccess': []},
+            {'id': 'sv_3', 'name': 'tombstone-sv_3',
+             'sizeTotal': units.Gi, 'pool': {'id': 'pool_1'},
+             'hostAccess': []},
+            {'id': 'sv_4', 'name': 'lun_4', 'sizeTotal': units.Gi,
+             'pool': {'id': 'pool_1'},
+             'hostAccess': [{'host': {'id': 'host_1'}}]}])
+
+    @staticmethod
+    def get_snap_contents(pool_ids, order_by=None):
+        return iter([{'id': 'snap_1', 'name': 'snap_1', 'size': units.Gi,
+                      'lun': {'id': 'sv_2'}}])
+
+    @staticmethod
+    def get_sp_lun_counts(pool_ids):
+        return {'spa': 3, 'spb': 1}
+
+    @staticmethod
+    def get_sp_utilization():
+        return {}
+
+    @staticmethod
+    def get_lun_perf(pool_ids):
+        return {'lun_1': ('pool_1', 100, 10, 200)}
+
+    @staticmethod
+    def get_tiering_policy(spec_value):
+        return spec_value
+
+    @staticmethod
+    def update_lun_io_limit_policy(lun, io_limit_policy):
+        pass
+
+    @staticmethod
+    def migrate_lun(lun, dest_pool):
+        return True
+
+    @staticmethod
+    def restore_snap(snap, delete_backup=False):
+        return None
+
+    @staticmethod
+    def get_snap_diff(base_snap, snap):
+        return []
+
     @staticmethod
     def extend_lun(lun_id, size_gib):
         if size_gib <= 0:
@@ -177,7 +280,8 @@ class MockClient(object):
         return test_client.MockResourceList(ids=['spa_eth0', 'spb_eth0'])
 
     @staticmethod
-    def thin_clone(obj, name, io_limit_policy, description, new_size_gb):
+    def thin_clone(obj, name, io_limit_policy, description, new_size_gb,
+                   tiering_policy=None, sp=None):
         if (obj.name, name) in (
                 ('snap_61', 'lun_60'), ('lun_63', 'lun_60')):
             return test_client.MockResource(_id=name)
@@ -188,6 +292,31 @@ class MockClient(object):
     def update_host_initiators(host, wwns):
         return None
 
+    @staticmethod
+    def create_cg(name, description=None, lun_add=None):
+        return test_client.MockResource(_id=name, name=name)
+
+    @staticmethod
+    def delete_cg(name):
+        pass
+
+    @staticmethod
+    def update_cg(name, add_lun_ids, remove_lun_ids):
+        pass
+
+    @staticmethod
+    def create_cg_snap(cg_name, snap_name=None):
+        return test_client.MockResource(_id=snap_name, name=snap_name)
+
+    @staticmethod
+    def filter_snaps_in_cg_snap(cg_snap_id):
+        snaps = []
+        for lun_id in ('lun_71', 'lun_72'):
+            snap = test_client.MockResource(_id='%s_%s' % (cg_snap_id, lun_id))
+            snap.lun = test_client.MockResource(_id=lun_id)
+            snaps.append(snap)
+        return snaps
+
     @property
     def system(self):
         return self._system
@@ -211,6 +340,8 @@ class MockOSResource(mock.Mock):
         super(MockOSResource, self).__init__(*args, **kwargs)
         if 'name' in kwargs:
             self.name = kwargs['name']
+        if 'group_id' not in kwargs:
+            self.group_id = None
 
 
 def mock_adapter(driver_clz):
@@ -228,6 +359,10 @@ def get_backend_qos_specs(volume):
     return None
 
 
+def get_extra_spec(volume, spec_key):
+    return None
+
+
 def get_connector_properties():
     return {'host': 'host1', 'wwpns': 'abcdefg'}
 
@@ -248,7 +383,7 @@ def get_connector_uids(adapter, connector):
     return []
 
 
-def get_connection_info(adapter, hlu, host, connector):
+def get_connection_info(adapter, hlu, host, connector, owner_sp=None):
     return {}
 
 
@@ -257,6 +392,9 @@ def patch_for_unity_adapter(func):
     @mock.patch('cinder.volume.drivers.dell_emc.unity.utils.'
                 'get_backend_qos_specs',
                 new=get_backend_qos_specs)
+    @mock.patch('cinder.volume.drivers.dell_emc.unity.utils.'
+                'get_extra_spec',
+                new=get_extra_spec)
     @mock.patch('cinder.utils.brick_get_connector_properties',
                 new=get_connector_properties)
     def func_wrapper(*args, **kwargs):
@@ -346,6 +484,666 @@ class CommonAdapterTest(unittest.TestCase):
         expected = get_lun_pl('lun_3')
         self.assertEqual(expected, ret['provider_location'])
 
+    @patch_for_unity_adapter
+    def test_create_volume_tiering_policy(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        specs = {'storagetype:tiering': 'HighestAvailable'}
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               side_effect=lambda vol, key: specs.get(key)
+                               ) as get_spec, \
+                mock.patch.object(self.adapter.client,
+                                  'create_lun') as create_lun:
+            create_lun.return_value = test_client.MockResource(_id='lun_3')
+            self.adapter.create_volume(volume)
+        get_spec.assert_any_call(volume, 'storagetype:tiering')
+        self.assertEqual('HighestAvailable',
+                         create_lun.call_args[1]['tiering_policy'])
+
+    @patch_for_unity_adapter
+    def test_create_volume_compressed(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        self.adapter.warm_luns = mock.Mock()
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               side_effect=lambda vol, key: {
+                                   'provisioning:type': 'compressed'}.get(
+                                       key)), \
+                mock.patch.object(self.adapter.client,
+                                  'create_lun') as create_lun:
+            create_lun.return_value = test_client.MockResource(_id='lun_3')
+            self.adapter.create_volume(volume)
+        self.assertTrue(create_lun.call_args[1]['is_compression'])
+        self.assertFalse(self.adapter.warm_luns.take.called)
+
+    @patch_for_unity_adapter
+    def test_create_volume_thick(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        self.adapter.warm_luns = mock.Mock()
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               side_effect=lambda vol, key: {
+                                   'provisioning:type': 'thick'}.get(key)), \
+                mock.patch.object(self.adapter.client,
+                                  'create_lun') as create_lun:
+            create_lun.return_value = test_client.MockResource(_id='lun_3')
+            self.adapter.create_volume(volume)
+        self.assertFalse(create_lun.call_args[1]['is_thin'])
+        self.assertFalse(create_lun.call_args[1]['is_compression'])
+        self.assertFalse(self.adapter.warm_luns.take.called)
+
+    @patch_for_unity_adapter
+    def test_thin_clone_thick_volume(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        src_snap = test_client.MockResource(name='snap_1', _id='snap_1')
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               return_value='thick'), \
+                mock.patch.object(self.adapter, '_dd_copy') as dd_copy, \
+                mock.patch.object(self.adapter.client,
+                                  'thin_clone') as thin_clone:
+            vol_params = adapter.VolumeParams(self.adapter, volume)
+            ret = self.adapter._thin_clone(vol_params, src_snap)
+        self.assertIs(dd_copy.return_value, ret)
+        dd_copy.assert_called_once_with(vol_params, src_snap, src_lun=None,
+                                        sp=None)
+        self.assertFalse(thin_clone.called)
+
+    @patch_for_unity_adapter
+    def test_create_volume_from_warm_lun(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1',
+                                display_description='desc')
+        warm_lun = mock.Mock()
+        warm_lun.get_id.return_value = 'lun_5'
+        self.adapter.warm_luns = mock.Mock()
+        self.adapter.warm_luns.take.return_value = warm_lun
+        with mock.patch.object(self.adapter.client,
+                               'create_lun') as create_lun:
+            ret = self.adapter.create_volume(volume)
+        self.assertEqual('pool1',
+                         self.adapter.warm_luns.take.call_args[0][0].name)
+        warm_lun.modify.assert_called_once_with(
+            name='lun_3', description='desc', io_limit_policy=None,
+            tiering_policy=None)
+        self.assertFalse(create_lun.called)
+        self.assertEqual(get_lun_pl('lun_5'), ret['provider_location'])
+
+    @patch_for_unity_adapter
+    def test_create_volume_warm_lun_modify_failed(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        warm_lun = mock.Mock()
+        warm_lun.get_id.return_value = 'lun_5'
+        warm_lun.modify.side_effect = ex.StoropsException
+        self.adapter.warm_luns = mock.Mock()
+        self.adapter.warm_luns.take.return_value = warm_lun
+        with mock.patch.object(self.adapter.client,
+                               'delete_lun') as delete_lun:
+            ret = self.adapter.create_volume(volume)
+        delete_lun.assert_called_once_with('lun_5')
+        self.assertEqual(get_lun_pl('lun_3'), ret['provider_location'])
+
+    @patch_for_unity_adapter
+    def test_create_volume_no_warm_lun(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        self.adapter.warm_luns = mock.Mock()
+        self.adapter.warm_luns.take.return_value = None
+        ret = self.adapter.create_volume(volume)
+        self.assertEqual(get_lun_pl('lun_3'), ret['provider_location'])
+
+    def test_setup_warm_luns(self):
+        config = MockConfig()
+        config.unity_warm_lun_sizes = [1, 10]
+        ret = adapter.CommonAdapter()
+        ret._client = MockClient()
+        with mock.patch.object(adapter.CommonAdapter, 'validate_ports'), \
+                patch_storops(), \
+                mock.patch.object(adapter, 'loopingcall') as loopingcall, \
+                mock.patch.object(adapter.WarmLuns, 'load') as load:
+            ret.do_setup(MockDriver(), config)
+        self.assertEqual([1, 10], ret.warm_luns.sizes)
+        self.assertEqual(
+            'warm-%s-' % adapter.utils.get_backend_tag('test_backend'),
+            ret.warm_luns.prefix)
+        load.assert_called_once_with(mock.ANY)
+        loopingcall.FixedIntervalLoopingCall.assert_called_once_with(
+            ret._refill_warm_luns)
+        loopingcall.FixedIntervalLoopingCall.return_value.start.\
+            assert_called_once_with(interval=60, initial_delay=0)
+
+    def test_setup_jobs(self):
+        config = MockConfig()
+        config.unity_job_batch_size = 8
+        ret = adapter.CommonAdapter()
+        ret._client = MockClient()
+        with mock.patch.object(adapter.CommonAdapter, 'validate_ports'), \
+                patch_storops(), \
+                mock.patch.object(ret._client, 'enable_jobs',
+                                  create=True) as enable_jobs:
+            ret.do_setup(MockDriver(), config)
+        enable_jobs.assert_called_once_with(8, 0.05, timeout=300)
+
+    @patch_for_unity_adapter
+    def test_create_volume_in_cg(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1',
+                                group_id='group_1')
+        with mock.patch('cinder.volume.utils.is_group_a_cg_snapshot_type',
+                        return_value=True), \
+                mock.patch.object(self.adapter.client,
+                                  'update_cg') as update_cg:
+            ret = self.adapter.create_volume(volume)
+        update_cg.assert_called_once_with('group_1', ['lun_3'], [])
+        self.assertEqual(get_lun_pl('lun_3'), ret['provider_location'])
+
+    @patch_for_unity_adapter
+    def test_create_volume_in_non_cg_group(self):
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1',
+                                group_id='group_1')
+        with mock.patch('cinder.volume.utils.is_group_a_cg_snapshot_type',
+                        return_value=False), \
+                mock.patch.object(self.adapter.client,
+                                  'update_cg') as update_cg:
+            self.adapter.create_volume(volume)
+        self.assertFalse(update_cg.called)
+
+    def test_create_group(self):
+        group = MockOSResource(id='group_1', description='group 1')
+        with mock.patch.object(self.adapter.client,
+                               'create_cg') as create_cg:
+            ret = self.adapter.create_group(group)
+        create_cg.assert_called_once_with('group_1', description='group 1')
+        self.assertEqual('available', ret['status'])
+
+    def test_delete_group(self):
+        group = MockOSResource(id='group_1')
+        with mock.patch.object(self.adapter.client,
+                               'delete_cg') as delete_cg:
+            ret = self.adapter.delete_group(group, [])
+        delete_cg.assert_called_once_with('group_1')
+        self.assertEqual((None, None), ret)
+
+    def test_update_group(self):
+        group = MockOSResource(id='group_1')
+        add_volumes = [MockOSResource(provider_location='id^lun_71'),
+                       MockOSResource(provider_location='id^lun_72')]
+        remove_volumes = [MockOSResource(provider_location='id^lun_73')]
+        with mock.patch.object(self.adapter.client,
+                               'update_cg') as update_cg:
+            ret = self.adapter.update_group(group, add_volumes,
+                                            remove_volumes)
+        update_cg.assert_called_once_with('group_1', {'lun_71', 'lun_72'},
+                                          {'lun_73'})
+        self.assertEqual('available', ret[0]['status'])
+
+    def test_update_group_none_volumes(self):
+        group = MockOSResource(id='group_1')
+        with mock.patch.object(self.adapter.client,
+                               'update_cg') as update_cg:
+            self.adapter.update_group(group, None, None)
+        update_cg.assert_called_once_with('group_1', set(), set())
+
+    def test_create_group_snapshot(self):
+        group_snapshot = MockOSResource(id='cg_snap_1', group_id='group_1')
+        snapshots = [
+            MockOSResource(id='snap_71', volume=MockOSResource(
+                provider_location='id^lun_71')),
+            MockOSResource(id='snap_72', volume=MockOSResource(
+                provider_location='id^lun_72'))]
+        model_update, snapshots_model_update = (
+            self.adapter.create_group_snapshot(group_snapshot, snapshots))
+        self.assertEqual('available', model_update['status'])
+        self.assertEqual(['snap_71', 'snap_72'],
+                         [u['id'] for u in snapshots_model_update])
+        self.assertEqual(get_snap_pl('cg_snap_1_lun_71'),
+                         snapshots_model_update[0]['provider_location'])
+        self.assertEqual('cg_snap_1_lun_72',
+                         snapshots_model_update[1]['provider_id'])
+
+    def test_delete_group_snapshot(self):
+        group_snapshot = MockOSResource(id='cg_snap_1')
+        with mock.patch.object(self.adapter.client,
+                               'delete_snap') as delete_snap:
+            ret = self.adapter.delete_group_snapshot(group_snapshot, [])
+        self.assertEqual('cg_snap_1', delete_snap.call_args[0][0].name)
+        self.assertEqual((None, None), ret)
+
+    def test_clone_image_cache_disabled(self):
+        volume = MockOSResource(id='vol_1', name='vol_1', size=5)
+        self.assertEqual((None, False),
+                         self.adapter.clone_image(None, volume, {'id': 'img'},
+                                                  None))
+
+    @patch_for_unity_adapter
+    def test_clone_image(self):
+        volume = MockOSResource(id='vol_1', name='vol_1', size=5)
+        self.adapter.image_cache = mock.Mock()
+        self.adapter.image_cache.clone.return_value = (
+            test_client.MockResource(_id='lun_90'))
+        model_update, cloned = self.adapter.clone_image(
+            None, volume, {'id': 'img'}, None)
+        self.assertTrue(cloned)
+        self.assertEqual(get_snap_lun_pl('lun_90'),
+                         model_update['provider_location'])
+
+    @patch_for_unity_adapter
+    def test_clone_image_compressed(self):
+        volume = MockOSResource(id='vol_1', name='vol_1', size=5)
+        self.adapter.image_cache = mock.Mock()
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               return_value='compressed'):
+            self.assertEqual((None, False), self.adapter.clone_image(
+                None, volume, {'id': 'img'}, None))
+        self.assertFalse(self.adapter.image_cache.clone.called)
+
+    @patch_for_unity_adapter
+    def test_clone_image_smaller_volume(self):
+        volume = MockOSResource(id='vol_1', name='vol_1', size=1)
+        self.adapter.image_cache = mock.Mock()
+        self.adapter.image_cache.clone.return_value = None
+        self.assertEqual((None, False),
+                         self.adapter.clone_image(None, volume, {'id': 'img'},
+                                                  None))
+
+    def _migrate_volume(self, location_info, is_thin_clone=False,
+                        family_clone_count=0, moved=True):
+        volume = MockOSResource(name='vol_1', provider_location='id^lun_1')
+        host = {'capabilities': {'location_info': location_info}}
+        lun = mock.Mock(is_thin_clone=is_thin_clone,
+                        family_clone_count=family_clone_count)
+        lun.pool.name = 'pool0'
+        with mock.patch.object(self.adapter.client, 'get_lun',
+                               return_value=lun), \
+                mock.patch.object(self.adapter.client, 'migrate_lun',
+                                  return_value=moved) as migrate_lun:
+            ret = self.adapter.migrate_volume(volume, host)
+        return ret, migrate_lun
+
+    def test_migrate_volume(self):
+        ret, migrate_lun = self._migrate_volume('pool1|CLIENT_SERIAL')
+        self.assertEqual((True, None), ret)
+        self.assertEqual('pool1', migrate_lun.call_args[0][1].name)
+
+    def test_migrate_volume_move_failed(self):
+        ret, _migrate_lun = self._migrate_volume('pool1|CLIENT_SERIAL',
+                                                 moved=False)
+        self.assertEqual((False, None), ret)
+
+    def test_migrate_volume_same_pool(self):
+        ret, migrate_lun = self._migrate_volume('pool0|CLIENT_SERIAL')
+        self.assertEqual((True, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def test_migrate_volume_other_array(self):
+        ret, migrate_lun = self._migrate_volume('pool1|OTHER_SERIAL')
+        self.assertEqual((False, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def test_migrate_volume_invalid_location_info(self):
+        ret, migrate_lun = self._migrate_volume(None)
+        self.assertEqual((False, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def test_migrate_volume_thin_clone(self):
+        ret, migrate_lun = self._migrate_volume('pool1|CLIENT_SERIAL',
+                                                is_thin_clone=True)
+        self.assertEqual((False, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def test_migrate_volume_with_thin_clones(self):
+        ret, migrate_lun = self._migrate_volume('pool1|CLIENT_SERIAL',
+                                                family_clone_count=2)
+        self.assertEqual((False, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def test_migrate_volume_pool_not_found(self):
+        ret, migrate_lun = self._migrate_volume('pool9|CLIENT_SERIAL')
+        self.assertEqual((False, None), ret)
+        self.assertFalse(migrate_lun.called)
+
+    def _retype(self, dest_host, new_qos_specs=None, is_thin_clone=False,
+                moved=True, new_extra_specs=None, modify_error=None):
+        volume = MockOSResource(name='vol_1', provider_location='id^lun_1',
+                                volume_type_id=None, project_id='project_1')
+        new_type = {'id': 'type_2'}
+        lun = mock.Mock(is_thin_clone=is_thin_clone, family_clone_count=0)
+        lun.modify.side_effect = modify_error
+        lun.pool.name = 'pool0'
+        client = self.adapter.client
+        with mock.patch.object(client, 'get_lun', return_value=lun), \
+                mock.patch('cinder.volume.drivers.dell_emc.unity.utils.'
+                           'get_backend_qos_specs_of_type',
+                           return_value=new_qos_specs), \
+                mock.patch('cinder.volume.drivers.dell_emc.unity.utils.'
+                           'get_extra_spec_of_type',
+                           side_effect=lambda type_id, key:
+                           (new_extra_specs or {}).get(key)), \
+                mock.patch.object(client, 'get_io_limit_policy') as get_qos, \
+                mock.patch.object(client, 'update_lun_io_limit_policy'
+                                  ) as update_qos, \
+                mock.patch.object(client, 'migrate_lun',
+                                  return_value=moved) as migrate_lun:
+            ret = self.adapter.retype(volume, new_type, {},
+                                      {'host': dest_host})
+        return ret, lun, get_qos, update_qos, migrate_lun
+
+    @patch_for_unity_adapter
+    def test_retype_qos(self):
+        qos_specs = {'id': 'qos_2', 'maxIOPS': 100, 'maxBWS': None}
+        ret, lun, get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool0', new_qos_specs=qos_specs)
+        self.assertTrue(ret)
+        get_qos.assert_called_once_with(qos_specs, project_id='project_1')
+        update_qos.assert_called_once_with(lun, get_qos.return_value)
+        self.assertFalse(migrate_lun.called)
+
+    @patch_for_unity_adapter
+    def test_retype_tiering_policy(self):
+        ret, lun, _get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool0',
+            new_extra_specs={'storagetype:tiering': 'LowestAvailable'})
+        self.assertTrue(ret)
+        lun.modify.assert_called_once_with(tiering_policy='LowestAvailable')
+        self.assertFalse(update_qos.called)
+        self.assertFalse(migrate_lun.called)
+
+    @patch_for_unity_adapter
+    def test_retype_compression(self):
+        ret, lun, _get_qos, _update_qos, migrate_lun = self._retype(
+            'host@unity#pool0',
+            new_extra_specs={'provisioning:type': 'compressed'})
+        self.assertTrue(ret)
+        lun.modify.assert_called_once_with(is_compression=True)
+        self.assertFalse(migrate_lun.called)
+
+    @patch_for_unity_adapter
+    def test_retype_tiering_policy_failed(self):
+        qos_specs = {'id': 'qos_2', 'maxIOPS': 100, 'maxBWS': None}
+        ret, lun, _get_qos, update_qos, _migrate_lun = self._retype(
+            'host@unity#pool0', new_qos_specs=qos_specs,
+            new_extra_specs={'storagetype:tiering': 'LowestAvailable',
+                             'provisioning:type': 'compressed'},
+            modify_error=ex.StoropsException)
+        self.assertFalse(ret)
+        lun.modify.assert_called_once_with(tiering_policy='LowestAvailable')
+        self.assertFalse(update_qos.called)
+
+    @patch_for_unity_adapter
+    def test_retype_compression_failed(self):
+        qos_specs = {'id': 'qos_2', 'maxIOPS': 100, 'maxBWS': None}
+        ret, lun, _get_qos, update_qos, _migrate_lun = self._retype(
+            'host@unity#pool0', new_qos_specs=qos_specs,
+            new_extra_specs={'provisioning:type': 'compressed'},
+            modify_error=ex.StoropsException)
+        self.assertFalse(ret)
+        lun.modify.assert_called_once_with(is_compression=True)
+        self.assertFalse(update_qos.called)
+
+    @patch_for_unity_adapter
+    def test_retype_thick(self):
+        ret, lun, _get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool0',
+            new_extra_specs={'provisioning:type': 'thick',
+                             'storagetype:tiering': 'LowestAvailable'})
+        self.assertFalse(ret)
+        self.assertFalse(lun.modify.called)
+        self.assertFalse(update_qos.called)
+        self.assertFalse(migrate_lun.called)
+
+    @patch_for_unity_adapter
+    def test_retype_nothing_changed(self):
+        ret, _lun, _get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool0')
+        self.assertTrue(ret)
+        self.assertFalse(update_qos.called)
+        self.assertFalse(migrate_lun.called)
+
+    @patch_for_unity_adapter
+    def test_retype_pool_changed(self):
+        ret, lun, _get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool1')
+        self.assertTrue(ret)
+        self.assertFalse(update_qos.called)
+        migrate_lun.assert_called_once_with(lun, mock.ANY,
+                                            is_compression=False)
+        self.assertEqual('pool1', migrate_lun.call_args[0][1].name)
+
+    @patch_for_unity_adapter
+    def test_retype_pool_changed_compression(self):
+        ret, lun, _get_qos, _update_qos, migrate_lun = self._retype(
+            'host@unity#pool1',
+            new_extra_specs={'provisioning:type': 'compressed'})
+        self.assertTrue(ret)
+        migrate_lun.assert_called_once_with(lun, mock.ANY,
+                                            is_compression=True)
+        self.assertFalse(lun.modify.called)
+
+    @patch_for_unity_adapter
+    def test_retype_move_failed(self):
+        qos_specs = {'id': 'qos_2', 'maxIOPS': 100, 'maxBWS': None}
+        ret, lun, _get_qos, update_qos, _migrate_lun = self._retype(
+            'host@unity#pool1', new_qos_specs=qos_specs,
+            new_extra_specs={'storagetype:tiering': 'LowestAvailable'},
+            moved=False)
+        self.assertFalse(ret)
+        # Nothing is changed on the LUN left in the source pool.
+        self.assertFalse(lun.modify.called)
+        self.assertFalse(update_qos.called)
+
+    @patch_for_unity_adapter
+    def test_retype_thin_clone_pool_changed(self):
+        qos_specs = {'id': 'qos_2', 'maxIOPS': 100, 'maxBWS': None}
+        ret, _lun, _get_qos, update_qos, migrate_lun = self._retype(
+            'host@unity#pool1', new_qos_specs=qos_specs, is_thin_clone=True)
+        self.assertFalse(ret)
+        self.assertFalse(update_qos.called)
+        self.assertFalse(migrate_lun.called)
+
+    @staticmethod
+    def _get_group_volumes(src_key, src_ids):
+        return [MockOSResource(id='vol_%s' % i, name='vol_%s' % i, size=1,
+                               host='unity#pool1', volume_type_id='type_1',
+                               **{src_key: src_id})
+                for i, src_id in enumerate(src_ids)]
+
+    @staticmethod
+    def _copy_lun(vol_params, snap, sp=None):
+        return test_client.MockResource(_id='lun_%s' % vol_params.name)
+
+    @patch_for_unity_adapter
+    def test_create_group_from_group_snapshot(self):
+        group = MockOSResource(id='group_2')
+        group_snapshot = MockOSResource(id='cg_snap_1')
+        snapshots = [
+            MockOSResource(id='snap_71', volume=MockOSResource(
+                provider_location='id^lun_71')),
+            MockOSResource(id='snap_72', volume=MockOSResource(
+                provider_location='id^lun_72'))]
+        volumes = self._get_group_volumes('snapshot_id',
+                                          ['snap_72', 'snap_71'])
+        with patch_thin_clone(None) as tc, \
+                mock.patch.object(adapter.CommonAdapter, '_dd_copy',
+                                  side_effect=self._copy_lun) as dd, \
+                mock.patch.object(self.adapter.client,
+                                  'create_cg') as create_cg:
+            model_update, volumes_model_update = (
+                self.adapter.create_group_from_src(
+                    group, volumes, group_snapshot=group_snapshot,
+                    snapshots=snapshots))
+        self.assertEqual('available', model_update['status'])
+        self.assertFalse(tc.called)
+        src_snaps = {call[0][0].name: call[0][1].get_id()
+                     for call in dd.call_args_list}
+        self.assertEqual({'vol_0': 'cg_snap_1_lun_72',
+                          'vol_1': 'cg_snap_1_lun_71'}, src_snaps)
+        create_cg.assert_called_once_with('group_2', lun_add=mock.ANY)
+        self.assertEqual(
+            ['lun_vol_0', 'lun_vol_1'],
+            [lun.get_id() for lun in create_cg.call_args[1]['lun_add']])
+        self.assertEqual(['vol_0', 'vol_1'],
+                         [u['id'] for u in volumes_model_update])
+        self.assertEqual(get_lun_pl('lun_vol_0'),
+                         volumes_model_update[0]['provider_location'])
+        self.assertEqual(['available', 'available'],
+                         [u['status'] for u in volumes_model_update])
+
+    @patch_for_unity_adapter
+    def test_create_group_from_source_group(self):
+        group = MockOSResource(id='group_3')
+        source_group = MockOSResource(id='group_1')
+        source_vols = [MockOSResource(id='src_71',
+                                      provider_location='id^lun_71'),
+                       MockOSResource(id='src_72',
+                                      provider_location='id^lun_72')]
+        volumes = self._get_group_volumes('source_volid',
+                                          ['src_71', 'src_72'])
+        with patch_dd_copy(None) as dd, \
+                mock.patch.object(self.adapter.client,
+                                  'create_cg_snap',
+                                  wraps=self.adapter.client.create_cg_snap
+                                  ) as create_cg_snap, \
+                mock.patch.object(self.adapter.client,
+                                  'delete_snap') as delete_snap:
+            dd.side_effect = self._copy_lun
+            model_update, volumes_model_update = (
+                self.adapter.create_group_from_src(
+                    group, volumes, source_group=source_group,
+                    source_vols=source_vols))
+        create_cg_snap.assert_called_once_with(
+            'group_1', snap_name='snap_clone_group_3')
+        self.assertEqual('snap_clone_group_3',
+                         delete_snap.call_args[0][0].get_id())
+        src_snaps = {call[0][0].name: call[0][1].get_id()
+                     for call in dd.call_args_list}
+        self.assertEqual({'vol_0': 'snap_clone_group_3_lun_71',
+                          'vol_1': 'snap_clone_group_3_lun_72'}, src_snaps)
+        self.assertEqual('available', model_update['status'])
+        self.assertEqual(2, len(volumes_model_update))
+
+    @patch_for_unity_adapter
+    def test_create_group_from_src_failed(self):
+        group = MockOSResource(id='group_2')
+        group_snapshot = MockOSResource(id='cg_snap_1')
+        snapshots = [
+            MockOSResource(id='snap_71', volume=MockOSResource(
+                provider_location='id^lun_71')),
+            MockOSResource(id='snap_72', volume=MockOSResource(
+                provider_location='id^lun_72'))]
+        volumes = self._get_group_volumes('snapshot_id',
+                                          ['snap_71', 'snap_72'])
+
+        def dd_copy(vol_params, snap, sp=None):
+            if vol_params.name == 'vol_1':
+                raise ex.StoropsException()
+            return self._copy_lun(vol_params, snap)
+
+        with patch_dd_copy(None) as dd, \
+                mock.patch.object(self.adapter.client,
+                                  'delete_lun') as delete_lun, \
+                mock.patch.object(self.adapter.client,
+                                  'create_cg') as create_cg:
+            dd.side_effect = dd_copy
+            self.assertRaises(exception.VolumeBackendAPIException,
+                              self.adapter.create_group_from_src,
+                              group, volumes, group_snapshot=group_snapshot,
+                              snapshots=snapshots)
+        delete_lun.assert_called_once_with('lun_vol_0')
+        self.assertFalse(create_cg.called)
+
+    @patch_for_unity_adapter
+    def test_create_group_from_src_create_cg_failed(self):
+        group = MockOSResource(id='group_2')
+        group_snapshot = MockOSResource(id='cg_snap_1')
+        snapshots = [
+            MockOSResource(id='snap_71', volume=MockOSResource(
+                provider_location='id^lun_71')),
+            MockOSResource(id='snap_72', volume=MockOSResource(
+                provider_location='id^lun_72'))]
+        volumes = self._get_group_volumes('snapshot_id',
+                                          ['snap_71', 'snap_72'])
+        with patch_dd_copy(None) as dd, \
+                mock.patch.object(self.adapter.client,
+                                  'delete_lun') as delete_lun, \
+                mock.patch.object(self.adapter.client, 'create_cg',
+                                  side_effect=ex.StoropsException):
+            dd.side_effect = self._copy_lun
+            self.assertRaises(ex.StoropsException,
+                              self.adapter.create_group_from_src,
+                              group, volumes, group_snapshot=group_snapshot,
+                              snapshots=snapshots)
+        self.assertEqual([mock.call('lun_vol_0'), mock.call('lun_vol_1')],
+                         delete_lun.call_args_list)
+
+    def test_revert_to_snapshot(self):
+        volume = MockOSResource(name='vol_1')
+        snapshot = MockOSResource(name='snap_1')
+        backup_snap = test_client.MockResource(name='backup', _id='snap_b')
+        with mock.patch.object(self.adapter.client, 'restore_snap',
+                               return_value=backup_snap) as restore, \
+                mock.patch.object(adapter.greenthread, 'spawn_n') as spawn:
+            self.adapter.revert_to_snapshot(volume, snapshot)
+        restore.assert_called_once_with(mock.ANY)
+        self.assertEqual('snap_1', restore.call_args[0][0].name)
+        spawn.assert_called_once_with(
+            adapter.utils.ignore_exception, self.adapter.client.delete_snap,
+            backup_snap)
+
+    def test_revert_to_snapshot_deferred(self):
+        volume = MockOSResource(name='vol_1')
+        snapshot = MockOSResource(name='snap_1')
+        backup_snap = mock.Mock()
+        backup_snap.get_id.return_value = 'snap_b'
+        self.adapter.deferred_deletes = mock.Mock(prefix='tombstone-tag-')
+        with mock.patch.object(self.adapter.client, 'restore_snap',
+                               return_value=backup_snap), \
+                mock.patch.object(adapter.greenthread, 'spawn_n') as spawn:
+            self.adapter.revert_to_snapshot(volume, snapshot)
+        self.adapter.deferred_deletes.add.assert_called_once_with(
+            'snap', 'snap_b', even_attached=False)
+        backup_snap.modify.assert_called_once_with(
+            name='tombstone-tag-snap_b')
+        self.assertFalse(spawn.called)
+
+    def test_revert_to_snapshot_no_backup(self):
+        volume = MockOSResource(name='vol_1')
+        snapshot = MockOSResource(name='snap_1')
+        with mock.patch.object(self.adapter.client, 'restore_snap',
+                               return_value=None), \
+                mock.patch.object(adapter.greenthread, 'spawn_n') as spawn:
+            self.adapter.revert_to_snapshot(volume, snapshot)
+        self.assertFalse(spawn.called)
+
+    def test_revert_to_snapshot_not_found(self):
+        volume = MockOSResource(name='vol_1')
+        snapshot = MockOSResource(name='snap_1', id='snap_1')
+        with mock.patch.object(self.adapter.client, 'get_snap',
+                               return_value=None), \
+                mock.patch.object(self.adapter.client,
+                                  'restore_snap') as restore:
+            self.assertRaises(exception.SnapshotNotFound,
+                              self.adapter.revert_to_snapshot,
+                              volume, snapshot)
+        self.assertFalse(restore.called)
+
+    def test_get_snapshot_diff(self):
+        snapshot = MockOSResource(name='snap_2', volume_id='vol_1')
+        base_snapshot = MockOSResource(name='snap_1', volume_id='vol_1')
+        with mock.patch.object(self.adapter.client, 'get_snap_diff',
+                               return_value=iter([(0, 512)])) as snap_diff:
+            self.assertEqual([(0, 512)], self.adapter.get_snapshot_diff(
+                snapshot, base_snapshot))
+        base_snap, snap = snap_diff.call_args[0]
+        self.assertEqual('snap_1', base_snap.name)
+        self.assertEqual('snap_2', snap.name)
+
+    def test_get_snapshot_diff_other_volume(self):
+        snapshot = MockOSResource(name='snap_2', volume_id='vol_2')
+        base_snapshot = MockOSResource(name='snap_1', volume_id='vol_1')
+        self.assertIsNone(self.adapter.get_snapshot_diff(snapshot,
+                                                         base_snapshot))
+
+    def test_get_snapshot_diff_not_supported(self):
+        snapshot = MockOSResource(name='snap_2', volume_id='vol_1')
+        base_snapshot = MockOSResource(name='snap_1', volume_id='vol_1')
+        with mock.patch.object(self.adapter.client, 'get_snap_diff',
+                               side_effect=ex.StoropsException):
+            self.assertIsNone(self.adapter.get_snapshot_diff(
+                snapshot, base_snapshot))
+
     def test_create_snapshot(self):
         volume = MockOSResource(provider_location='id^lun_43')
         snap = MockOSResource(volume=volume, name='abc-def_snap')
@@ -372,6 +1170,131 @@ class CommonAdapterTest(unittest.TestCase):
         volume = MockOSResource(provider_location='id^lun_4')
         self.adapter.delete_volume(volume)
 
+    def test_delete_volume_untracked(self):
+        volume = MockOSResource(provider_location='id^lun_4')
+        self.adapter.lun_telemetry = mock.Mock()
+        self.adapter.delete_volume(volume)
+        self.adapter.lun_telemetry.untrack.assert_called_once_with('lun_4')
+
+    def test_delete_volume_deferred(self):
+        volume = MockOSResource(provider_location='id^lun_4')
+        lun = mock.Mock(is_thin_clone=True, io_limit_policy=None)
+        self.adapter.deferred_deletes = mock.Mock(prefix='tombstone-tag-')
+        with mock.patch.object(self.adapter.client, 'get_lun',
+                               return_value=lun), \
+                mock.patch.object(self.adapter.client,
+                                  'delete_lun') as delete_lun:
+            self.adapter.delete_volume(volume)
+        self.adapter.deferred_deletes.add.assert_called_once_with(
+            'lun', 'lun_4', is_clone=True)
+        lun.modify.assert_called_once_with(name='tombstone-tag-lun_4')
+        self.assertFalse(delete_lun.called)
+
+    def test_delete_volume_deferred_shared_qos(self):
+        volume = MockOSResource(provider_location='id^lun_4')
+        lun = mock.Mock(is_thin_clone=False)
+        lun.io_limit_policy.is_shared = True
+        self.adapter.deferred_deletes = mock.Mock(prefix='tombstone-tag-')
+        with mock.patch.object(self.adapter.client, 'get_lun',
+                               return_value=lun), \
+                mock.patch.object(self.adapter.client,
+                                  'update_lun_io_limit_policy') as update_qos:
+            self.adapter.delete_volume(volume)
+        update_qos.assert_called_once_with(lun, None)
+
+    def test_volume_params_shared_qos(self):
+        volume = MockOSResource(name='vol_1', size=5, host='unity#pool1',
+                                project_id='project_1')
+        qos_specs = {'id': 'qos_1', 'maxIOPS': 100, 'maxBWS': None,
+                     'isShared': True}
+        with mock.patch.object(adapter.utils, 'get_backend_qos_specs',
+                               return_value=qos_specs), \
+                mock.patch.object(self.adapter.client,
+                                  'get_io_limit_policy') as get_qos:
+            params = adapter.VolumeParams(self.adapter, volume)
+            self.assertEqual(get_qos.return_value, params.io_limit_policy)
+        get_qos.assert_called_once_with(qos_specs, project_id='project_1')
+
+    def test_delete_snapshot_deferred(self):
+        snapshot = MockOSResource(name='snap_1')
+        snap = mock.Mock()
+        snap.get_id.return_value = 'snap_id_1'
+        self.adapter.deferred_deletes = mock.Mock(prefix='tombstone-tag-')
+        with mock.patch.object(self.adapter.client, 'get_snap',
+                               return_value=snap), \
+                mock.patch.object(self.adapter.client,
+                                  'delete_snap') as delete_snap:
+            self.adapter.delete_snapshot(snapshot)
+        self.adapter.deferred_deletes.add.assert_called_once_with(
+            'snap', 'snap_id_1', even_attached=False)
+        snap.modify.assert_called_once_with(name='tombstone-tag-snap_id_1')
+        self.assertFalse(delete_snap.called)
+
+    def test_setup_deferred_deletes(self):
+        config = MockConfig()
+        config.unity_deferred_delete = True
+        ret = adapter.CommonAdapter()
+        ret._client = MockClient()
+        with mock.patch.object(adapter.CommonAdapter, 'validate_ports'), \
+                patch_storops(), \
+                mock.patch.object(adapter, 'loopingcall') as loopingcall, \
+                mock.patch.object(adapter.DeferredDeletes, 'load') as load:
+            ret.do_setup(MockDriver(), config)
+        self.assertTrue(ret.deferred_deletes.path.endswith(
+            'deferred_deletes'))
+        self.assertEqual(
+            'tombstone-%s-' % adapter.utils.get_backend_tag('test_backend'),
+            ret.deferred_deletes.prefix)
+        load.assert_called_once_with(mock.ANY, even_attached=False)
+        loopingcall.FixedIntervalLoopingCall.assert_called_once_with(
+            ret.deferred_deletes.reap)
+        loopingcall.FixedIntervalLoopingCall.return_value.start.\
+            assert_called_once_with(interval=2.0)
+
+    def test_setup_perf_sampler(self):
+        config = MockConfig()
+        config.unity_perf_sample_interval = 30
+        ret = adapter.CommonAdapter()
+        ret._client = MockClient()
+        with mock.patch.object(adapter.CommonAdapter, 'validate_ports'), \
+                patch_storops(), \
+                mock.patch.object(adapter, 'loopingcall') as loopingcall, \
+                mock.patch.object(ret._client,
+                                  'enable_perf_stats') as enable_perf_stats:
+            ret.do_setup(MockDriver(), config)
+        enable_perf_stats.assert_called_once_with(30)
+        self.assertEqual(0.3, ret.perf_sampler.alpha)
+        loopingcall.FixedIntervalLoopingCall.assert_called_once_with(
+            ret._sample_perf)
+        loopingcall.FixedIntervalLoopingCall.return_value.start.\
+            assert_called_once_with(interval=30)
+
+    def test_sample_perf(self):
+        self.adapter.perf_sampler = mock.Mock()
+        self.adapter.storage_pools_map = {
+            'pool1': test_client.MockResource('pool1', 'pool_1')}
+        self.adapter._sample_perf()
+        self.adapter.perf_sampler.sample.assert_called_once_with(
+            ['pool_1'], {'lun_1': ('pool_1', 100, 10, 200)})
+
+    def test_sample_perf_telemetry(self):
+        self.adapter.perf_sampler = mock.Mock()
+        self.adapter.lun_telemetry = mock.Mock()
+        self.adapter._sample_perf()
+        self.adapter.lun_telemetry.record.assert_called_once_with(
+            {'lun_1': ('pool_1', 100, 10, 200)})
+
+    def test_sample_perf_error(self):
+        self.adapter.perf_sampler = mock.Mock()
+        self.adapter.perf_sampler.sample.side_effect = ex.StoropsException
+        self.adapter._sample_perf()
+
+    def test_get_pool_stats_perf(self):
+        self.adapter.perf_sampler = mock.Mock()
+        self.adapter.perf_sampler.get.return_value = {'perf_iops': 100}
+        stats = self.adapter.get_pools_stats()[0]
+        self.assertEqual(100, stats['perf_iops'])
+
     def test_get_pool_stats(self):
         stats_list = self.adapter.get_pools_stats()
         self.assertEqual(1, len(stats_list))
@@ -384,16 +1307,170 @@ class CommonAdapterTest(unittest.TestCase):
         self.assertEqual(2, stats['free_capacity_gb'])
         self.assertEqual(300, stats['max_over_subscription_ratio'])
         self.assertEqual(5, stats['reserved_percentage'])
-        self.assertFalse(stats['thick_provisioning_support'])
+        self.assertTrue(stats['thick_provisioning_support'])
         self.assertTrue(stats['thin_provisioning_support'])
+        self.assertTrue(stats['consistent_group_snapshot_enabled'])
+        self.assertEqual(0, stats['warm_luns'])
+        self.assertEqual(0, stats['warm_luns_capacity_gb'])
+        self.assertFalse(stats['fast_cache'])
+        self.assertTrue(stats['compression_support'])
+        self.assertEqual(1.0, stats['data_reduction_ratio'])
+        self.assertEqual(0, stats['data_reduction_saved_gb'])
+
+    def test_get_pool_stats_data_reduction(self):
+        pool = test_client.MockResource('pool1')
+        pool.data_reduction_ratio = 2.5
+        pool.data_reduction_size_saved = 30 * units.Gi
+        stats = self.adapter._get_pool_stats(pool)
+        self.assertEqual(2.5, stats['data_reduction_ratio'])
+        self.assertEqual(30, stats['data_reduction_saved_gb'])
+        self.assertEqual(300, stats['max_over_subscription_ratio'])
+
+    def test_get_pool_stats_compression_scaled(self):
+        pool = test_client.MockResource('pool1')
+        pool.compression_ratio = 2
+        pool.compression_size_saved = 10 * units.Gi
+        self.adapter.over_subscription_data_reduction = True
+        stats = self.adapter._get_pool_stats(pool)
+        self.assertEqual(2, stats['data_reduction_ratio'])
+        self.assertEqual(10, stats['data_reduction_saved_gb'])
+        self.assertEqual(600, stats['max_over_subscription_ratio'])
+
+    def test_get_pool_stats_tiers(self):
+        pool = test_client.MockResource('pool1')
+        pool.is_fast_cache_enabled = True
+        pool.tiers = [mock.Mock(size_total=10 * units.Gi,
+                                size_free=4 * units.Gi),
+                      mock.Mock(size_total=0, size_free=0)]
+        pool.tiers[0].name = 'Extreme Performance'
+        pool.tiers[1].name = 'Capacity'
+        stats = self.adapter._get_pool_stats(pool)
+        self.assertTrue(stats['fast_cache'])
+        self.assertEqual(4, stats['extreme_performance_tier_free_capacity_gb'])
+        self.assertNotIn('capacity_tier_free_capacity_gb', stats)
+
+    def test_get_pool_stats_warm_luns(self):
+        self.adapter.warm_luns = mock.Mock()
+        self.adapter.warm_luns.reserved.return_value = (2, 4)
+        stats = self.adapter.get_pools_stats()[0]
+        self.assertEqual(2, stats['warm_luns'])
+        self.assertEqual(4, stats['warm_luns_capacity_gb'])
+        self.assertEqual(2, stats['provisioned_capacity_gb'])
 
     def test_update_volume_stats(self):
         stats = self.adapter.update_volume_stats()
         self.assertEqual('backend', stats['volume_backend_name'])
         self.assertEqual('unknown', stats['storage_protocol'])
         self.assertTrue(stats['thin_provisioning_support'])
-        self.assertFalse(stats['thick_provisioning_support'])
+        self.assertTrue(stats['thick_provisioning_support'])
         self.assertEqual(1, len(stats['pools']))
+        self.assertNotIn('hot_volumes', stats)
+
+    def test_update_volume_stats_sp_lun_counts(self):
+        self.adapter.sp_balancer = adapter.SpBalancer(self.adapter.client)
+        self.adapter._refresh_sp_balance()
+        stats = self.adapter.update_volume_stats()
+        self.assertEqual({'spa': 3, 'spb': 1}, stats['sp_lun_counts'])
+
+    def test_create_volume_sp_balanced(self):
+        self.adapter.sp_balancer = mock.Mock()
+        self.adapter.sp_balancer.choose.return_value = 'spb'
+        volume = MockOSResource(name='lun_3', size=5, host='unity#pool1')
+        with mock.patch.object(self.adapter.client, 'create_lun',
+                               wraps=self.adapter.client.create_lun) as create:
+            self.adapter.create_volume(volume)
+        self.assertEqual('spb', create.call_args[1]['sp'])
+
+    def test_choose_sp_disabled(self):
+        self.assertIsNone(self.adapter.choose_sp())
+
+    def test_refresh_sp_balance_error(self):
+        self.adapter.sp_balancer = mock.Mock()
+        self.adapter.sp_balancer.refresh.side_effect = ex.StoropsException
+        self.adapter._refresh_sp_balance()
+
+    def test_update_volume_stats_hot_volumes(self):
+        self.adapter.hot_volume_count = 1
+        self.adapter.lun_telemetry = adapter.LunTelemetry(2)
+        self.adapter.lun_telemetry.track('lun_1', 'vol_1')
+        self.adapter.lun_telemetry.record(
+            self.adapter.client.get_lun_perf(['pool_1']))
+        stats = self.adapter.update_volume_stats()
+        self.assertEqual([{'volume_id': 'vol_1', 'iops': 100,
+                           'bandwidth_mbps': 10, 'response_time_us': 200}],
+                         stats['hot_volumes'])
+
+    def test_update_provider_info(self):
+        self.adapter.lun_telemetry = mock.Mock()
+        volumes = [MockOSResource(id='vol_1', provider_location='id^lun_1',
+                                  provider_id='lun_1', host='h@b#pool1')]
+        with mock.patch.object(self.adapter.client,
+                               'get_lun_contents') as get_contents:
+            self.assertEqual(([], None),
+                             self.adapter.update_provider_info(volumes, []))
+        get_contents.assert_not_called()
+        self.adapter.lun_telemetry.track.assert_called_once_with('lun_1',
+                                                                 'vol_1')
+
+    def test_update_provider_info_bulk(self):
+        self.adapter.storage_pools_map = {
+            'pool1': test_client.MockResource(name='pool1', _id='pool_1')}
+        volume_1 = MockOSResource(id='vol_1', name='volume-1',
+                                  provider_location=None, provider_id=None,
+                                  host='h@b')
+        volume_2 = MockOSResource(id='vol_2', name='lun_2',
+                                  provider_location='id^sv_2',
+                                  provider_id=None, host='h@b#pool1')
+        snapshots = [MockOSResource(id='s_1', name='snap_1', provider_id=None),
+                     MockOSResource(id='s_2', name='snap_2', provider_id=None),
+                     MockOSResource(id='s_3', name='snap_3',
+                                    provider_id='snap_3')]
+        with mock.patch.object(self.adapter.client, 'get_lun_contents',
+                               wraps=self.adapter.client.get_lun_contents
+                               ) as get_contents:
+            ret = self.adapter.update_provider_info([volume_1, volume_2],
+                                                    snapshots)
+        get_contents.assert_called_once_with(['pool_1'])
+        self.assertEqual(([{'id': 'vol_1', 'provider_id': 'sv_1'},
+                           {'id': 'vol_2', 'provider_id': 'sv_2'}],
+                          [{'id': 's_1', 'provider_id': 'snap_1'},
+                           {'id': 's_2', 'provider_id': None}]), ret)
+
+        with mock.patch.object(self.adapter.client, 'get_lun') as get_lun, \
+                mock.patch.object(self.adapter.client,
+                                  'get_pool_name') as get_pool_name:
+            self.assertEqual('sv_1', self.adapter.get_lun_id(volume_1))
+            self.assertEqual('pool1', self.adapter.get_pool_name(volume_1))
+        get_lun.assert_not_called()
+        get_pool_name.assert_not_called()
+        # The listed ones are taken once.
+        self.assertEqual('lun_4', self.adapter.get_lun_id(volume_1))
+        # Only the volumes without the location or pool are kept.
+        self.assertNotIn('lun_2', self.adapter._lun_ids)
+
+    def test_clear_listed_luns(self):
+        self.adapter._lun_ids['volume-1'] = 'sv_1'
+        self.adapter._pool_names['volume-1'] = 'pool1'
+        self.adapter.clear_listed_luns()
+        self.assertEqual({}, self.adapter._lun_ids)
+        self.assertEqual({}, self.adapter._pool_names)
+
+    def test_update_provider_info_list_failed(self):
+        volume = MockOSResource(id='vol_1', name='volume-1',
+                                provider_location=None, provider_id=None,
+                                host='h@b')
+        with mock.patch.object(self.adapter.client, 'get_lun_contents',
+                               side_effect=ex.UnityResourceNotFoundError):
+            self.assertEqual(([], None),
+                             self.adapter.update_provider_info([volume], []))
+        self.assertEqual('lun_4', self.adapter.get_lun_id(volume))
+
+    def test_makeup_model_tracked(self):
+        self.adapter.lun_telemetry = mock.Mock()
+        lun = test_client.MockResource(_id='lun_3')
+        self.adapter.makeup_model(lun, volume_id='vol_3')
+        self.adapter.lun_telemetry.track.assert_called_once_with('lun_3',
+                                                                 'vol_3')
 
     def test_serial_number(self):
         self.assertEqual('CLIENT_SERIAL', self.adapter.serial_number)
@@ -498,6 +1575,103 @@ class CommonAdapterTest(unittest.TestCase):
         volume_size = self.adapter.manage_existing_get_size(volume, ref)
         self.assertEqual(5, volume_size)
 
+    def test_get_manageable_volumes(self):
+        cinder_volumes = [MockOSResource(id='1', name='volume-1',
+                                         provider_location=None)]
+        with mock.patch.object(self.adapter.client, 'get_lun_contents',
+                               wraps=self.adapter.client.get_lun_contents
+                               ) as get_contents:
+            ret = self.adapter.get_manageable_volumes(
+                cinder_volumes, None, 10, 0, ['size'], ['desc'])
+        get_contents.assert_called_once_with(
+            [pool.get_id() for pool in
+             self.adapter.storage_pools_map.values()],
+            order_by=[('sizeTotal', 'desc'), ('id', 'asc')])
+        self.assertEqual(
+            [('sv_1', 3, False, '1'), ('sv_2', 2, True, None),
+             ('sv_3', 1, False, None), ('sv_4', 1, False, None)],
+            [(v['reference']['source-id'], v['size'], v['safe_to_manage'],
+              v['cinder_id']) for v in ret])
+        self.assertIsNone(ret[1]['reason_not_safe'])
+
+    def test_get_manageable_volumes_paged(self):
+        ret = self.adapter.get_manageable_volumes(
+            [], {'source-id': 'sv_1'}, 1, 1, ['reference'], ['asc'])
+        self.assertEqual([{'source-id': 'sv_3'}],
+                         [v['reference'] for v in ret])
+
+    def test_get_manageable_snapshots(self):
+        cinder_snapshots = [MockOSResource(id='s_1', name='snapshot-s_1',
+                                           provider_location='id^snap_1')]
+        ret = self.adapter.get_manageable_snapshots(
+            cinder_snapshots, None, 10, 0, [], [])
+        self.assertEqual(1, len(ret))
+        self.assertEqual({'source-id': 'sv_2'}, ret[0]['source_reference'])
+        self.assertEqual('s_1', ret[0]['cinder_id'])
+        self.assertFalse(ret[0]['safe_to_manage'])
+
+    def test_get_manageable_snapshots_cg_skipped(self):
+        contents = [{'id': 'snap_1', 'name': 'snap_1', 'size': units.Gi,
+                     'lun': None},
+                    {'id': 'snap_2', 'name': 'snap_2', 'size': units.Gi,
+                     'lun': {'id': 'sv_2'}}]
+        with mock.patch.object(self.adapter.client, 'get_snap_contents',
+                               return_value=iter(contents)):
+            ret = self.adapter.get_manageable_snapshots([], None, 10, 0,
+                                                        [], [])
+        self.assertEqual([{'source-id': 'snap_2'}],
+                         [entry['reference'] for entry in ret])
+
+    def test_get_manageable_snapshots_attached(self):
+        contents = [{'id': 'snap_1', 'name': 'snap_1', 'size': units.Gi,
+                     'lun': {'id': 'sv_1'},
+                     'hostAccess': [{'host': {'id': 'host_1'}}]},
+                    {'id': 'snap_2', 'name': 'snap_2', 'size': units.Gi,
+                     'lun': {'id': 'sv_2'}, 'hostAccess': []}]
+        with mock.patch.object(self.adapter.client, 'get_snap_contents',
+                               return_value=iter(contents)):
+            ret = self.adapter.get_manageable_snapshots([], None, 10, 0,
+                                                        [], [])
+        self.assertEqual([False, True],
+                         [entry['safe_to_manage'] for entry in ret])
+        self.assertEqual('Attached to hosts.', ret[0]['reason_not_safe'])
+
+    def _manage_snapshot(self, func, ref, lun_id='lun_1'):
+        snapshot = MockOSResource(name='snapshot-1')
+        snapshot.volume.provider_location = 'id^lun_1'
+        snap = mock.Mock(existed=True, size=2 * units.Gi)
+        snap.get_id.return_value = 'snap_1'
+        snap.storage_resource.get_id.return_value = lun_id
+        with mock.patch.object(self.adapter.client, 'get_snap',
+                               return_value=snap) as get_snap:
+            return func(snapshot, ref), snap, get_snap
+
+    def test_manage_existing_snapshot(self):
+        ret, snap, get_snap = self._manage_snapshot(
+            self.adapter.manage_existing_snapshot, {'source-name': 'snap'})
+        get_snap.assert_called_once_with(name='snap')
+        snap.modify.assert_called_once_with(name='snapshot-1')
+        self.assertEqual('snap_1', ret['provider_id'])
+        self.assertEqual(get_snap_pl('snap_1'), ret['provider_location'])
+
+    def test_manage_existing_snapshot_get_size(self):
+        size, _snap, get_snap = self._manage_snapshot(
+            self.adapter.manage_existing_snapshot_get_size,
+            {'source-id': 'snap_1'})
+        get_snap.assert_called_once_with(snap_id='snap_1')
+        self.assertEqual(2, size)
+
+    def test_manage_existing_snapshot_other_lun(self):
+        self.assertRaises(exception.ManageExistingInvalidReference,
+                          self._manage_snapshot,
+                          self.adapter.manage_existing_snapshot,
+                          {'source-id': 'snap_1'}, lun_id='lun_2')
+
+    def test_manage_existing_snapshot_invalid_ref(self):
+        self.assertRaises(exception.ManageExistingInvalidReference,
+                          self._manage_snapshot,
+                          self.adapter.manage_existing_snapshot, {})
+
     @patch_for_unity_adapter
     def test_create_volume_from_snapshot(self):
         lun_id = 'lun_50'
@@ -546,6 +1720,51 @@ class CommonAdapterTest(unittest.TestCase):
                 src_lun=IdMatcher(test_client.MockResource(_id=src_lun_id)))
             self.assertEqual(get_snap_lun_pl(lun_id), ret['provider_location'])
 
+    @patch_for_unity_adapter
+    def test_create_volume_from_snapshot_in_cg(self):
+        volume = MockOSResource(name='lun_50', id='lun_50',
+                                host='unity#pool1', group_id='group_1')
+        snap = MockOSResource(name='snap_50')
+        with patch_thin_clone(test_client.MockResource(_id='lun_50')), \
+                mock.patch('cinder.volume.utils.is_group_a_cg_snapshot_type',
+                           return_value=True), \
+                mock.patch.object(self.adapter.client,
+                                  'update_cg') as update_cg:
+            self.adapter.create_volume_from_snapshot(volume, snap)
+        update_cg.assert_called_once_with('group_1', ['lun_50'], [])
+
+    @patch_for_unity_adapter
+    def test_create_cloned_volume_in_cg(self):
+        volume = MockOSResource(id='lun_54', host='unity#pool1', size=3,
+                                group_id='group_2')
+        src_vref = MockOSResource(id='lun_71', name='lun_71',
+                                  provider_location=get_lun_pl('lun_71'),
+                                  volume_attachment=None, group_id='group_1')
+        with patch_dd_copy(test_client.MockResource(_id='lun_54')) as dd, \
+                patch_thin_clone(None) as tc, \
+                mock.patch('cinder.volume.utils.is_group_a_cg_snapshot_type',
+                           return_value=True), \
+                mock.patch.object(self.adapter.client, 'create_cg_snap',
+                                  wraps=self.adapter.client.create_cg_snap
+                                  ) as create_cg_snap, \
+                mock.patch.object(self.adapter.client,
+                                  'delete_snap') as delete_snap, \
+                mock.patch.object(self.adapter.client,
+                                  'update_cg') as update_cg:
+            ret = self.adapter.create_cloned_volume(volume, src_vref)
+        create_cg_snap.assert_called_once_with(
+            'group_1', snap_name='snap_clone_lun_54')
+        dd.assert_called_once_with(
+            adapter.VolumeParams(self.adapter, volume),
+            IdMatcher(test_client.MockResource(
+                _id='snap_clone_lun_54_lun_71')),
+            src_lun=IdMatcher(test_client.MockResource(_id='lun_71')))
+        self.assertFalse(tc.called)
+        self.assertEqual('snap_clone_lun_54',
+                         delete_snap.call_args[0][0].get_id())
+        update_cg.assert_called_once_with('group_2', ['lun_54'], [])
+        self.assertEqual(get_lun_pl('lun_54'), ret['provider_location'])
+
     @patch_for_unity_adapter
     def test_dd_copy_with_src_lun(self):
         lun_id = 'lun_56'
@@ -602,9 +1821,70 @@ class CommonAdapterTest(unittest.TestCase):
         volume = MockOSResource(name=lun_id, id=lun_id, size=1,
                                 provider_location=get_snap_lun_pl(lun_id))
         src_snap = test_client.MockResource(name=src_snap_id, _id=src_snap_id)
-        ret = self.adapter._thin_clone(volume, src_snap)
+        ret = self.adapter._thin_clone(
+            adapter.VolumeParams(self.adapter, volume), src_snap)
         self.assertEqual(IdMatcher(test_client.MockResource(_id=lun_id)), ret)
 
+    @patch_for_unity_adapter
+    def test_thin_clone_compressed(self):
+        lun_id = 'lun_60'
+        src_snap_id = 'snap_61'
+        volume = MockOSResource(name=lun_id, id=lun_id, size=1,
+                                provider_location=get_snap_lun_pl(lun_id))
+        src_snap = test_client.MockResource(name=src_snap_id, _id=src_snap_id)
+        cloned = mock.Mock(is_compression_enabled=False)
+        with mock.patch.object(adapter.utils, 'get_extra_spec',
+                               side_effect=lambda vol, key: {
+                                   'provisioning:type': 'compressed'}.get(
+                                       key)), \
+                mock.patch.object(self.adapter.client, 'thin_clone',
+                                  return_value=cloned), \
+                patch_dd_copy(None) as dd:
+            ret = self.adapter._thin_clone(
+                adapter.VolumeParams(self.adapter, volume), src_snap)
+        cloned.modify.assert_called_once_with(is_compression=True)
+        self.assertFalse(dd.called)
+        self.assertEqual(cloned, ret)
+
+    @patch_for_unity_adapter
+    def test_thin_clone_compression_not_modified(self):
+        lun_id = 'lun_60'
+        src_snap_id = 'snap_61'
+        volume = MockOSResource(name=lun_id, id=lun_id, size=1,
+                                provider_location=get_snap_lun_pl(lun_id))
+        src_snap = test_client.MockResource(name=src_snap_id, _id=src_snap_id)
+        cloned = mock.Mock(is_compression_enabled=True)
+        cloned.get_id.return_value = 'lun_64'
+        cloned.modify.side_effect = ex.StoropsException
+        new_dd_lun = test_client.MockResource(name='lun_65')
+        with mock.patch.object(self.adapter.client, 'thin_clone',
+                               return_value=cloned), \
+                mock.patch.object(self.adapter.client,
+                                  'delete_lun') as delete_lun, \
+                patch_dd_copy(new_dd_lun) as dd:
+            vol_params = adapter.VolumeParams(self.adapter, volume)
+            ret = self.adapter._thin_clone(vol_params, src_snap)
+        cloned.modify.assert_called_once_with(is_compression=False)
+        delete_lun.assert_called_once_with('lun_64')
+        dd.assert_called_once_with(vol_params, src_snap, src_lun=None,
+                                   sp=None)
+        self.assertEqual(new_dd_lun, ret)
+
+    @patch_for_unity_adapter
+    def test_thin_clone_cg_member(self):
+        volume = MockOSResource(name='lun_60', id='lun_60', size=1)
+        src_snap = test_client.MockResource(name='snap_61', _id='snap_61')
+        new_dd_lun = test_client.MockResource(name='lun_65')
+        with mock.patch.object(
+                self.adapter.client, 'thin_clone',
+                side_effect=ex.UnityCGMemberActionNotSupportError), \
+                patch_dd_copy(new_dd_lun) as dd:
+            vol_params = adapter.VolumeParams(self.adapter, volume)
+            ret = self.adapter._thin_clone(vol_params, src_snap)
+        dd.assert_called_once_with(vol_params, src_snap, src_lun=None,
+                                   sp=None)
+        self.assertEqual(new_dd_lun, ret)
+
     @patch_for_unity_adapter
     def test_thin_clone_downgraded_with_src_lun(self):
         lun_id = 'lun_60'
@@ -623,7 +1903,8 @@ class CommonAdapterTest(unittest.TestCase):
             vol_params = adapter.VolumeParams(self.adapter, volume)
             vol_params.name = 'hidden-{}'.format(volume.name)
             vol_params.description = 'hidden-{}'.format(volume.description)
-            dd.assert_called_with(vol_params, src_snap, src_lun=src_lun)
+            dd.assert_called_with(vol_params, src_snap, src_lun=src_lun,
+                                  sp=None)
             mocked_storops.TCHelper.notify.assert_called_with(src_lun,
                                                               'DD_COPY',
                                                               new_dd_lun)
@@ -644,12 +1925,36 @@ class CommonAdapterTest(unittest.TestCase):
             vol_params = adapter.VolumeParams(self.adapter, volume)
             vol_params.name = 'hidden-{}'.format(volume.name)
             vol_params.description = 'hidden-{}'.format(volume.description)
-            dd.assert_called_with(vol_params, src_snap, src_lun=None)
+            dd.assert_called_with(vol_params, src_snap, src_lun=None,
+                                  sp=None)
             mocked_storops.TCHelper.notify.assert_called_with(src_snap,
                                                               'DD_COPY',
                                                               new_dd_lun)
         self.assertEqual(IdMatcher(test_client.MockResource(_id=lun_id)), ret)
 
+    @patch_for_unity_adapter
+    def test_thin_clone_downgraded_sp_chosen_once(self):
+        lun_id = 'lun_60'
+        src_snap_id = 'snap_62'
+        volume = MockOSResource(name=lun_id, id=lun_id, size=1,
+                                provider_location=get_snap_lun_pl(lun_id))
+        src_snap = test_client.MockResource(name=src_snap_id, _id=src_snap_id)
+        new_dd_lun = test_client.MockResource(name='lun_63')
+        self.adapter.sp_balancer = mock.Mock()
+        self.adapter.sp_balancer.choose.return_value = 'spb'
+        with patch_storops(), patch_dd_copy(new_dd_lun) as dd, \
+                mock.patch.object(self.adapter.client, 'thin_clone',
+                                  side_effect=[
+                                      ex.UnityThinCloneLimitExceededError,
+                                      test_client.MockResource(_id=lun_id)]
+                                  ) as thin_clone:
+            self.adapter._thin_clone(
+                adapter.VolumeParams(self.adapter, volume), src_snap)
+        self.assertEqual(1, self.adapter.sp_balancer.choose.call_count)
+        self.assertEqual('spb', dd.call_args[1]['sp'])
+        self.assertEqual(['spb', 'spb'],
+                         [c[1]['sp'] for c in thin_clone.call_args_list])
+
     def test_extend_volume_error(self):
         def f():
             volume = MockOSResource(id='l56',
@@ -658,6 +1963,50 @@ class CommonAdapterTest(unittest.TestCase):
 
         self.assertRaises(ex.ExtendLunError, f)
 
+    def test_extend_volume_density_based_qos(self):
+        volume = MockOSResource(id='l56', project_id='project_1',
+                                provider_location=get_lun_pl('lun56'))
+        qos_specs = {'id': 'qos_1', 'maxIOPS': None, 'maxBWS': None,
+                     'maxIOPSDensity': 10}
+        with mock.patch.object(adapter.utils, 'get_backend_qos_specs',
+                               return_value=qos_specs), \
+                mock.patch.object(self.adapter.client,
+                                  'get_io_limit_policy') as get_qos, \
+                mock.patch.object(self.adapter.client,
+                                  'update_lun_io_limit_policy') as update_qos:
+            self.adapter.extend_volume(volume, 10)
+        get_qos.assert_called_once_with(qos_specs, project_id='project_1')
+        lun, policy = update_qos.call_args[0]
+        self.assertEqual('lun56', lun.get_id())
+        self.assertEqual(get_qos.return_value, policy)
+
+    def test_extend_volume_qos_not_modified(self):
+        volume = MockOSResource(id='l56', project_id='project_1',
+                                provider_location=get_lun_pl('lun56'))
+        qos_specs = {'id': 'qos_1', 'maxIOPS': None, 'maxBWS': None,
+                     'maxIOPSDensity': 10}
+        for err in (ex.UnityNothingToModifyError, ex.StoropsException):
+            with mock.patch.object(adapter.utils, 'get_backend_qos_specs',
+                                   return_value=qos_specs), \
+                    mock.patch.object(self.adapter.client,
+                                      'get_io_limit_policy'), \
+                    mock.patch.object(self.adapter.client,
+                                      'extend_lun') as extend_lun, \
+                    mock.patch.object(self.adapter.client,
+                                      'update_lun_io_limit_policy',
+                                      side_effect=err):
+                self.adapter.extend_volume(volume, 10)
+            extend_lun.assert_called_once_with('lun56', 10)
+
+    @patch_for_unity_adapter
+    def test_extend_volume_absolute_qos(self):
+        volume = MockOSResource(id='l56',
+                                provider_location=get_lun_pl('lun56'))
+        with mock.patch.object(self.adapter.client,
+                               'update_lun_io_limit_policy') as update_qos:
+            self.adapter.extend_volume(volume, 10)
+        self.assertFalse(update_qos.called)
+
     def test_extend_volume_no_id(self):
         def f():
             volume = MockOSResource(provider_location='type^lun')
@@ -686,6 +2035,538 @@ class CommonAdapterTest(unittest.TestCase):
             self.adapter.normalize_config(config)
 
 
+class CloneSnapshotsTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.create_snap.side_effect = (
+            lambda lun_id, name: test_client.MockResource(name=name, _id=name))
+
+    def test_use_not_shared(self):
+        snaps = adapter.CloneSnapshots(self.client)
+        with snaps.use('lun_1', 'snap_a') as snap_a:
+            with snaps.use('lun_1', 'snap_b') as snap_b:
+                self.assertEqual('snap_a', snap_a.name)
+                self.assertEqual('snap_b', snap_b.name)
+        self.assertEqual(2, self.client.create_snap.call_count)
+        self.assertEqual(2, self.client.delete_snap.call_count)
+
+    def test_use_shared(self):
+        snaps = adapter.CloneSnapshots(self.client, window=60)
+        with snaps.use('lun_1', 'snap_a') as snap_a:
+            with snaps.use('lun_1', 'snap_b') as snap_b:
+                self.assertIs(snap_a, snap_b)
+            self.assertFalse(self.client.delete_snap.called)
+        self.client.create_snap.assert_called_once_with('lun_1', 'snap_a')
+        self.client.delete_snap.assert_called_once_with(snap_a)
+
+    def test_use_shared_other_source(self):
+        snaps = adapter.CloneSnapshots(self.client, window=60)
+        with snaps.use('lun_1', 'snap_a') as snap_a:
+            with snaps.use('lun_2', 'snap_b') as snap_b:
+                self.assertEqual('snap_b', snap_b.name)
+        self.assertEqual('snap_a', snap_a.name)
+        self.assertEqual(2, self.client.delete_snap.call_count)
+
+    def test_use_shared_expired(self):
+        snaps = adapter.CloneSnapshots(self.client, window=60)
+        with mock.patch.object(adapter, 'time') as mocked_time:
+            mocked_time.time.return_value = 0
+            with snaps.use('lun_1', 'snap_a') as snap_a:
+                mocked_time.time.return_value = 61
+                with snaps.use('lun_1', 'snap_b') as snap_b:
+                    self.assertEqual('snap_b', snap_b.name)
+                self.client.delete_snap.assert_called_once_with(snap_b)
+        self.assertEqual('snap_a', snap_a.name)
+        self.assertEqual(2, self.client.delete_snap.call_count)
+
+    def test_use_shared_after_release(self):
+        snaps = adapter.CloneSnapshots(self.client, window=60)
+        with snaps.use('lun_1', 'snap_a'):
+            pass
+        with snaps.use('lun_1', 'snap_b') as snap_b:
+            self.assertEqual('snap_b', snap_b.name)
+        self.assertEqual(2, self.client.create_snap.call_count)
+
+    def test_attach_shared(self):
+        snaps = adapter.CloneSnapshots(self.client, window=60)
+        snap = test_client.MockResource(name='snap_a', _id='snap_a')
+        connect = mock.MagicMock()
+        connect.return_value.__enter__.return_value = 'conn'
+        with snaps.attach(snap, connect) as conn_a:
+            with snaps.attach(snap, connect) as conn_b:
+                self.assertEqual('conn', conn_a)
+                self.assertEqual('conn', conn_b)
+            self.assertFalse(connect.return_value.__exit__.called)
+        connect.assert_called_once_with()
+        connect.return_value.__exit__.assert_called_once_with(None, None,
+                                                              None)
+
+
+class WarmLunsTest(unittest.TestCase):
+    def setUp(self):
+        self.adapter = mock.Mock(backend_tag='tag')
+        self.adapter.choose_sp.return_value = 'spb'
+        self.client = self.adapter.client
+        self.client.create_lun.side_effect = (
+            lambda name, size, pool, description, sp: (
+                test_client.MockResource(name=name, _id=name)))
+        self.pool = test_client.MockResource(name='pool1', _id='pool_1')
+        self.warm_luns = adapter.WarmLuns(self.adapter, [1, 10], 2, 20)
+
+    def test_refill(self):
+        self.warm_luns.refill([self.pool])
+        self.assertEqual(4, self.client.create_lun.call_count)
+        self.assertEqual((4, 22), self.warm_luns.reserved(self.pool))
+        name = self.client.create_lun.call_args[1]['name']
+        self.assertTrue(name.startswith('warm-tag-pool_1-10-'))
+        self.assertEqual('spb', self.client.create_lun.call_args[1]['sp'])
+        self.assertEqual(4, self.adapter.choose_sp.call_count)
+
+    def test_refill_taken(self):
+        self.warm_luns.refill([self.pool])
+        lun = self.warm_luns.take(self.pool, 10)
+        self.assertTrue(lun.name.startswith('warm-tag-pool_1-10-'))
+        self.assertEqual((3, 12), self.warm_luns.reserved(self.pool))
+        self.warm_luns.refill([self.pool])
+        self.assertEqual(5, self.client.create_lun.call_count)
+        self.assertEqual((4, 22), self.warm_luns.reserved(self.pool))
+
+    def test_refill_pool_short_of_capacity(self):
+        self.pool.size_free = self.pool.size_total // 10
+        self.warm_luns.refill([self.pool])
+        self.assertFalse(self.client.create_lun.called)
+
+    def test_take_none(self):
+        self.assertIsNone(self.warm_luns.take(self.pool, 1))
+
+    def test_load(self):
+        self.client.get_lun_contents.return_value = [
+            {'id': 'lun_1', 'name': 'warm-tag-pool_1-1-abc'},
+            {'id': 'lun_2', 'name': 'warm-tag-pool_2-1-abc'},
+            {'id': 'lun_3', 'name': 'warm-tag-unknown'}]
+        self.warm_luns.load(['pool_1', 'pool_2'])
+        self.client.get_lun_contents.assert_called_once_with(
+            ['pool_1', 'pool_2'], name_prefix='warm-tag-')
+        self.assertEqual(
+            [mock.call(lun_id='lun_1'), mock.call(lun_id='lun_2')],
+            self.client.get_lun.call_args_list)
+        self.assertEqual((1, 1), self.warm_luns.reserved(self.pool))
+        self.warm_luns.refill([self.pool])
+        self.assertEqual(3, self.client.create_lun.call_count)
+
+    def test_load_size_not_configured(self):
+        self.client.get_lun_contents.return_value = [
+            {'id': 'lun_1', 'name': 'warm-tag-pool_1-1-abc'},
+            {'id': 'lun_2', 'name': 'warm-tag-pool_1-5-abc'}]
+        self.warm_luns.load(['pool_1'])
+        self.client.delete_lun.assert_called_once_with('lun_2')
+        self.assertEqual([mock.call(lun_id='lun_1')],
+                         self.client.get_lun.call_args_list)
+        self.assertEqual((1, 1), self.warm_luns.reserved(self.pool))
+
+
+class PerfSamplerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.get_sp_utilization.return_value = {'spa': 20.0,
+                                                       'spb': 60.0}
+        self.sampler = adapter.PerfSampler(self.client, 0.5)
+        self.pool = test_client.MockResource('pool1', 'pool_1')
+
+    def test_sample(self):
+        self.client.get_lun_perf.return_value = {
+            'lun_1': ('pool_1', 100, 10, 200),
+            'lun_2': ('pool_1', 300, 30, 600),
+            'lun_3': ('pool_2', 1000, 100, 1000)}
+        self.sampler.sample(['pool_1'])
+        self.client.get_lun_perf.assert_called_once_with(['pool_1'])
+        self.assertEqual({'perf_iops': 400, 'perf_bandwidth_mbps': 40,
+                          'perf_response_time_us': 500,
+                          'perf_sp_utilization': 60},
+                         self.sampler.get(self.pool))
+
+    def test_sample_smoothed(self):
+        self.sampler.sample(['pool_1'],
+                            lun_perf={'lun_1': ('pool_1', 100, 10, 200)})
+        self.client.get_sp_utilization.return_value = {'spa': 20.0}
+        self.sampler.sample(['pool_1'], lun_perf={})
+        self.assertEqual({'perf_iops': 50, 'perf_bandwidth_mbps': 5,
+                          'perf_response_time_us': 100,
+                          'perf_sp_utilization': 40},
+                         self.sampler.get(self.pool))
+        self.assertFalse(self.client.get_lun_perf.called)
+
+    def test_sample_ports(self):
+        sampler = adapter.PerfSampler(self.client, 0.5, sample_ports=True)
+        self.client.get_ethernet_port_load.return_value = {'spa_eth0': 100.0}
+        sampler.sample([], lun_perf={})
+        self.client.get_ethernet_port_load.return_value = {'spa_eth0': 300.0,
+                                                           'spb_eth0': 50.0}
+        sampler.sample([], lun_perf={})
+        self.assertEqual({'spa_eth0': 200.0, 'spb_eth0': 50.0},
+                         sampler.get_port_load())
+
+    def test_sample_ports_disabled(self):
+        self.sampler.sample([], lun_perf={})
+        self.assertEqual({}, self.sampler.get_port_load())
+        self.assertFalse(self.client.get_ethernet_port_load.called)
+
+    def test_get_not_sampled(self):
+        self.assertEqual({}, self.sampler.get(self.pool))
+
+
+class SpBalancerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.get_sp_lun_counts.return_value = {'spa': 2, 'spb': 2}
+        self.client.get_sp_utilization.return_value = {}
+        self.balancer = adapter.SpBalancer(self.client)
+
+    def test_choose_not_refreshed(self):
+        self.assertIsNone(self.balancer.choose())
+
+    def test_choose_by_count(self):
+        self.client.get_sp_lun_counts.return_value = {'spa': 3, 'spb': 1}
+        self.balancer.refresh(['pool_1'])
+        self.client.get_sp_lun_counts.assert_called_once_with(['pool_1'])
+        self.assertEqual(['spb', 'spb', 'spa', 'spb'],
+                         [self.balancer.choose() for _i in range(4)])
+        self.assertEqual({'spa': 4, 'spb': 4}, self.balancer.get_stats())
+
+    def test_choose_by_utilization(self):
+        self.client.get_sp_utilization.return_value = {'spa': 80.0,
+                                                       'spb': 10.0}
+        self.balancer.refresh(['pool_1'])
+        self.assertEqual('spb', self.balancer.choose())
+
+
+class LunTelemetryTest(unittest.TestCase):
+    def setUp(self):
+        self.telemetry = adapter.LunTelemetry(2)
+        self.telemetry.track('lun_1', 'vol_1')
+        self.telemetry.track('lun_2', 'vol_2')
+
+    def test_top(self):
+        self.telemetry.record({'lun_1': ('pool_1', 100, 10, 200),
+                               'lun_2': ('pool_1', 300, 30, 600),
+                               'lun_3': ('pool_1', 1000, 100, 1000)})
+        self.assertEqual(
+            [{'volume_id': 'vol_2', 'iops': 300, 'bandwidth_mbps': 30,
+              'response_time_us': 600},
+             {'volume_id': 'vol_1', 'iops': 100, 'bandwidth_mbps': 10,
+              'response_time_us': 200}],
+            self.telemetry.top(5))
+        self.assertEqual(['vol_2'],
+                         [v['volume_id'] for v in self.telemetry.top(1)])
+
+    def test_ring_wrap_around(self):
+        for iops in (100, 200, 600):
+            self.telemetry.record({'lun_1': ('pool_1', iops, 0, 0)})
+        # Only the latest 2 samples are kept.
+        self.assertEqual(400, self.telemetry.top(1)[0]['iops'])
+
+    def test_partially_filled(self):
+        self.telemetry.record({'lun_1': ('pool_1', 100, 10, 200)})
+        self.assertEqual(100, self.telemetry.top(1)[0]['iops'])
+
+    def test_lun_gone(self):
+        self.telemetry.record({'lun_1': ('pool_1', 100, 10, 200)})
+        for _i in range(adapter.LunTelemetry.MAX_MISSES):
+            self.telemetry.record({})
+        self.assertEqual([], self.telemetry.top(1))
+
+    def test_sample_missed(self):
+        self.telemetry.record({'lun_1': ('pool_1', 100, 10, 200)})
+        for _i in range(adapter.LunTelemetry.MAX_MISSES - 1):
+            self.telemetry.record({})
+        self.assertEqual(100, self.telemetry.top(1)[0]['iops'])
+        # The misses in a row are counted again after a sample.
+        self.telemetry.record({'lun_1': ('pool_1', 300, 10, 200)})
+        for _i in range(adapter.LunTelemetry.MAX_MISSES - 1):
+            self.telemetry.record({})
+        self.assertEqual(200, self.telemetry.top(1)[0]['iops'])
+
+    def test_untrack(self):
+        self.telemetry.record({'lun_1': ('pool_1', 100, 10, 200)})
+        self.telemetry.untrack('lun_1')
+        self.assertEqual([], self.telemetry.top(1))
+
+
+class ZoneMappingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.lookup = mock.Mock()
+        self.lookup.get_device_mapping_from_network.return_value = {
+            'san_1': {'initiator_port_wwn_list': ['i_1'],
+                      'target_port_wwn_list': ['t_1']}}
+        self.cache = adapter.ZoneMappingCache(self.lookup, 60)
+
+    def test_cached(self):
+        ret = self.cache.get_device_mapping_from_network(['i_1'],
+                                                         ['t_1', 't_2'])
+        ret['san_1']['target_port_wwn_list'].append('changed')
+        self.assertEqual(
+            {'san_1': {'initiator_port_wwn_list': ['i_1'],
+                       'target_port_wwn_list': ['t_1']}},
+            self.cache.get_device_mapping_from_network(['I_1'],
+                                                       ['t_2', 't_1']))
+        self.assertEqual(
+            1, self.lookup.get_device_mapping_from_network.call_count)
+
+    def test_different_targets(self):
+        self.cache.get_device_mapping_from_network(['i_1'], ['t_1'])
+        self.cache.get_device_mapping_from_network(['i_1'], ['t_2'])
+        self.assertEqual(
+            2, self.lookup.get_device_mapping_from_network.call_count)
+
+    @mock.patch('time.time')
+    def test_expired(self, mock_time):
+        mock_time.return_value = 100
+        self.cache.get_device_mapping_from_network(['i_1'], ['t_1'])
+        mock_time.return_value = 161
+        self.cache.get_device_mapping_from_network(['i_1'], ['t_1'])
+        self.assertEqual(
+            2, self.lookup.get_device_mapping_from_network.call_count)
+
+    def test_invalidate(self):
+        self.cache.get_device_mapping_from_network(['i_1', 'i_2'], ['t_1'])
+        self.cache.get_device_mapping_from_network(['i_3'], ['t_1'])
+        self.cache.invalidate(['I_2'])
+        self.cache.get_device_mapping_from_network(['i_1', 'i_2'], ['t_1'])
+        self.cache.get_device_mapping_from_network(['i_3'], ['t_1'])
+        self.assertEqual(
+            3, self.lookup.get_device_mapping_from_network.call_count)
+
+
+class DeferredDeletesTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'unity', 'deferred_deletes')
+        self.client = mock.Mock()
+        self.client.get_lun_contents.return_value = []
+        self.client.get_snap_contents.return_value = []
+        self.deletes = adapter.DeferredDeletes(self.client, self.path, 1,
+                                               'tag')
+        self.deletes.load(['pool_1'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _saved(self):
+        with open(self.path) as f:
+            return [(e['type'], e['id']) for e in json.load(f)]
+
+    def test_add_saved(self):
+        self.deletes.add('lun', 'lun_1')
+        self.deletes.add('snap', 'snap_1', even_attached=True)
+        self.assertEqual([('lun', 'lun_1'), ('snap', 'snap_1')],
+                         self._saved())
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+    def test_load(self):
+        self.deletes.add('lun', 'lun_1')
+        self.client.get_lun_contents.return_value = [
+            {'id': 'lun_1', 'name': 'tombstone-tag-lun_1'},
+            {'id': 'lun_2', 'name': 'tombstone-tag-lun_2'}]
+        self.client.get_snap_contents.return_value = [
+            {'id': 'snap_1', 'name': 'tombstone-tag-snap_1'}]
+        self.client.get_lun.return_value = mock.Mock(is_thin_clone=True)
+        deletes = adapter.DeferredDeletes(self.client, self.path, 1, 'tag')
+        deletes.load(['pool_1'], even_attached=True)
+        self.client.get_lun_contents.assert_called_with(
+            ['pool_1'], name_prefix='tombstone-tag-')
+        self.client.get_snap_contents.assert_called_with(
+            ['pool_1'], name_prefix='tombstone-tag-')
+        self.client.get_lun.assert_called_once_with(lun_id='lun_2')
+        self.assertEqual(3, deletes.pending)
+        self.assertEqual([('lun', 'lun_1'), ('lun', 'lun_2'),
+                          ('snap', 'snap_1')], self._saved())
+        with open(self.path) as f:
+            self.assertTrue(json.load(f)[2]['even_attached'])
+
+    def test_save_error(self):
+        with mock.patch.object(adapter.os, 'fsync', side_effect=OSError):
+            self.deletes.add('lun', 'lun_1')
+        self.assertEqual(1, self.deletes.pending)
+
+    def test_reap_order(self):
+        self.deletes.add('lun', 'lun_base')
+        self.deletes.add('lun', 'lun_clone', is_clone=True)
+        self.deletes.add('snap', 'snap_1')
+        for _i in range(3):
+            self.deletes.reap()
+        self.client.get_snap.assert_called_once_with(snap_id='snap_1')
+        self.client.delete_snap.assert_called_once_with(
+            self.client.get_snap.return_value, even_attached=False)
+        self.assertEqual([mock.call('lun_clone'), mock.call('lun_base')],
+                         self.client.delete_lun.call_args_list)
+        self.assertEqual(0, self.deletes.pending)
+        self.assertEqual([], self._saved())
+
+    def test_reap_retry(self):
+        self.client.delete_lun.side_effect = [ex.StoropsException, None]
+        self.deletes.add('lun', 'lun_1')
+        self.deletes.reap()
+        self.assertEqual(1, self.deletes.pending)
+        self.deletes.reap()
+        self.assertEqual(0, self.deletes.pending)
+        self.assertEqual(2, self.client.delete_lun.call_count)
+
+    def test_reap_retry_after_others(self):
+        self.client.delete_lun.side_effect = [
+            ex.StoropsException, ex.StoropsException, None, None]
+        self.deletes.add('lun', 'lun_1')
+        self.deletes.reap()
+        self.deletes.reap()
+        self.deletes.add('lun', 'lun_2')
+        self.deletes.reap()
+        self.assertEqual(1, self.deletes.pending)
+        self.deletes.reap()
+        self.assertEqual(0, self.deletes.pending)
+        self.assertEqual([mock.call('lun_1'), mock.call('lun_1'),
+                          mock.call('lun_2'), mock.call('lun_1')],
+                         self.client.delete_lun.call_args_list)
+
+    def test_reap_empty(self):
+        self.deletes.reap()
+        self.assertFalse(self.client.delete_lun.called)
+
+
+def mock_image_lun(name, _id, size_gb=5, clones=0):
+    lun = mock.Mock(existed=True, total_size_gb=size_gb,
+                    family_clone_count=clones)
+    lun.name = name
+    lun.get_id.return_value = _id
+    return lun
+
+
+@mock.patch.object(adapter, 'storops_ex', new=ex)
+@mock.patch('cinder.utils.brick_get_connector_properties',
+            new=get_connector_properties)
+@mock.patch.object(adapter.image_utils, 'fetch_to_raw')
+class ImageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.adapter = mock.Mock()
+        self.adapter.choose_sp.return_value = 'spb'
+        self.client = self.adapter.client
+        self.client.get_lun_contents.return_value = []
+        self.tmp_lun = mock_image_lun('tmp-image-pool_1-img_1', 'lun_2')
+        self.client.create_lun.return_value = self.tmp_lun
+        self.vol_params = mock.Mock(
+            pool=test_client.MockResource(name='pool1', _id='pool_1'),
+            size=5, description='desc', io_limit_policy=None,
+            tiering_policy=None)
+        self.vol_params.name = 'vol_1'
+        self.cache = adapter.ImageCache(self.adapter, 3)
+
+    def clone(self):
+        return self.cache.clone(None, self.vol_params, {'id': 'img_1'}, None)
+
+    def test_clone_cached(self, fetch):
+        image_lun = mock_image_lun('image-pool_1-img_1', 'lun_1', size_gb=3)
+        self.client.get_lun.return_value = image_lun
+        self.assertIs(self.client.thin_clone.return_value, self.clone())
+        self.client.thin_clone.assert_called_once_with(
+            image_lun, 'vol_1', description='desc', io_limit_policy=None,
+            new_size_gb=5, tiering_policy=None, sp='spb')
+        self.assertFalse(self.client.create_lun.called)
+        self.assertFalse(fetch.called)
+
+    def test_clone_not_cached(self, fetch):
+        self.client.get_lun.return_value = None
+        self.clone()
+        self.client.create_lun.assert_called_once_with(
+            name='tmp-image-pool_1-img_1', size=5, pool=self.vol_params.pool,
+            description='Image cache of img_1.')
+        fetch.assert_called_once_with(None, None, 'img_1', mock.ANY, mock.ANY,
+                                      size=5)
+        self.tmp_lun.modify.assert_called_once_with(
+            name='image-pool_1-img_1')
+        self.assertIs(self.tmp_lun, self.client.thin_clone.call_args[0][0])
+
+    def test_clone_sized_by_image(self, fetch):
+        self.client.get_lun.return_value = None
+        self.cache.clone(None, self.vol_params,
+                         {'id': 'img_1', 'virtual_size': 2 * units.Gi + 1},
+                         None)
+        self.client.create_lun.assert_called_once_with(
+            name='tmp-image-pool_1-img_1', size=3, pool=self.vol_params.pool,
+            description='Image cache of img_1.')
+
+    def test_clone_image_larger_than_volume(self, fetch):
+        self.assertIsNone(self.cache.clone(
+            None, self.vol_params, {'id': 'img_1', 'disk_format': 'raw',
+                                    'size': 6 * units.Gi}, None))
+        self.assertFalse(self.client.get_lun.called)
+
+    def test_clone_fill_failed(self, fetch):
+        self.client.get_lun.return_value = None
+        fetch.side_effect = ex.StoropsException
+        self.assertRaises(ex.StoropsException, self.clone)
+        self.client.delete_lun.assert_called_once_with('lun_2')
+        self.assertFalse(self.client.thin_clone.called)
+
+    def test_clone_smaller_volume(self, fetch):
+        self.client.get_lun.return_value = mock_image_lun(
+            'image-pool_1-img_1', 'lun_1', size_gb=10)
+        self.assertIsNone(self.clone())
+        self.assertFalse(self.client.thin_clone.called)
+
+    def test_clone_rollover(self, fetch):
+        full_lun = mock_image_lun('image-pool_1-img_1', 'lun_1')
+        self.client.get_lun.return_value = full_lun
+        cloned = mock.Mock()
+        self.client.thin_clone.side_effect = [
+            ex.UnityThinCloneLimitExceededError, cloned]
+        self.assertIs(cloned, self.clone())
+        full_lun.modify.assert_called_once_with(
+            name='image-pool_1-img_1-lun_1')
+        self.assertTrue(fetch.called)
+        self.assertIs(self.tmp_lun, self.client.thin_clone.call_args[0][0])
+
+    def test_clone_rollover_by_others(self, fetch):
+        full_lun = mock_image_lun('image-pool_1-img_1', 'lun_1')
+        new_lun = mock_image_lun('image-pool_1-img_1', 'lun_3')
+        self.client.get_lun.side_effect = [full_lun, new_lun]
+        self.client.thin_clone.side_effect = [
+            ex.UnityThinCloneLimitExceededError, mock.Mock()]
+        self.clone()
+        self.assertFalse(full_lun.modify.called)
+        self.assertFalse(fetch.called)
+        self.assertIs(new_lun, self.client.thin_clone.call_args[0][0])
+
+    def _mock_pool_luns(self, luns):
+        self.client.get_lun_contents.return_value = [
+            {'id': lun.get_id(), 'name': lun.name} for lun in luns]
+        luns = {lun.get_id(): lun for lun in luns}
+        self.client.get_lun.side_effect = (
+            lambda name=None, lun_id=None: luns.get(lun_id))
+
+    def test_evict(self, fetch):
+        lun_a = mock_image_lun('image-pool_1-img_a', 'lun_a')
+        lun_b = mock_image_lun('image-pool_1-img_b', 'lun_b')
+        retired = mock_image_lun('image-pool_1-img_c-lun_c', 'lun_c',
+                                 clones=2)
+        self.cache._touch('image-pool_1-img_a')
+        self.cache._touch('image-pool_1-img_b')
+        self.tmp_lun.name = 'image-pool_1-img_1'
+        self._mock_pool_luns([lun_b, retired, lun_a, self.tmp_lun])
+        self.clone()
+        self.client.get_lun_contents.assert_called_once_with(
+            ['pool_1'], name_prefix='image-pool_1-')
+        self.client.delete_lun.assert_called_once_with('lun_a')
+
+    def test_evict_not_needed(self, fetch):
+        self._mock_pool_luns([mock_image_lun('image-pool_1-img_a', 'lun_a')])
+        self.clone()
+        self.assertFalse(self.client.delete_lun.called)
+
+    def test_evict_not_filled(self, fetch):
+        self.client.get_lun.return_value = mock_image_lun(
+            'image-pool_1-img_1', 'lun_1')
+        self.clone()
+        self.assertFalse(self.client.get_lun_contents.called)
+
+
 class FCAdapterTest(unittest.TestCase):
     def setUp(self):
         self.adapter = mock_adapter(adapter.FCAdapter)
@@ -740,6 +2621,68 @@ class FCAdapterTest(unittest.TestCase):
         wwns = ['8899AABBCCDDEEFF', '8899AABBCCDDFFEE']
         self.assertListEqual(wwns, ret['target_wwn'])
 
+    def test_get_connection_info_owner_sp_first(self):
+        self.adapter.lookup_service = None
+        host = test_client.MockResource('host1')
+        ret = self.adapter.get_connection_info(10, host, {}, owner_sp='spb')
+        self.assertListEqual(['8899AABBCCDDFFEE', '8899AABBCCDDEEFF'],
+                             ret['target_wwn'])
+
+    def test_get_connection_info_max_targets(self):
+        self.adapter.config.unity_fc_max_targets = 2
+        targets = {'8899AABBCCDD00%02d' % i: 'spa' if i % 2 else 'spb'
+                   for i in range(8)}
+        fabrics = {'san_1': ['8899AABBCCDD00%02d' % i for i in range(4)],
+                   'san_2': ['8899AABBCCDD00%02d' % i for i in range(4, 8)]}
+        mapping = {san: {'initiator_port_wwn_list': ['200000051e55a100'],
+                         'target_port_wwn_list': wwns}
+                   for san, wwns in fabrics.items()}
+        host = test_client.MockResource('host1')
+        connector = {'host': 'host1', 'wwpns': ['200000051e55a100']}
+        with mock.patch.object(self.adapter.client, 'get_fc_targets',
+                               return_value=targets), \
+                mock.patch.object(self.adapter.lookup_service,
+                                  'get_device_mapping_from_network',
+                                  return_value=mapping):
+            ret = self.adapter.get_connection_info(10, host, connector,
+                                                   owner_sp='spa')
+        wwns = ret['target_wwn']
+        self.assertEqual(2, len(wwns))
+        self.assertEqual(['spa', 'spb'], [targets[wwn] for wwn in wwns])
+        self.assertEqual(set(['san_1', 'san_2']),
+                         set(san for san in fabrics for wwn in wwns
+                             if wwn in fabrics[san]))
+        # Only the selected target of each fabric is zoned.
+        self.assertEqual(
+            1, len(ret['initiator_target_map']['200000051e55a100']))
+
+    def test_invalidate_zone_mapping(self):
+        self.adapter.lookup_service = mock.Mock(spec=adapter.ZoneMappingCache)
+        self.adapter.invalidate_zone_mapping({'wwpns': ['abc']})
+        self.adapter.lookup_service.invalidate.assert_called_once_with(
+            ['abc'])
+        self.adapter.invalidate_zone_mapping(None)
+
+    def test_do_setup_zone_cache(self):
+        config = MockConfig()
+        config.unity_fc_zone_cache_ttl = 600
+        ret = adapter.FCAdapter()
+        ret._client = MockClient()
+        with mock.patch('cinder.volume.drivers.dell_emc.unity.adapter.'
+                        'CommonAdapter.validate_ports'), \
+                mock.patch.object(adapter.utils, 'create_lookup_service',
+                                  return_value=MockLookupService()), \
+                patch_storops():
+            ret.do_setup(MockDriver(), config)
+        self.assertIsInstance(ret.lookup_service, adapter.ZoneMappingCache)
+        self.assertEqual(600, ret.lookup_service.ttl)
+
+    def test_get_fc_zone_info_target_order(self):
+        ret = self.adapter._get_fc_zone_info(
+            ['200000051e55a100'], ['100000051E55A121', '100000051E55A100'])
+        self.assertListEqual(['100000051e55a121', '100000051e55a100'],
+                             ret['target_wwn'])
+
     @patch_for_fc_adapter
     def test_initialize_connection_volume(self):
         volume = MockOSResource(provider_location='id^lun_43', id='id_43')
@@ -751,7 +2694,9 @@ class FCAdapterTest(unittest.TestCase):
 
     @patch_for_fc_adapter
     def test_initialize_connection_snapshot(self):
-        snap = MockOSResource(id='snap_1', name='snap_1')
+        snap = MockOSResource(
+            id='snap_1', name='snap_1',
+            volume=MockOSResource(provider_location='id^lun_43'))
         connector = {'host': 'host1'}
         conn_info = self.adapter.initialize_connection_snapshot(
             snap, connector)
@@ -825,6 +2770,80 @@ class ISCSIAdapterTest(unittest.TestCase):
         self.assertTrue(info['target_portal'] in target_portals)
         self.assertTrue(info['target_iqn'] in target_iqns)
 
+    def test_get_connection_info_owner_sp_first(self):
+        connector = {'host': 'fake_host', 'initiator': 'fake_iqn'}
+        info = self.adapter.get_connection_info(10, None, connector,
+                                                owner_sp='spb')
+        self.assertListEqual(['1.2.3.5:1234', '1.2.3.4:1234'],
+                             info['target_portals'])
+        self.assertListEqual(['iqn.1-1.com.e:c.a.a1', 'iqn.1-1.com.e:c.a.a0'],
+                             info['target_iqns'])
+        self.assertEqual('1.2.3.5:1234', info['target_portal'])
+        self.assertEqual('iqn.1-1.com.e:c.a.a1', info['target_iqn'])
+
+    def _iscsi_targets(self):
+        return [{'portal': '%s:3260' % ip, 'iqn': 'iqn.%s' % port, 'sp': sp,
+                 'port': port, 'ip': ip, 'netmask': '255.255.255.0'}
+                for ip, port, sp in (('10.0.1.1', 'spa_eth0', 'spa'),
+                                     ('10.0.0.1', 'spa_eth1', 'spa'),
+                                     ('10.0.0.2', 'spb_eth1', 'spb'))]
+
+    def test_get_connection_info_same_subnet_first(self):
+        connector = {'host': 'fake_host', 'initiator': 'fake_iqn',
+                     'ip': '10.0.0.9'}
+        with mock.patch.object(self.adapter.client, 'get_iscsi_target_info',
+                               return_value=self._iscsi_targets()):
+            info = self.adapter.get_connection_info(10, None, connector,
+                                                    owner_sp='spa')
+        self.assertListEqual(['10.0.0.1:3260', '10.0.0.2:3260',
+                              '10.0.1.1:3260'], info['target_portals'])
+        self.assertEqual('10.0.0.1:3260', info['target_portal'])
+
+    def test_get_connection_info_port_load(self):
+        connector = {'host': 'fake_host', 'initiator': 'fake_iqn',
+                     'ip': '10.0.0.9'}
+        self.adapter.perf_sampler = mock.Mock()
+        self.adapter.perf_sampler.get_port_load.return_value = {
+            'spa_eth1': 500.0, 'spb_eth1': 100.0}
+        with mock.patch.object(self.adapter.client, 'get_iscsi_target_info',
+                               return_value=self._iscsi_targets()):
+            info = self.adapter.get_connection_info(10, None, connector)
+        self.assertListEqual(['10.0.0.2:3260', '10.0.0.1:3260',
+                              '10.0.1.1:3260'], info['target_portals'])
+        self.assertEqual('10.0.0.2:3260', info['target_portal'])
+
+    def test_get_connection_info_max_portals(self):
+        connector = {'host': 'fake_host', 'initiator': 'fake_iqn',
+                     'ip': '10.0.0.9'}
+        self.adapter.config.unity_iscsi_max_portals = 2
+        with mock.patch.object(self.adapter.client, 'get_iscsi_target_info',
+                               return_value=self._iscsi_targets()):
+            info = self.adapter.get_connection_info(10, None, connector,
+                                                    owner_sp='spb')
+        self.assertListEqual(['10.0.0.2:3260', '10.0.0.1:3260'],
+                             info['target_portals'])
+        self.assertListEqual(['iqn.spb_eth1', 'iqn.spa_eth1'],
+                             info['target_iqns'])
+        self.assertListEqual([10, 10], info['target_luns'])
+
+    def test_get_connection_info_max_portals_peer_sp(self):
+        connector = {'host': 'fake_host', 'initiator': 'fake_iqn',
+                     'ip': '10.0.1.9'}
+        self.adapter.config.unity_iscsi_max_portals = 2
+        with mock.patch.object(self.adapter.client, 'get_iscsi_target_info',
+                               return_value=self._iscsi_targets()):
+            info = self.adapter.get_connection_info(10, None, connector,
+                                                    owner_sp='spa')
+        # The 2 portals of SPA rank first, but one of SPB is kept.
+        self.assertListEqual(['10.0.1.1:3260', '10.0.0.2:3260'],
+                             info['target_portals'])
+
+    def test_initialize_connection_owner_sp(self):
+        volume = MockOSResource(provider_location='id^lun_43', id='id_43')
+        connector = {'host': 'host1', 'initiator': 'fake_iqn'}
+        conn_info = self.adapter.initialize_connection(volume, connector)
+        self.assertEqual('1.2.3.5:1234', conn_info['data']['target_portal'])
+
     @patch_for_iscsi_adapter
     def test_initialize_connection_volume(self):
         volume = MockOSResource(provider_location='id^lun_43', id='id_43')
@@ -836,10 +2855,27 @@ class ISCSIAdapterTest(unittest.TestCase):
 
     @patch_for_iscsi_adapter
     def test_initialize_connection_snapshot(self):
-        snap = MockOSResource(id='snap_1', name='snap_1')
+        snap = MockOSResource(
+            id='snap_1', name='snap_1',
+            volume=MockOSResource(provider_location='id^lun_43'))
         connector = {'host': 'host1'}
         conn_info = self.adapter.initialize_connection_snapshot(
             snap, connector)
         self.assertEqual('iscsi', conn_info['driver_volume_type'])
         self.assertTrue(conn_info['data']['target_discovered'])
         self.assertEqual('snap_1', conn_info['data']['volume_id'])
+
+    @patch_for_iscsi_adapter
+    def test_initialize_connection_snapshot_lun_not_found(self):
+        snap = MockOSResource(
+            id='snap_1', name='snap_1',
+            volume=MockOSResource(provider_location='id^lun_43'))
+        with mock.patch.object(self.adapter.client, 'get_lun',
+                               return_value=None) as get_lun, \
+                mock.patch.object(self.adapter.client, 'get_owner_sp',
+                                  return_value=None) as get_owner_sp:
+            conn_info = self.adapter.initialize_connection_snapshot(
+                snap, {'host': 'host1'})
+        get_lun.assert_called_once_with(lun_id='lun_43')
+        get_owner_sp.assert_called_once_with(None)
+        self.assertEqual('snap_1', conn_info['data']['volume_id'])
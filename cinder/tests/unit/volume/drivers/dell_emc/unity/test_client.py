@@ -12,15 +12,19 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import threading
 import unittest
 
 from mock import mock
 from oslo_utils import units
+from six.moves import urllib
 
 from cinder import coordination
+from cinder import exception
 from cinder.tests.unit.volume.drivers.dell_emc.unity \
     import fake_exception as ex
 from cinder.volume.drivers.dell_emc.unity import client
+from cinder.volume.drivers.dell_emc.unity import utils
 
 ########################
 #
@@ -41,6 +45,8 @@ class MockResource(object):
         self.initiator_id = []
         self.alu_hlu_map = {'already_attached': 99}
         self.ip_address = None
+        self.netmask = None
+        self.v6_prefix_length = None
         self.is_logged_in = None
         self.wwn = None
         self.max_iops = None
@@ -48,6 +54,17 @@ class MockResource(object):
         self.pool_name = 'Pool0'
         self._storage_resource = None
         self.host_cache = []
+        self.is_fast_cache_enabled = False
+        self.tiers = []
+        self.tiering_policy = None
+        self.is_all_flash = True
+        self.is_compression = None
+        self.is_thin_enabled = True
+        self.is_compression_enabled = False
+        self.data_reduction_ratio = None
+        self.data_reduction_size_saved = None
+        self.compression_ratio = None
+        self.compression_size_saved = None
 
     @property
     def id(self):
@@ -104,13 +121,19 @@ class MockResource(object):
         return self.alu_hlu_map.get(lun.get_id(), None)
 
     @staticmethod
-    def create_lun(lun_name, size_gb, description=None, io_limit_policy=None):
+    def create_lun(lun_name, size_gb, description=None, io_limit_policy=None,
+                   tiering_policy=None, is_compression=None, is_thin=None,
+                   sp=None):
         if lun_name == 'in_use':
             raise ex.UnityLunNameInUseError()
         ret = MockResource(lun_name, 'lun_2')
         if io_limit_policy is not None:
             ret.max_iops = io_limit_policy.max_iops
             ret.max_kbps = io_limit_policy.max_kbps
+        ret.tiering_policy = tiering_policy
+        ret.is_compression = is_compression
+        ret.is_thin_enabled = is_thin
+        ret.default_node = sp
         return ret
 
     @staticmethod
@@ -125,6 +148,16 @@ class MockResource(object):
     def update(data=None):
         pass
 
+    @property
+    def storage_processor(self):
+        # The ports named with 1 at the end are on SP B.
+        name = self.name or self._id
+        return MockResource(_id='spb' if name.endswith('1') else 'spa')
+
+    @property
+    def ethernet_port(self):
+        return self
+
     @property
     def iscsi_node(self):
         name = 'iqn.1-1.com.e:c.%s.0' % self.name
@@ -169,8 +202,15 @@ class MockResource(object):
     def storage_resource(self, value):
         self._storage_resource = value
 
-    def modify(self, name=None):
-        self.name = name
+    def modify(self, name=None, tiering_policy=None, sp=None):
+        if name is not None:
+            self.name = name
+        if tiering_policy is not None:
+            self.tiering_policy = tiering_policy
+        if sp is not None:
+            if sp == 'failed_sp':
+                raise ex.StoropsException()
+            self.default_node = sp
 
     def thin_clone(self, name, io_limit_policy=None, description=None):
         if name == 'thin_clone_name_in_use':
@@ -195,6 +235,10 @@ class MockResourceList(object):
     def name(self):
         return map(lambda i: i.name, self.resources)
 
+    @property
+    def list(self):
+        return list(self.resources)
+
     def __iter__(self):
         return self.resources.__iter__()
 
@@ -215,6 +259,7 @@ class MockSystem(object):
     def __init__(self):
         self.serial_number = 'SYSTEM_SERIAL'
         self.system_version = '4.1.0'
+        self._cli = None
 
     @property
     def info(self):
@@ -230,6 +275,9 @@ class MockSystem(object):
             lun = MockResource(name=_id, _id=_id)
             lun.total_size_gb = 7
             return lun
+        if _id is None and name is None:
+            return MockResourceList(['image-pool_1-img_1',
+                                     'image-pool_2-img_1', 'volume-1'])
         return MockResource(name, _id)
 
     @staticmethod
@@ -237,7 +285,22 @@ class MockSystem(object):
         return MockResourceList(['Pool 1', 'Pool 2'])
 
     @staticmethod
-    def get_snap(name):
+    def get_snap(_id=None, name=None, snap_group=None):
+        if snap_group is not None:
+            return MockResourceList(['%s_lun_1' % snap_group,
+                                     '%s_lun_2' % snap_group])
+        if name == 'not_found' or _id == 'not_found':
+            raise ex.UnityResourceNotFoundError()
+        return MockResource(name, _id)
+
+    @staticmethod
+    def create_cg(name, description=None, lun_add=None):
+        if name == 'in_use':
+            raise ex.UnityConsistencyGroupNameInUseError()
+        return MockResource(name)
+
+    @staticmethod
+    def get_cg(name):
         if name == 'not_found':
             raise ex.UnityResourceNotFoundError()
         return MockResource(name)
@@ -260,6 +323,7 @@ class MockSystem(object):
     def get_iscsi_portal():
         portal0 = MockResource('p0')
         portal0.ip_address = '1.1.1.1'
+        portal0.netmask = '255.255.255.0'
         portal1 = MockResource('p1')
         portal1.ip_address = '1.1.1.2'
         return MockResourceList.create(portal0, portal1)
@@ -273,12 +337,14 @@ class MockSystem(object):
         return MockResourceList.create(port0, port1)
 
     @staticmethod
-    def create_io_limit_policy(name, max_iops=None, max_kbps=None):
+    def create_io_limit_policy(name, max_iops=None, max_kbps=None,
+                               **kwargs):
         if name == 'in_use':
             raise ex.UnityPolicyNameInUseError()
         ret = MockResource(name)
         ret.max_iops = max_iops
         ret.max_kbps = max_kbps
+        ret.kwargs = kwargs
         return ret
 
     @staticmethod
@@ -286,6 +352,42 @@ class MockSystem(object):
         return MockResource(name=name)
 
 
+class MockSnapDiffCli(object):
+    """Simulates the snapshot differential of a LUN on the array."""
+
+    def __init__(self, block_size, changed_blocks):
+        self.block_size = block_size
+        self.changed_blocks = sorted(changed_blocks)
+        self.calls = 0
+
+    def action(self, type_name, obj_id, action, baseSnap=None,
+               startOffset=0, maxExtents=None):
+        self.calls += 1
+        extents = [{'offset': block * self.block_size,
+                    'length': self.block_size}
+                   for block in self.changed_blocks
+                   if block * self.block_size >= startOffset]
+        content = {'extents': extents[:maxExtents]}
+        if len(extents) > maxExtents:
+            content['nextOffset'] = extents[maxExtents]['offset']
+        return mock.Mock(first_content=content)
+
+
+class MockPagedCli(object):
+    """Simulates the paged REST queries of the resources."""
+
+    def __init__(self, contents):
+        self.contents = contents
+        self.urls = []
+
+    def rest_get(self, url):
+        self.urls.append(url)
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+        page, per_page = int(query['page'][0]), int(query['per_page'][0])
+        return mock.Mock(
+            contents=self.contents[(page - 1) * per_page:page * per_page])
+
+
 @mock.patch.object(client, 'storops', new='True')
 def get_client():
     ret = client.UnityClient('1.2.3.4', 'user', 'pass')
@@ -325,6 +427,121 @@ class ClientTest(unittest.TestCase):
         lun = self.client.create_lun('LUN 4', 6, pool, io_limit_policy=limit)
         self.assertEqual(100, lun.max_kbps)
 
+    def test_create_lun_with_tiering_policy(self):
+        pool = MockResource('Pool 0')
+        lun = self.client.create_lun('LUN 4', 6, pool,
+                                     tiering_policy='HIGHEST')
+        self.assertEqual('HIGHEST', lun.tiering_policy)
+
+    def test_create_lun_in_job_with_tiering_policy(self):
+        self.client.jobs = mock.Mock()
+        pool = MockResource('Pool 1', 'pool_1')
+        self.client.create_lun('lun_1', 3, pool,
+                               tiering_policy=mock.Mock(index=2))
+        task = self.client.jobs.submit.call_args[0][0]
+        self.assertEqual(
+            {'tieringPolicy': 2},
+            task['parametersIn']['lunParameters']['fastVPParameters'])
+
+    def test_create_lun_compressed(self):
+        pool = MockResource('Pool 0')
+        lun = self.client.create_lun('LUN 4', 6, pool, is_compression=True)
+        self.assertTrue(lun.is_compression)
+
+    def test_create_lun_not_compressed(self):
+        pool = MockResource('Pool 0')
+        lun = self.client.create_lun('LUN 4', 6, pool)
+        self.assertIsNone(lun.is_compression)
+
+    def test_create_lun_thick(self):
+        pool = MockResource('Pool 0')
+        lun = self.client.create_lun('LUN 4', 6, pool, is_thin=False)
+        self.assertFalse(lun.is_thin_enabled)
+
+    def test_create_lun_in_job_thick(self):
+        self.client.jobs = mock.Mock()
+        pool = MockResource('Pool 1', 'pool_1')
+        self.client.create_lun('lun_1', 3, pool, is_thin=False)
+        task = self.client.jobs.submit.call_args[0][0]
+        self.assertFalse(
+            task['parametersIn']['lunParameters']['isThinEnabled'])
+
+    def test_create_lun_in_job_compressed(self):
+        self.client.jobs = mock.Mock()
+        pool = MockResource('Pool 1', 'pool_1')
+        self.client.create_lun('lun_1', 3, pool, is_compression=True)
+        task = self.client.jobs.submit.call_args[0][0]
+        self.assertTrue(
+            task['parametersIn']['lunParameters']['isCompressionEnabled'])
+
+    def test_create_lun_on_sp(self):
+        pool = MockResource('Pool 0')
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum = mock.Mock(SPA='SPA', SPB='SPB')
+            lun = self.client.create_lun('LUN 4', 6, pool, sp='spb')
+        self.assertEqual('SPB', lun.default_node)
+
+    def test_create_lun_in_job_on_sp(self):
+        self.client.jobs = mock.Mock()
+        pool = MockResource('Pool 1', 'pool_1')
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum.SPA = mock.Mock(index=0)
+            self.client.create_lun('lun_1', 3, pool, sp='spa')
+        task = self.client.jobs.submit.call_args[0][0]
+        self.assertEqual(
+            0, task['parametersIn']['lunParameters']['defaultNode'])
+
+    def test_thin_clone_on_sp(self):
+        src_lun = MockResource(_id='id_78')
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum = mock.Mock(SPA='SPA', SPB='SPB')
+            lun = self.client.thin_clone(src_lun, 'tc_78', sp='spa')
+        self.assertEqual('SPA', lun.default_node)
+
+    def test_thin_clone_on_sp_failed(self):
+        src_lun = MockResource(_id='id_78')
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum = mock.Mock(SPA='failed_sp')
+            lun = self.client.thin_clone(src_lun, 'tc_78', sp='spa')
+        self.assertEqual('tc_78', lun.name)
+
+    def test_get_sp_lun_counts(self):
+        cli = MockPagedCli([{'id': 'sv_1', 'currentNode': 0},
+                            {'id': 'sv_2', 'currentNode': 1},
+                            {'id': 'sv_3', 'currentNode': 1},
+                            {'id': 'sv_4', 'currentNode': 2989}])
+        self.client.system._cli = cli
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum = mock.Mock(SPA='SPA', SPB='SPB')
+            storops.NodeEnum.parse.side_effect = {
+                0: 'SPA', 1: 'SPB', 2989: 'UNKNOWN'}.get
+            self.assertEqual({'spa': 1, 'spb': 2},
+                             self.client.get_sp_lun_counts(['pool_1']))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(['id,currentNode'], query['fields'])
+        self.assertEqual(['pool.id eq "pool_1"'], query['filter'])
+
+    def test_get_sp_lun_counts_no_pools(self):
+        self.assertEqual({'spa': 0, 'spb': 0},
+                         self.client.get_sp_lun_counts([]))
+
+    def test_thin_clone_with_tiering_policy(self):
+        src_lun = MockResource(_id='id_78')
+        lun = self.client.thin_clone(src_lun, 'tc_78',
+                                     tiering_policy='LOWEST')
+        self.assertEqual('tc_78', lun.name)
+        self.assertEqual('LOWEST', lun.tiering_policy)
+
+    def test_get_tiering_policy(self):
+        with mock.patch.object(client, 'storops') as storops:
+            storops.TieringPolicyEnum = mock.Mock(HIGHEST='HIGHEST')
+            self.assertEqual('HIGHEST', self.client.get_tiering_policy(
+                'HighestAvailable'))
+
+    def test_get_tiering_policy_none(self):
+        self.assertIsNone(self.client.get_tiering_policy(None))
+
     def test_thin_clone_success(self):
         name = 'tc_77'
         src_lun = MockResource(_id='id_77')
@@ -366,6 +583,211 @@ class ClientTest(unittest.TestCase):
         ret = self.client.get_lun(lun_id='not_found')
         self.assertIsNone(ret)
 
+    def test_enable_perf_stats(self):
+        with mock.patch.object(self.client.system,
+                               'enable_perf_stats', create=True) as enable:
+            self.client.enable_perf_stats(60)
+        enable.assert_called_once_with(interval=60)
+
+    def test_get_lun_perf(self):
+        cli = MockPagedCli([{'id': 'lun_1', 'pool': {'id': 'pool_1'}},
+                            {'id': 'lun_2', 'pool': {'id': 'pool_1'}}])
+        self.client.system._cli = cli
+        luns = {'lun_1': mock.Mock(read_iops=10, write_iops=20, read_mbps=1,
+                                   write_mbps=None, response_time=300),
+                'lun_2': mock.Mock(read_iops=None, write_iops=None)}
+        with mock.patch.object(self.client.system, 'get_lun',
+                               side_effect=lambda _id: luns[_id]):
+            self.assertEqual({'lun_1': ('pool_1', 30, 1, 300)},
+                             self.client.get_lun_perf(['pool_1']))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(['id,pool'], query['fields'])
+        self.assertEqual(['pool.id eq "pool_1"'], query['filter'])
+
+    def test_get_lun_perf_no_pools(self):
+        self.assertEqual({}, self.client.get_lun_perf([]))
+
+    def test_get_ethernet_port_load(self):
+        port_1 = mock.Mock(read_bytes_rate=100, write_bytes_rate=50)
+        port_1.get_id.return_value = 'spa_eth0'
+        port_2 = mock.Mock(read_bytes_rate=None, write_bytes_rate=None)
+        with mock.patch.object(self.client, 'get_ethernet_ports',
+                               return_value=[port_1, port_2]):
+            self.assertEqual({'spa_eth0': 150},
+                             self.client.get_ethernet_port_load())
+
+    def test_get_sp_utilization(self):
+        spa = mock.Mock(utilization=35.5)
+        spa.get_id.return_value = 'spa'
+        spb = mock.Mock(utilization=None)
+        with mock.patch.object(self.client.system, 'get_sp', create=True,
+                               return_value=[spa, spb]):
+            self.assertEqual({'spa': 35.5}, self.client.get_sp_utilization())
+
+    def _migrate_lun(self, states):
+        with mock.patch.object(client, 'storops') as storops, \
+                mock.patch.object(client, 'move_session') as ms, \
+                mock.patch('time.sleep') as sleep:
+            storops.MoveSessionStateEnum = mock.Mock(
+                COMPLETED='Completed', FAILED='Failed',
+                CANCELLED='Cancelled')
+            session = ms.UnityMoveSession.create.return_value
+            states = iter(states)
+
+            def update():
+                session.state = next(states)
+
+            session.update.side_effect = update
+            lun = MockResource(_id='lun_1')
+            lun.is_thin_enabled = False
+            lun.is_compression_enabled = True
+            pool = MockResource('Pool 2')
+            ret = self.client.migrate_lun(lun, pool)
+            ms.UnityMoveSession.create.assert_called_once_with(
+                None, lun, pool, is_dest_thin=False,
+                is_data_reduction_applied=True)
+            return ret, sleep
+
+    def test_migrate_lun(self):
+        ret, sleep = self._migrate_lun(['Running', 'Running', 'Completed'])
+        self.assertTrue(ret)
+        self.assertEqual([mock.call(1), mock.call(2)], sleep.call_args_list)
+
+    def test_migrate_lun_failed(self):
+        ret, _sleep = self._migrate_lun(['Running', 'Failed'])
+        self.assertFalse(ret)
+
+    def test_migrate_lun_to_compressed(self):
+        lun = MockResource(_id='lun_1')
+        pool = MockResource('Pool 2')
+        with mock.patch.object(client, 'move_session') as ms, \
+                mock.patch.object(utils, 'poll_with_backoff',
+                                  return_value=True):
+            self.assertTrue(self.client.migrate_lun(lun, pool,
+                                                    is_compression=True))
+        ms.UnityMoveSession.create.assert_called_once_with(
+            None, lun, pool, is_dest_thin=True, is_data_reduction_applied=True)
+
+    def test_migrate_lun_timeout(self):
+        self.client.system._cli = mock.Mock()
+        self.client.move_session_timeout = 60
+        with mock.patch.object(client, 'move_session') as ms, \
+                mock.patch.object(utils, 'poll_with_backoff',
+                                  return_value=None) as poll:
+            self.assertFalse(self.client.migrate_lun(
+                MockResource(_id='lun_1'), MockResource('Pool 2')))
+        self.assertEqual(60, poll.call_args[1]['timeout'])
+        session = ms.UnityMoveSession.create.return_value
+        self.client.system._cli.action.assert_called_once_with(
+            'moveSession', session.get_id.return_value, 'cancel')
+
+    def test_migrate_lun_create_session_failed(self):
+        with mock.patch.object(client, 'move_session') as ms:
+            ms.UnityMoveSession.create.side_effect = ex.UnityException
+            self.assertFalse(self.client.migrate_lun(
+                MockResource(_id='lun_1'), MockResource('Pool 2')))
+
+    def test_get_snap_by_id(self):
+        self.assertEqual('snap_1', self.client.get_snap(
+            snap_id='snap_1').get_id())
+
+    def test_get_snap_by_id_not_found(self):
+        self.assertIsNone(self.client.get_snap(snap_id='not_found'))
+
+    def test_restore_snap(self):
+        snap = mock.Mock()
+        self.assertIs(snap.restore.return_value,
+                      self.client.restore_snap(snap))
+        snap.restore.assert_called_once_with(delete_backup=False)
+
+    def test_restore_snap_delete_backup(self):
+        snap = mock.Mock()
+        self.client.restore_snap(snap, delete_backup=True)
+        snap.restore.assert_called_once_with(delete_backup=True)
+
+    @mock.patch.object(client, 'SNAP_DIFF_PAGE_SIZE', new=2)
+    def test_get_snap_diff(self):
+        cli = MockSnapDiffCli(4096, [1, 3, 4, 9, 10])
+        self.client.system._cli = cli
+        extents = list(self.client.get_snap_diff(MockResource(_id='snap_1'),
+                                                 MockResource(_id='snap_2')))
+        self.assertEqual([(4096, 4096), (12288, 4096), (16384, 4096),
+                          (36864, 4096), (40960, 4096)], extents)
+        self.assertEqual(3, cli.calls)
+
+    @mock.patch.object(client, 'MANAGEABLE_PAGE_SIZE', new=2)
+    def test_get_lun_contents(self):
+        cli = MockPagedCli([{'id': 'sv_%s' % i} for i in range(4)])
+        self.client.system._cli = cli
+        contents = self.client.get_lun_contents(
+            ['pool_1', 'pool_2'], order_by=[('sizeTotal', 'desc')])
+        self.assertEqual(['sv_0', 'sv_1', 'sv_2', 'sv_3'],
+                         [c['id'] for c in contents])
+        # The last page is empty.
+        self.assertEqual(3, len(cli.urls))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(['id,name,sizeTotal,pool,hostAccess'],
+                         query['fields'])
+        self.assertEqual(['pool.id eq "pool_1" or pool.id eq "pool_2"'],
+                         query['filter'])
+        self.assertEqual(['sizeTotal desc'], query['orderby'])
+
+    @mock.patch.object(client, 'MANAGEABLE_PAGE_SIZE', new=2)
+    def test_get_snap_contents(self):
+        cli = MockPagedCli([{'id': 'snap_1'}])
+        self.client.system._cli = cli
+        self.assertEqual([{'id': 'snap_1'}],
+                         list(self.client.get_snap_contents(['pool_1'])))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(['id,name,size,lun,hostAccess'], query['fields'])
+        self.assertEqual(['lun.pool.id eq "pool_1"'], query['filter'])
+        self.assertNotIn('orderby', query)
+
+    def test_get_lun_contents_name_prefix(self):
+        cli = MockPagedCli([])
+        self.client.system._cli = cli
+        list(self.client.get_lun_contents(['pool_1'],
+                                          name_prefix='image-pool_1-'))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(
+            ['(pool.id eq "pool_1") and name lk "image-pool_1-%"'],
+            query['filter'])
+
+    def test_get_snap_contents_name_prefix(self):
+        cli = MockPagedCli([])
+        self.client.system._cli = cli
+        list(self.client.get_snap_contents(['pool_1'],
+                                           name_prefix='tombstone-'))
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(
+            cli.urls[0]).query)
+        self.assertEqual(
+            ['(lun.pool.id eq "pool_1") and name lk "tombstone-%"'],
+            query['filter'])
+
+    def test_get_lun_contents_no_pools(self):
+        self.assertEqual([], list(self.client.get_lun_contents([])))
+
+    def test_update_lun_io_limit_policy(self):
+        lun = mock.Mock()
+        policy = mock.Mock()
+        self.client.update_lun_io_limit_policy(lun, policy)
+        lun.modify.assert_called_once_with(io_limit_policy=policy)
+
+    def test_update_lun_io_limit_policy_remove(self):
+        lun = mock.Mock()
+        self.client.update_lun_io_limit_policy(lun, None)
+        lun.io_limit_policy.remove_from_storage.assert_called_once_with(lun)
+        self.assertFalse(lun.modify.called)
+
+    def test_update_lun_io_limit_policy_none(self):
+        lun = mock.Mock(io_limit_policy=None)
+        self.client.update_lun_io_limit_policy(lun, None)
+        self.assertFalse(lun.modify.called)
+
     def test_get_pools(self):
         pools = self.client.get_pools()
         self.assertEqual(2, len(pools))
@@ -463,13 +885,19 @@ class ClientTest(unittest.TestCase):
 
     def test_get_iscsi_target_info(self):
         ret = self.client.get_iscsi_target_info()
-        expected = [{'iqn': 'iqn.1-1.com.e:c.p0.0', 'portal': '1.1.1.1:3260'},
-                    {'iqn': 'iqn.1-1.com.e:c.p1.0', 'portal': '1.1.1.2:3260'}]
+        expected = [{'iqn': 'iqn.1-1.com.e:c.p0.0', 'portal': '1.1.1.1:3260',
+                     'sp': 'spa', 'port': None, 'ip': '1.1.1.1',
+                     'netmask': '255.255.255.0'},
+                    {'iqn': 'iqn.1-1.com.e:c.p1.0', 'portal': '1.1.1.2:3260',
+                     'sp': 'spb', 'port': None, 'ip': '1.1.1.2',
+                     'netmask': None}]
         self.assertListEqual(expected, ret)
 
     def test_get_iscsi_target_info_allowed_ports(self):
         ret = self.client.get_iscsi_target_info(allowed_ports=['spa_eth0'])
-        expected = [{'iqn': 'iqn.1-1.com.e:c.p0.0', 'portal': '1.1.1.1:3260'}]
+        expected = [{'iqn': 'iqn.1-1.com.e:c.p0.0', 'portal': '1.1.1.1:3260',
+                     'sp': 'spa', 'port': None, 'ip': '1.1.1.1',
+                     'netmask': '255.255.255.0'}]
         self.assertListEqual(expected, ret)
 
     def test_get_fc_target_info_without_host(self):
@@ -477,6 +905,21 @@ class ClientTest(unittest.TestCase):
         self.assertListEqual(['8899AABBCCDDEEFF', '8899AABBCCDDFFEE'],
                              sorted(ret))
 
+    def test_get_fc_targets(self):
+        ret = self.client.get_fc_targets()
+        self.assertEqual({'8899AABBCCDDEEFF': 'spa',
+                          '8899AABBCCDDFFEE': 'spb'}, ret)
+
+    def test_get_owner_sp(self):
+        lun = MockResource(_id='lun_1')
+        lun.current_node = 'SPB'
+        with mock.patch.object(client, 'storops') as storops:
+            storops.NodeEnum = mock.Mock(SPA='SPA', SPB='SPB')
+            self.assertEqual('spb', self.client.get_owner_sp(lun))
+            lun.current_node = 'UNKNOWN'
+            self.assertIsNone(self.client.get_owner_sp(lun))
+        self.assertIsNone(self.client.get_owner_sp(None))
+
     def test_get_fc_target_info_without_host_but_allowed_ports(self):
         ret = self.client.get_fc_target_info(allowed_ports=['spa_fc0'])
         self.assertListEqual(['8899AABBCCDDEEFF'], ret)
@@ -507,6 +950,35 @@ class ClientTest(unittest.TestCase):
         self.assertEqual('3kiops', limit.name)
         self.assertEqual(3000, limit.max_iops)
 
+    def test_get_io_limit_policy_density_based(self):
+        specs = {'id': 'density', 'maxIOPS': None, 'maxBWS': None,
+                 'maxIOPSDensity': 10, 'burstRate': 50, 'burstTime': 5,
+                 'burstFrequency': 1}
+        with mock.patch.object(client, 'storops') as storops:
+            storops.IOLimitPolicyTypeEnum = mock.Mock(
+                DENSITY_BASED='DENSITY_BASED')
+            limit = self.client.get_io_limit_policy(specs)
+        self.assertEqual('density', limit.name)
+        self.assertIsNone(limit.max_iops)
+        self.assertEqual({'policy_type': 'DENSITY_BASED',
+                          'max_iops_density': 10, 'max_kbps_density': None,
+                          'burst_rate': 50, 'burst_time': 5,
+                          'burst_frequency': 1}, limit.kwargs)
+
+    def test_get_io_limit_policy_shared(self):
+        specs = {'id': 'qos_1', 'maxIOPS': 1000, 'maxBWS': None,
+                 'isShared': True}
+        limit = self.client.get_io_limit_policy(specs, project_id='project_1')
+        self.assertEqual('qos_1-project_1', limit.name)
+        self.assertEqual(1000, limit.max_iops)
+        self.assertEqual({'is_shared': True}, limit.kwargs)
+
+    def test_create_io_limit_policy_burst(self):
+        limit = self.client.create_io_limit_policy('burst', max_iops=100,
+                                                   burst_rate=20)
+        self.assertEqual(100, limit.max_iops)
+        self.assertEqual({'burst_rate': 20}, limit.kwargs)
+
     def test_create_io_limit_policy_in_use(self):
         limit = self.client.create_io_limit_policy('in_use', max_iops=100)
         self.assertEqual('in_use', limit.name)
@@ -521,3 +993,192 @@ class ClientTest(unittest.TestCase):
 
     def test_get_pool_name(self):
         self.assertEqual('Pool0', self.client.get_pool_name('lun_0'))
+
+    def test_create_cg(self):
+        cg = self.client.create_cg('cg_1', description='cg 1')
+        self.assertEqual('cg_1', cg.name)
+
+    def test_create_cg_name_in_use(self):
+        cg = self.client.create_cg('in_use')
+        self.assertEqual('in_use', cg.name)
+
+    def test_get_cg_not_found(self):
+        self.assertIsNone(self.client.get_cg('not_found'))
+
+    def test_delete_cg_not_found(self):
+        try:
+            self.client.delete_cg('not_found')
+        except ex.StoropsException:
+            self.fail('not found error should be dealt with silently.')
+
+    def test_update_cg(self):
+        cg = mock.Mock()
+        with mock.patch.object(self.client, 'get_cg', return_value=cg):
+            self.client.update_cg('cg_1', ['lun_1'], ['lun_2'])
+        cg.update_lun.assert_called_once_with(
+            add_luns=[mock.ANY], remove_luns=[mock.ANY])
+        kwargs = cg.update_lun.call_args[1]
+        self.assertEqual('lun_1', kwargs['add_luns'][0].get_id())
+        self.assertEqual('lun_2', kwargs['remove_luns'][0].get_id())
+
+    def test_update_cg_not_found(self):
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self.client.update_cg, 'not_found', [], [])
+
+    def test_create_cg_snap(self):
+        snap = self.client.create_cg_snap('cg_1', snap_name='cg_snap_1')
+        self.assertEqual('cg_snap_1', snap.name)
+
+    def test_create_cg_snap_name_in_use(self):
+        snap = self.client.create_cg_snap('cg_1', snap_name='in_use')
+        self.assertEqual('in_use', snap.name)
+
+    def test_filter_snaps_in_cg_snap(self):
+        snaps = self.client.filter_snaps_in_cg_snap('cg_snap_1')
+        self.assertEqual(['cg_snap_1_lun_1', 'cg_snap_1_lun_2'],
+                         [snap.name for snap in snaps])
+
+
+@mock.patch.object(client, 'storops_ex', new=ex)
+def mock_job_task(name, parameters_out):
+    # Not a dict, like the `UnityJobTask` of storops.
+    task = mock.Mock(spec=['name', 'parameters_out'],
+                     parameters_out=parameters_out)
+    task.name = name
+    return task
+
+
+class JobCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.client = get_client()
+        self.client.system._cli = mock.Mock()
+        self.jobs = client.JobCoalescer(self.client, 2, 0.2)
+
+    def _submit_concurrently(self, *args_list):
+        results = [None] * len(args_list)
+
+        def submit(i, args):
+            try:
+                results[i] = self.jobs.submit(*args)
+            except Exception as ex:
+                results[i] = ex
+
+        threads = [threading.Thread(target=submit, args=(i, args))
+                   for i, args in enumerate(args_list)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_submit_batched(self):
+        with mock.patch.object(self.jobs, '_run_job',
+                               return_value=[{'id': 'a'}, {'id': 'b'}]
+                               ) as run_job:
+            results = self._submit_concurrently(
+                ({'action': 'create'}, lambda out: out['id'], None),
+                ({'action': 'create'}, lambda out: out['id'], None))
+        self.assertEqual(['a', 'b'], sorted(results))
+        run_job.assert_called_once_with([{'action': 'create'},
+                                         {'action': 'create'}])
+
+    def test_submit_alone(self):
+        fallback = mock.Mock(return_value='alone')
+        self.assertEqual('alone', self.jobs.submit({}, None, fallback))
+
+    def test_submit_job_not_completed(self):
+        def fail():
+            raise ex.UnityResourceNotFoundError()
+
+        with mock.patch.object(self.jobs, '_run_job', return_value=None):
+            results = self._submit_concurrently(
+                ({}, None, lambda: 'done'), ({}, None, fail))
+        self.assertIn('done', results)
+        self.assertEqual(1, len([r for r in results if isinstance(
+            r, ex.UnityResourceNotFoundError)]))
+
+    def _run_job(self, state, tasks):
+        with mock.patch.object(client, 'storops') as storops, \
+                mock.patch.object(client, 'job_resource') as job_resource, \
+                mock.patch('time.sleep'):
+            storops.JobStateEnum = mock.Mock(
+                QUEUED='Queued', RUNNING='Running', SUSPENDED='Suspended',
+                ROLLING_BACK='Rolling_Back', COMPLETED='Completed')
+            job = job_resource.UnityJob.return_value
+            states = iter(['Running', 'Suspended', state])
+
+            def update():
+                job.state = next(states)
+
+            job.update.side_effect = update
+            job.tasks = [mock_job_task('task_1', {'id': 'b'}),
+                         mock_job_task('task_0', {'id': 'a'})]
+            ret = self.jobs._run_job(tasks)
+            job_resource.UnityJob.assert_called_once_with(
+                _id=self.client.system._cli.rest_post.return_value.resource_id,
+                cli=self.client.system._cli)
+            return ret
+
+    def test_run_job(self):
+        ret = self._run_job('Completed', [{'action': 'a'}, {'action': 'b'}])
+        self.assertEqual([{'id': 'a'}, {'id': 'b'}], ret)
+        body = self.client.system._cli.rest_post.call_args[0][1]
+        self.assertEqual([{'action': 'a', 'name': 'task_0'},
+                          {'action': 'b', 'name': 'task_1'}], body['tasks'])
+
+    def test_run_job_failed(self):
+        self.assertIsNone(self._run_job('Failed', [{}, {}]))
+
+    def test_run_job_output_missing(self):
+        self.assertRaises(exception.VolumeBackendAPIException,
+                          self._run_job, 'Completed', [{}, {}, {}])
+
+    def test_run_job_timeout(self):
+        with mock.patch.object(utils, 'poll_with_backoff',
+                               return_value=None):
+            self.assertRaises(exception.VolumeBackendAPIException,
+                              self._run_job, 'Running', [{}, {}])
+
+    def test_submit_job_timeout(self):
+        fallback = mock.Mock()
+        with mock.patch.object(
+                self.jobs, '_run_job',
+                side_effect=exception.VolumeBackendAPIException(data='')):
+            results = self._submit_concurrently(({}, None, fallback),
+                                                ({}, None, fallback))
+        self.assertTrue(all(isinstance(
+            r, exception.VolumeBackendAPIException) for r in results))
+        self.assertFalse(fallback.called)
+
+    def test_run_job_single_task(self):
+        self.assertIsNone(self.jobs._run_job([{}]))
+        self.assertFalse(self.client.system._cli.rest_post.called)
+
+    def test_delete_lun_in_job(self):
+        self.client.jobs = mock.Mock()
+        self.client.delete_lun('lun_1')
+        task = self.client.jobs.submit.call_args[0][0]
+        self.assertEqual({'object': 'storageResource', 'action': 'delete',
+                          'parametersIn': {'id': 'lun_1'}}, task)
+
+    def test_create_lun_in_job(self):
+        self.client.jobs = mock.Mock()
+        pool = MockResource('Pool 1', 'pool_1')
+        policy = MockResource('policy', 'qos_1')
+        self.client.create_lun('lun_1', 3, pool, description='desc',
+                               io_limit_policy=policy)
+        task, on_complete, _fallback = self.client.jobs.submit.call_args[0]
+        self.assertEqual(
+            {'name': 'lun_1', 'description': 'desc',
+             'lunParameters': {'pool': {'id': 'pool_1'},
+                               'size': 3 * units.Gi,
+                               'ioLimitParameters': {
+                                   'ioLimitPolicy': {'id': 'qos_1'}}}},
+            task['parametersIn'])
+        lun = on_complete({'storageResource': {'id': 'sv_1'}})
+        self.assertEqual('sv_1', lun.get_id())
+
+    def test_delete_attached_snap_not_in_job(self):
+        self.client.jobs = mock.Mock()
+        self.client.delete_snap(MockResource(_id='snap_1'), even_attached=True)
+        self.assertFalse(self.client.jobs.submit.called)
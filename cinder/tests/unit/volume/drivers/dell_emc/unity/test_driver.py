@@ -15,6 +15,8 @@
 
 import unittest
 
+import mock
+
 from cinder.tests.unit.volume.drivers.dell_emc.unity \
     import fake_exception as ex
 from cinder.tests.unit.volume.drivers.dell_emc.unity import test_adapter
@@ -44,10 +46,22 @@ class MockAdapter(object):
     def create_cloned_volume(volume, src_vref):
         return volume
 
+    @staticmethod
+    def clone_image(context, volume, image_meta, image_service):
+        return volume, True
+
     @staticmethod
     def extend_volume(volume, new_size):
         volume.size = new_size
 
+    @staticmethod
+    def migrate_volume(volume, host):
+        return True, {'volume': volume, 'host': host}
+
+    @staticmethod
+    def retype(volume, new_type, diff, host):
+        return volume.volume_type_id != new_type['id']
+
     @staticmethod
     def delete_volume(volume):
         volume.exists = False
@@ -61,6 +75,14 @@ class MockAdapter(object):
     def delete_snapshot(snapshot):
         snapshot.exists = False
 
+    @staticmethod
+    def revert_to_snapshot(volume, snapshot):
+        volume.reverted_to = snapshot
+
+    @staticmethod
+    def get_snapshot_diff(snapshot, base_snapshot):
+        return [(0, 512)]
+
     @staticmethod
     def initialize_connection(volume, connector):
         return {'volume': volume, 'connector': connector}
@@ -69,6 +91,10 @@ class MockAdapter(object):
     def terminate_connection(volume, connector):
         return {'volume': volume, 'connector': connector}
 
+    @staticmethod
+    def invalidate_zone_mapping(connector):
+        pass
+
     @staticmethod
     def update_volume_stats():
         return {'stats': 123}
@@ -84,6 +110,24 @@ class MockAdapter(object):
         volume.size = 7
         return volume
 
+    @staticmethod
+    def get_manageable_volumes(cinder_volumes, marker, limit, offset,
+                               sort_keys, sort_dirs):
+        return [{'reference': {'source-id': 'sv_1'}}]
+
+    @staticmethod
+    def get_manageable_snapshots(cinder_snapshots, marker, limit, offset,
+                                 sort_keys, sort_dirs):
+        return [{'reference': {'source-id': 'snap_1'}}]
+
+    @staticmethod
+    def manage_existing_snapshot(snapshot, existing_ref):
+        return {'provider_id': 'snap_1'}
+
+    @staticmethod
+    def manage_existing_snapshot_get_size(snapshot, existing_ref):
+        return 3
+
     @staticmethod
     def get_pool_name(volume):
         return 'pool_0'
@@ -96,6 +140,37 @@ class MockAdapter(object):
     def terminate_connection_snapshot(snapshot, connector):
         return {'snapshot': snapshot, 'connector': connector}
 
+    @staticmethod
+    def create_group(group):
+        return group
+
+    @staticmethod
+    def delete_group(group, volumes):
+        return group, volumes
+
+    @staticmethod
+    def update_group(group, add_volumes, remove_volumes):
+        return group, add_volumes, remove_volumes
+
+    @staticmethod
+    def create_group_snapshot(group_snapshot, snapshots):
+        return group_snapshot, snapshots
+
+    @staticmethod
+    def delete_group_snapshot(group_snapshot, snapshots):
+        return group_snapshot, snapshots
+
+    @staticmethod
+    def create_group_from_src(group, volumes, group_snapshot=None,
+                              snapshots=None, source_group=None,
+                              source_vols=None):
+        return group, volumes, group_snapshot, source_group
+
+
+def patch_for_cg_type(is_cg):
+    return mock.patch('cinder.volume.utils.is_group_a_cg_snapshot_type',
+                      return_value=is_cg)
+
 
 ########################
 #
@@ -170,11 +245,29 @@ class UnityDriverTest(unittest.TestCase):
         self.assertEqual(
             volume, self.driver.create_cloned_volume(volume, None))
 
+    def test_clone_image(self):
+        volume = self.get_volume()
+        self.assertEqual((volume, True),
+                         self.driver.clone_image(None, volume, None,
+                                                 {'id': 'img'}, None))
+
     def test_extend_volume(self):
         volume = self.get_volume()
         self.driver.extend_volume(volume, 6)
         self.assertEqual(6, volume.size)
 
+    def test_migrate_volume(self):
+        volume = self.get_volume()
+        host = {'capabilities': {'location_info': 'pool1|SERIAL'}}
+        moved, model_update = self.driver.migrate_volume(None, volume, host)
+        self.assertTrue(moved)
+        self.assertEqual({'volume': volume, 'host': host}, model_update)
+
+    def test_retype(self):
+        volume = test_adapter.MockOSResource(volume_type_id='type_1')
+        self.assertTrue(self.driver.retype(None, volume, {'id': 'type_2'},
+                                           {}, {'host': 'host@unity#pool'}))
+
     def test_delete_volume(self):
         volume = self.get_volume()
         self.driver.delete_volume(volume)
@@ -190,6 +283,22 @@ class UnityDriverTest(unittest.TestCase):
         self.driver.delete_snapshot(snapshot)
         self.assertFalse(snapshot.exists)
 
+    def test_get_snapshot_diff(self):
+        self.assertEqual([(0, 512)], self.driver.get_snapshot_diff(
+            None, self.get_snapshot(), self.get_snapshot()))
+
+    def test_set_initialized(self):
+        self.driver.adapter = mock.Mock()
+        self.driver.set_initialized()
+        self.assertTrue(self.driver.initialized)
+        self.driver.adapter.clear_listed_luns.assert_called_once_with()
+
+    def test_revert_to_snapshot(self):
+        volume = self.get_volume()
+        snapshot = self.get_snapshot()
+        self.driver.revert_to_snapshot(None, volume, snapshot)
+        self.assertEqual(snapshot, volume.reverted_to)
+
     def test_ensure_export(self):
         self.assertIsNone(self.driver.ensure_export(
             self.get_context(), self.get_volume()))
@@ -213,6 +322,18 @@ class UnityDriverTest(unittest.TestCase):
         self.assertEqual(volume, conn_info['volume'])
         self.assertEqual(connector, conn_info['connector'])
 
+    def test_initialize_connection_invalidate_zone_mapping(self):
+        volume = self.get_volume()
+        connector = self.get_connector()
+        with mock.patch.object(self.driver.adapter, 'initialize_connection',
+                               side_effect=ex.StoropsException), \
+                mock.patch.object(self.driver.adapter,
+                                  'invalidate_zone_mapping') as invalidate:
+            self.assertRaises(ex.StoropsException,
+                              self.driver.initialize_connection,
+                              volume, connector)
+        invalidate.assert_called_once_with(connector)
+
     def test_terminate_connection(self):
         volume = self.get_volume()
         connector = self.get_connector()
@@ -235,6 +356,25 @@ class UnityDriverTest(unittest.TestCase):
         self.assertTrue(volume.managed)
         self.assertEqual(7, volume.size)
 
+    def test_get_manageable_volumes(self):
+        ret = self.driver.get_manageable_volumes([], None, 10, 0, [], [])
+        self.assertEqual([{'reference': {'source-id': 'sv_1'}}], ret)
+
+    def test_get_manageable_snapshots(self):
+        ret = self.driver.get_manageable_snapshots([], None, 10, 0, [], [])
+        self.assertEqual([{'reference': {'source-id': 'snap_1'}}], ret)
+
+    def test_manage_existing_snapshot(self):
+        ret = self.driver.manage_existing_snapshot(None, None)
+        self.assertEqual('snap_1', ret['provider_id'])
+
+    def test_manage_existing_snapshot_get_size(self):
+        self.assertEqual(
+            3, self.driver.manage_existing_snapshot_get_size(None, None))
+
+    def test_unmanage_snapshot(self):
+        self.assertIsNone(self.driver.unmanage_snapshot(None))
+
     def test_get_pool(self):
         self.assertEqual('pool_0', self.driver.get_pool(self.get_volume()))
 
@@ -256,3 +396,54 @@ class UnityDriverTest(unittest.TestCase):
         conn_info = self.driver.terminate_connection_snapshot(
             snapshot, self.get_connector())
         self.assertEqual(snapshot, conn_info['snapshot'])
+
+    @patch_for_cg_type(True)
+    def test_create_group(self, mocked):
+        group = test_adapter.MockOSResource(id='group_1')
+        self.assertEqual(group, self.driver.create_group(None, group))
+
+    @patch_for_cg_type(False)
+    def test_create_group_not_cg(self, mocked):
+        group = test_adapter.MockOSResource(id='group_1')
+        self.assertRaises(NotImplementedError,
+                          self.driver.create_group, None, group)
+
+    @patch_for_cg_type(True)
+    def test_delete_group(self, mocked):
+        group = test_adapter.MockOSResource(id='group_1')
+        volumes = [self.get_volume()]
+        self.assertEqual((group, volumes),
+                         self.driver.delete_group(None, group, volumes))
+
+    @patch_for_cg_type(True)
+    def test_update_group(self, mocked):
+        group = test_adapter.MockOSResource(id='group_1')
+        add_volumes = [self.get_volume()]
+        self.assertEqual((group, add_volumes, None),
+                         self.driver.update_group(None, group,
+                                                  add_volumes=add_volumes))
+
+    @patch_for_cg_type(True)
+    def test_create_group_snapshot(self, mocked):
+        group_snapshot = test_adapter.MockOSResource(id='cg_snap_1')
+        snapshots = [self.get_snapshot()]
+        self.assertEqual((group_snapshot, snapshots),
+                         self.driver.create_group_snapshot(
+                             None, group_snapshot, snapshots))
+
+    @patch_for_cg_type(False)
+    def test_delete_group_snapshot_not_cg(self, mocked):
+        group_snapshot = test_adapter.MockOSResource(id='cg_snap_1')
+        self.assertRaises(NotImplementedError,
+                          self.driver.delete_group_snapshot,
+                          None, group_snapshot, [])
+
+    @patch_for_cg_type(True)
+    def test_create_group_from_src(self, mocked):
+        group = test_adapter.MockOSResource(id='group_2')
+        source_group = test_adapter.MockOSResource(id='group_1')
+        volumes = [self.get_volume()]
+        self.assertEqual((group, volumes, None, source_group),
+                         self.driver.create_group_from_src(
+                             None, group, volumes, source_group=source_group,
+                             source_vols=[]))
@@ -53,6 +53,29 @@ def get_volume_type_qos_specs(type_id):
                 }
             }
         }
+    elif type_id == 'density_burst':
+        ret = {
+            'qos_specs': {
+                'id': 'density_burst',
+                'consumer': 'back-end',
+                'specs': {
+                    'maxIOPSDensity': 10,
+                    'maxBWSDensity': 100,
+                    'burstRate': 50,
+                }
+            }
+        }
+    elif type_id == 'shared':
+        ret = {
+            'qos_specs': {
+                'id': 'shared',
+                'consumer': 'back-end',
+                'specs': {
+                    'maxIOPS': 1000,
+                    'isShared': 'True',
+                }
+            }
+        }
     else:
         ret = None
     return ret
@@ -169,6 +192,100 @@ class UnityUtilsTest(unittest.TestCase):
     def test_convert_ip_to_portal(self):
         self.assertEqual('1.2.3.4:3260', utils.convert_ip_to_portal('1.2.3.4'))
 
+    def test_is_same_subnet(self):
+        self.assertTrue(utils.is_same_subnet('10.0.0.9', '10.0.0.1',
+                                             '255.255.255.0'))
+        self.assertFalse(utils.is_same_subnet('10.0.1.9', '10.0.0.1',
+                                              '255.255.255.0'))
+        self.assertTrue(utils.is_same_subnet('fd00::9', 'fd00::1', 64))
+
+    def test_cap_targets_by_sp(self):
+        targets = [{'id': i, 'sp': sp}
+                   for i, sp in enumerate(['spa', 'spa', 'spa', 'spb',
+                                           'spb'])]
+        self.assertEqual(targets, utils.cap_targets_by_sp(targets, 0))
+        self.assertEqual([0, 3], [t['id'] for t in
+                                  utils.cap_targets_by_sp(targets, 2)])
+        self.assertEqual([0, 1, 3], [t['id'] for t in
+                                     utils.cap_targets_by_sp(targets, 3)])
+        self.assertEqual([0], [t['id'] for t in
+                               utils.cap_targets_by_sp(targets, 1)])
+
+    def test_select_fc_targets_no_limit(self):
+        targets = {'wwn_2': 'spa', 'wwn_1': 'spb', 'wwn_3': 'spb'}
+        self.assertEqual(['wwn_1', 'wwn_3', 'wwn_2'],
+                         utils.select_fc_targets(targets, 0, owner_sp='spb'))
+        self.assertEqual(['wwn_1', 'wwn_2', 'wwn_3'],
+                         utils.select_fc_targets(targets, 3))
+
+    def test_select_fc_targets_balanced(self):
+        targets = {'wwn_%d' % i: 'spa' if i % 2 else 'spb' for i in range(8)}
+        fabrics = {'wwn_%d' % i: 'san_1' if i < 4 else 'san_2'
+                   for i in range(8)}
+        selected = utils.select_fc_targets(targets, 4, owner_sp='spb',
+                                           fabrics=fabrics, seed='host1')
+        self.assertEqual(['spb', 'spb', 'spa', 'spa'],
+                         [targets[wwn] for wwn in selected])
+        # Each SP is reached on each fabric.
+        self.assertEqual(4, len(set((targets[wwn], fabrics[wwn])
+                                    for wwn in selected)))
+
+    def test_select_fc_targets_unzoned_dropped(self):
+        targets = {'WWN_1': 'spa', 'wwn_2': 'spb', 'wwn_3': 'spa',
+                   'wwn_4': 'spb'}
+        fabrics = {'wwn_1': 'san_1', 'wwn_2': 'san_1'}
+        self.assertEqual(['WWN_1', 'wwn_2'],
+                         utils.select_fc_targets(targets, 3, fabrics=fabrics))
+        self.assertEqual(['WWN_1', 'wwn_2'],
+                         utils.select_fc_targets(targets, 0, fabrics=fabrics))
+        self.assertEqual(['WWN_1', 'wwn_2', 'wwn_3', 'wwn_4'],
+                         utils.select_fc_targets(targets, 0, fabrics={}))
+
+    def test_select_fc_targets_stable(self):
+        targets = {'wwn_%d' % i: 'spa' if i % 2 else 'spb' for i in range(8)}
+        selected = utils.select_fc_targets(targets, 2, seed='host1')
+        self.assertEqual(selected,
+                         utils.select_fc_targets(targets, 2, seed='host1'))
+        spread = set(tuple(utils.select_fc_targets(targets, 2,
+                                                   seed='host%d' % i))
+                     for i in range(10))
+        self.assertGreater(len(spread), 1)
+
+    def test_filter_zone_mapping(self):
+        mapping = {'san_1': {'initiator_port_wwn_list': ['i_1'],
+                             'target_port_wwn_list': ['t_1', 't_2']}}
+        self.assertEqual(
+            {'san_1': {'initiator_port_wwn_list': ['i_1'],
+                       'target_port_wwn_list': ['t_2']}},
+            utils.filter_zone_mapping(mapping, ['T_2']))
+        self.assertEqual({'t_1': 'san_1', 't_2': 'san_1'},
+                         utils.get_zone_fabrics(mapping))
+
+    def test_paginate_manageable(self):
+        entries = [{'reference': {'source-id': i}} for i in range(6)]
+        self.assertEqual(entries[2:4], utils.paginate_manageable(
+            iter(entries), '{"source-id": 0}', 2, 1))
+        self.assertEqual(entries[1:], utils.paginate_manageable(
+            iter(entries), {'source-id': 0}, None, None))
+        self.assertEqual(entries[:3], utils.paginate_manageable(
+            iter(entries), None, 3, 0))
+
+    def test_paginate_manageable_invalid_marker(self):
+        entries = [{'reference': {'source-id': i}} for i in range(2)]
+        self.assertRaises(exception.InvalidInput,
+                          utils.paginate_manageable,
+                          iter(entries), 'not_json', 1, 0)
+        self.assertRaises(exception.InvalidInput,
+                          utils.paginate_manageable,
+                          iter(entries), {'source-id': 5}, 1, 0)
+
+    def test_is_same_subnet_unknown(self):
+        self.assertFalse(utils.is_same_subnet(None, '10.0.0.1',
+                                              '255.255.255.0'))
+        self.assertFalse(utils.is_same_subnet('10.0.0.9', '10.0.0.1', None))
+        self.assertFalse(utils.is_same_subnet('invalid', '10.0.0.1',
+                                              '255.255.255.0'))
+
     def test_convert_to_itor_tgt_map(self):
         zone_mapping = {
             'san_1': {
@@ -201,6 +318,21 @@ class UnityUtilsTest(unittest.TestCase):
         except IgnoredException:
             self.fail('should not raise any exception.')
 
+    @mock.patch('time.sleep')
+    def test_poll_with_backoff(self, sleep):
+        results = iter([None, None, None, 'done'])
+        self.assertEqual('done', utils.poll_with_backoff(
+            lambda: next(results), interval=2, max_interval=5))
+        self.assertEqual([mock.call(2), mock.call(4), mock.call(5)],
+                         sleep.call_args_list)
+
+    @mock.patch('time.sleep')
+    @mock.patch('time.time', side_effect=[0, 0, 2, 3])
+    def test_poll_with_backoff_timeout(self, _time, sleep):
+        self.assertIsNone(utils.poll_with_backoff(lambda: None, interval=2,
+                                                  timeout=3))
+        self.assertEqual([mock.call(2), mock.call(1)], sleep.call_args_list)
+
     def test_assure_cleanup(self):
         data = [0]
 
@@ -217,6 +349,36 @@ class UnityUtilsTest(unittest.TestCase):
 
         self.assertEqual(9, data[0])
 
+    def test_get_tiering_policy_name(self):
+        self.assertEqual('HIGHEST',
+                         utils.get_tiering_policy_name('HighestAvailable'))
+        self.assertIsNone(utils.get_tiering_policy_name(None))
+
+    def test_get_tiering_policy_name_invalid(self):
+        self.assertRaises(exception.InvalidVolumeType,
+                          utils.get_tiering_policy_name, 'Fastest')
+
+    @mock.patch('cinder.volume.volume_types.get_volume_type_extra_specs',
+                return_value={'storagetype:tiering': 'Auto'})
+    def test_get_extra_spec_of_type(self, get_specs):
+        self.assertEqual('Auto', utils.get_extra_spec_of_type(
+            'type_1', 'storagetype:tiering'))
+        self.assertIsNone(utils.get_extra_spec_of_type(
+            'type_1', 'provisioning:type'))
+        self.assertIsNone(utils.get_extra_spec_of_type(
+            None, 'storagetype:tiering'))
+        get_specs.assert_called_with('type_1')
+
+    def test_get_provisioning_type(self):
+        self.assertEqual('thin', utils.get_provisioning_type(None))
+        self.assertEqual('thick', utils.get_provisioning_type('thick'))
+        self.assertEqual('compressed',
+                         utils.get_provisioning_type('compressed'))
+
+    def test_get_provisioning_type_invalid(self):
+        self.assertRaises(exception.InvalidVolumeType,
+                          utils.get_provisioning_type, 'dedup')
+
     def test_get_backend_qos_specs_type_none(self):
         volume = test_adapter.MockOSResource(volume_type_id=None)
         ret = utils.get_backend_qos_specs(volume)
@@ -254,3 +416,33 @@ class UnityUtilsTest(unittest.TestCase):
         ret = utils.get_backend_qos_specs(volume)
         expected = {'maxBWS': 2, 'id': 'max_2_mbps', 'maxIOPS': None}
         self.assertEqual(expected, ret)
+
+    @patch_volume_types
+    def test_get_backend_qos_density_burst(self):
+        volume = test_adapter.MockOSResource(volume_type_id='density_burst')
+        ret = utils.get_backend_qos_specs(volume)
+        expected = {'maxBWS': None, 'id': 'density_burst', 'maxIOPS': None,
+                    'maxIOPSDensity': 10, 'maxBWSDensity': 100,
+                    'burstRate': 50}
+        self.assertEqual(expected, ret)
+
+    def test_is_density_based_qos(self):
+        self.assertTrue(utils.is_density_based_qos(
+            {'id': 'qos_1', 'maxIOPS': None, 'maxBWSDensity': 100}))
+        self.assertFalse(utils.is_density_based_qos(
+            {'id': 'qos_1', 'maxIOPS': 100, 'maxBWS': None}))
+        self.assertFalse(utils.is_density_based_qos(None))
+
+    @patch_volume_types
+    def test_get_backend_qos_shared(self):
+        volume = test_adapter.MockOSResource(volume_type_id='shared')
+        ret = utils.get_backend_qos_specs(volume)
+        expected = {'maxBWS': None, 'id': 'shared', 'maxIOPS': 1000,
+                    'isShared': True}
+        self.assertEqual(expected, ret)
+
+    def test_get_backend_tag(self):
+        tag = utils.get_backend_tag('backend_1')
+        self.assertEqual(8, len(tag))
+        self.assertEqual(tag, utils.get_backend_tag('backend_1'))
+        self.assertNotEqual(tag, utils.get_backend_tag('backend_2'))
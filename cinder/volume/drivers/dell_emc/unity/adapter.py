@@ -13,16 +13,29 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import array
+import collections
 import contextlib
 import copy
 import functools
+import json
+import math
 import os
 import random
+import threading
+import time
+import uuid
 
+from eventlet import greenpool
+from eventlet import greenthread
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
+from oslo_service import loopingcall
 from oslo_utils import excutils
+from oslo_utils import fileutils
 from oslo_utils import importutils
+from oslo_utils import units
 
 storops = importutils.try_import('storops')
 if storops:
@@ -32,7 +45,9 @@ else:
     storops_ex = None
 
 from cinder import exception
-from cinder.i18n import _, _LE, _LI
+from cinder.i18n import _, _LE, _LI, _LW
+from cinder.image import image_utils
+from cinder.objects import fields
 from cinder import utils as cinder_utils
 from cinder.volume.drivers.dell_emc.unity import client
 from cinder.volume.drivers.dell_emc.unity import utils
@@ -57,6 +72,8 @@ class VolumeParams(object):
                              else volume.display_name)
         self._pool = None
         self._io_limit_policy = None
+        self._tiering_policy = None
+        self._provisioning = None
 
     @property
     def volume_id(self):
@@ -101,24 +118,813 @@ class VolumeParams(object):
         if self._io_limit_policy is None:
             qos_specs = utils.get_backend_qos_specs(self._volume)
             self._io_limit_policy = self._adapter.client.get_io_limit_policy(
-                qos_specs)
+                qos_specs, project_id=self._volume.project_id)
         return self._io_limit_policy
 
     @io_limit_policy.setter
     def io_limit_policy(self, value):
         self._io_limit_policy = value
 
+    @property
+    def tiering_policy(self):
+        if self._tiering_policy is None:
+            self._tiering_policy = self._adapter.client.get_tiering_policy(
+                utils.get_extra_spec(self._volume, utils.TIERING_POLICY_SPEC))
+        return self._tiering_policy
+
+    @property
+    def provisioning(self):
+        """The provisioning type of the volume, like thin or compressed."""
+        if self._provisioning is None:
+            self._provisioning = utils.get_provisioning_type(
+                utils.get_extra_spec(self._volume, utils.PROVISIONING_SPEC))
+        return self._provisioning
+
+    @property
+    def is_compression(self):
+        return self.provisioning == utils.PROVISIONING_COMPRESSED
+
+    @property
+    def is_thin(self):
+        return self.provisioning != utils.PROVISIONING_THICK
+
+    @property
+    def cg_id(self):
+        """The ID of the consistency group the volume is created in."""
+        if (self._volume.group_id and
+                vol_utils.is_group_a_cg_snapshot_type(self._volume.group)):
+            return self._volume.group_id
+        return None
+
     def __eq__(self, other):
         return (self.volume_id == other.volume_id
                 and self.name == other.name
                 and self.size == other.size
-                and self.io_limit_policy == other.io_limit_policy)
+                and self.io_limit_policy == other.io_limit_policy
+                and self.tiering_policy == other.tiering_policy)
+
+
+class CloneSnapshots(object):
+    """Internal snapshots taken on source LUNs for volume cloning.
+
+    A snapshot is shared by the clones of the same source LUN which are
+    requested within `window` seconds after it is taken, and is deleted when
+    the last of them releases it. Sharing is disabled if `window` is 0.
+
+    The clones copied via dd share the host attachment of the snapshot too,
+    which is detached when the last of them finishes copying.
+    """
+
+    def __init__(self, client, window=0):
+        self.client = client
+        self.window = window
+        self._lock = threading.Lock()
+        self._shared = {}
+        self._attached = {}
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['created_at'] < self.window
+
+    def _create(self, src_lun_id, snap_name):
+        snap = self.client.create_snap(src_lun_id, snap_name)
+        return {'snap': snap, 'created_at': time.time(), 'refs': 1}
+
+    def _acquire(self, src_lun_id, snap_name):
+        if self.window <= 0:
+            return self._create(src_lun_id, snap_name)
+
+        with lockutils.lock('unity-clone-snap-%s' % src_lun_id):
+            with self._lock:
+                entry = self._shared.get(src_lun_id)
+                if entry is not None and self._is_fresh(entry):
+                    entry['refs'] += 1
+                    LOG.debug('Share internal snapshot %(name)s of LUN '
+                              '%(lun_id)s, references: %(refs)s.',
+                              {'name': entry['snap'].name,
+                               'lun_id': src_lun_id,
+                               'refs': entry['refs']})
+                    return entry
+            entry = self._create(src_lun_id, snap_name)
+            with self._lock:
+                self._shared[src_lun_id] = entry
+            return entry
+
+    def _release(self, src_lun_id, entry):
+        with self._lock:
+            entry['refs'] -= 1
+            if entry['refs'] > 0:
+                return
+            if self._shared.get(src_lun_id) is entry:
+                del self._shared[src_lun_id]
+        utils.ignore_exception(self.client.delete_snap, entry['snap'])
+
+    @contextlib.contextmanager
+    def use(self, src_lun_id, snap_name):
+        """Provides an internal snapshot of the LUN. Used as a context.
+
+        :param src_lun_id: the ID of the source LUN.
+        :param snap_name: the name of the snapshot if a new one is needed.
+        """
+        entry = self._acquire(src_lun_id, snap_name)
+        try:
+            yield entry['snap']
+        finally:
+            self._release(src_lun_id, entry)
+
+    @contextlib.contextmanager
+    def attach(self, snap, connect):
+        """Attaches a snapshot to the host once for its concurrent users.
+
+        :param snap: the snapshot to attach.
+        :param connect: the function returning the context which attaches
+                        the snapshot, and detaches it on exit.
+        """
+        lock_name = 'unity-clone-snap-attach-%s' % snap.get_id()
+        with lockutils.lock(lock_name):
+            entry = self._attached.get(snap.get_id())
+            if entry is None:
+                context = connect()
+                entry = {'context': context, 'info': context.__enter__(),
+                         'refs': 0}
+                self._attached[snap.get_id()] = entry
+            entry['refs'] += 1
+        try:
+            yield entry['info']
+        finally:
+            with lockutils.lock(lock_name):
+                entry['refs'] -= 1
+                if entry['refs'] == 0:
+                    del self._attached[snap.get_id()]
+                    entry['context'].__exit__(None, None, None)
+
+
+class ImageCache(object):
+    """Image LUNs cached in the pools for creating volumes from images.
+
+    One image LUN per image per pool is filled from the image service once,
+    and the volumes are thin cloned from it. The image LUN is sized from the
+    virtual size of the image. When the thin clones of an image LUN reach the
+    limit of the array, the image LUN is retired and a new one is filled.
+    Image LUNs without thin clones are evicted in least recently used order
+    when a pool holds more than `max_count` of them.
+
+    An image LUN is filled, cloned and evicted under the lock of its name.
+    """
+
+    def __init__(self, adapter, max_count):
+        self.adapter = adapter
+        self.max_count = max_count
+        self._lock = threading.Lock()
+        self._lru = collections.OrderedDict()
+
+    @property
+    def client(self):
+        return self.adapter.client
+
+    @staticmethod
+    def _prefix(pool):
+        return 'image-%s-' % pool.get_id()
+
+    def _touch(self, name):
+        with self._lock:
+            self._lru.pop(name, None)
+            self._lru[name] = time.time()
+
+    @staticmethod
+    def _get_size(image_meta):
+        """Gets the size in GiB of the image LUN, or None if unknown."""
+        size = image_meta.get('virtual_size')
+        if not size and image_meta.get('disk_format') == 'raw':
+            size = image_meta.get('size')
+        return int(math.ceil(float(size) / units.Gi)) if size else None
+
+    def _evict(self, pool, keep):
+        contents = list(self.client.get_lun_contents(
+            [pool.get_id()], name_prefix=self._prefix(pool)))
+        excess = len(contents) - self.max_count
+        if excess <= 0:
+            return
+        with self._lock:
+            ranks = {name: i for i, name in enumerate(self._lru)}
+        # The image LUNs unknown to the LRU, like the retired ones or the
+        # ones created before the service started, are evicted first.
+        for content in sorted(contents,
+                              key=lambda c: ranks.get(c['name'], -1)):
+            if excess <= 0:
+                break
+            name = content['name']
+            if name == keep:
+                continue
+            with lockutils.lock(name):
+                # Checks again since it may be cloned after it is listed.
+                lun = self.client.get_lun(lun_id=content['id'])
+                if (lun is None or not lun.existed or lun.name != name
+                        or lun.family_clone_count):
+                    continue
+                LOG.info(_LI('Evict image LUN %s from cache.'), name)
+                utils.ignore_exception(self.client.delete_lun, lun.get_id())
+            with self._lock:
+                self._lru.pop(name, None)
+            excess -= 1
+        if excess > 0:
+            LOG.warning(_LW('Image cache of pool %(pool)s exceeds the limit '
+                            '%(max)s, but the other image LUNs have thin '
+                            'clones.'),
+                        {'pool': pool.name, 'max': self.max_count})
+
+    def _fill(self, context, name, pool, size, image_meta, image_service):
+        """Creates an image LUN and copies the image into it.
+
+        The LUN is filled under a temporary name and renamed when done, so
+        that a partially filled LUN is never used as the image LUN.
+        """
+        LOG.info(_LI('Create image LUN %(name)s for image %(image)s.'),
+                 {'name': name, 'image': image_meta['id']})
+        lun = self.client.create_lun(
+            name='tmp-%s' % name, size=size, pool=pool,
+            description='Image cache of %s.' % image_meta['id'])
+        try:
+            conn_props = cinder_utils.brick_get_connector_properties()
+            with self.adapter._connect_resource(lun, conn_props,
+                                                lun.get_id()) as conn:
+                image_utils.fetch_to_raw(
+                    context, image_service, image_meta['id'],
+                    conn['device']['path'],
+                    self.adapter.driver.configuration.volume_dd_blocksize,
+                    size=size)
+            lun.modify(name=name)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                utils.ignore_exception(self.client.delete_lun, lun.get_id())
+        return lun
+
+    def _get(self, context, name, pool, size, image_meta, image_service):
+        """Gets the image LUN, and whether it is filled just now."""
+        lun = self.client.get_lun(name=name)
+        if lun is not None and lun.existed:
+            return lun, False
+        return self._fill(context, name, pool, size, image_meta,
+                          image_service), True
+
+    def _rollover(self, context, name, full_lun, pool, image_meta,
+                  image_service):
+        lun = self.client.get_lun(name=name)
+        if (lun is not None and lun.existed
+                and lun.get_id() != full_lun.get_id()):
+            # Rolled over by another request.
+            return lun, False
+        retired_name = '%s-%s' % (name, full_lun.get_id())
+        LOG.info(_LI('Thin clones of image LUN %(name)s reach the limit, '
+                     'retire it as %(retired)s.'),
+                 {'name': name, 'retired': retired_name})
+        full_lun.modify(name=retired_name)
+        with self._lock:
+            self._lru.pop(name, None)
+        return self._fill(context, name, pool, full_lun.total_size_gb,
+                          image_meta, image_service), True
+
+    def _thin_clone(self, image_lun, vol_params, sp):
+        return self.client.thin_clone(
+            image_lun, vol_params.name,
+            description=vol_params.description,
+            io_limit_policy=vol_params.io_limit_policy,
+            new_size_gb=vol_params.size,
+            tiering_policy=vol_params.tiering_policy,
+            sp=sp)
+
+    def clone(self, context, vol_params, image_meta, image_service):
+        """Thin clones a volume from the cached LUN of the image.
+
+        :return: the cloned LUN, or None if the volume is smaller than the
+                 image LUN.
+        """
+        pool = vol_params.pool
+        name = self._prefix(pool) + image_meta['id']
+        size = self._get_size(image_meta) or vol_params.size
+        if size > vol_params.size:
+            LOG.debug('Volume %(vol)s is smaller than image %(image)s.',
+                      {'vol': vol_params.name, 'image': image_meta['id']})
+            return None
+        sp = self.adapter.choose_sp()
+        with lockutils.lock(name):
+            image_lun, filled = self._get(context, name, pool, size,
+                                          image_meta, image_service)
+            if image_lun.total_size_gb > vol_params.size:
+                LOG.debug('Volume %(vol)s is smaller than image LUN '
+                          '%(name)s.', {'vol': vol_params.name, 'name': name})
+                return None
+            try:
+                lun = self._thin_clone(image_lun, vol_params, sp)
+            except storops_ex.UnityThinCloneLimitExceededError:
+                image_lun, rolled = self._rollover(
+                    context, name, image_lun, pool, image_meta,
+                    image_service)
+                filled = filled or rolled
+                lun = self._thin_clone(image_lun, vol_params, sp)
+        self._touch(name)
+        if filled:
+            # Evicted out of the lock of the image, since the others are
+            # locked when evicted.
+            self._evict(pool, name)
+        return lun
+
+
+class WarmLuns(object):
+    """Thin LUNs created in advance in the pools for new volumes.
+
+    `depth` LUNs of each size in `sizes` are kept in each pool. A LUN is taken
+    and renamed when a volume of the same size is created in the pool, and
+    `refill` creates new ones in background. The pools with less than
+    `min_free_percent` free capacity are not refilled. The LUNs are named
+    with the tag of the backend, not to be taken by the others sharing the
+    array.
+    """
+
+    PREFIX = 'warm-'
+
+    def __init__(self, adapter, sizes, depth, min_free_percent):
+        self.adapter = adapter
+        self.sizes = sizes
+        self.depth = depth
+        self.min_free_percent = min_free_percent
+        self.prefix = '%s%s-' % (self.PREFIX, adapter.backend_tag)
+        self._lock = threading.Lock()
+        self._luns = collections.defaultdict(list)
+
+    @property
+    def client(self):
+        return self.adapter.client
+
+    def _name(self, pool_id, size):
+        return '%(prefix)s%(pool)s-%(size)s-%(uuid)s' % {
+            'prefix': self.prefix, 'pool': pool_id, 'size': size,
+            'uuid': uuid.uuid4().hex}
+
+    def load(self, pool_ids):
+        """Loads the warm LUNs left in the pools by the last run.
+
+        The LUNs of the sizes no longer in `sizes` are deleted.
+        """
+        for content in self.client.get_lun_contents(pool_ids,
+                                                    name_prefix=self.prefix):
+            name = content['name']
+            try:
+                pool_id, size, _uuid = name[len(self.prefix):].split('-', 2)
+                key = (pool_id, int(size))
+            except ValueError:
+                LOG.debug('Ignore LUN %s with unknown name format.', name)
+                continue
+            if key[1] not in self.sizes:
+                LOG.info(_LI('Delete warm LUN %s of the size no longer '
+                             'configured.'), name)
+                utils.ignore_exception(self.client.delete_lun, content['id'])
+                continue
+            lun = self.client.get_lun(lun_id=content['id'])
+            if lun is None:
+                continue
+            with self._lock:
+                self._luns[key].append(lun)
+
+    def take(self, pool, size):
+        """Takes a warm LUN of the size in the pool, or None if no one."""
+        with self._lock:
+            luns = self._luns.get((pool.get_id(), size))
+            return luns.pop(0) if luns else None
+
+    def _has_room(self, pool):
+        if not pool.size_total:
+            return False
+        return pool.size_free * 100.0 / pool.size_total >= (
+            self.min_free_percent)
+
+    def refill(self, pools):
+        """Creates the warm LUNs taken from the pools."""
+        for pool in pools:
+            if not self._has_room(pool):
+                LOG.debug('Skip refilling warm LUNs in pool %s which is '
+                          'short of free capacity.', pool.name)
+                continue
+            for size in self.sizes:
+                key = (pool.get_id(), size)
+                with self._lock:
+                    missing = self.depth - len(self._luns[key])
+                for _i in range(missing):
+                    lun = self.client.create_lun(
+                        name=self._name(*key), size=size, pool=pool,
+                        description='Warm LUN.', sp=self.adapter.choose_sp())
+                    with self._lock:
+                        self._luns[key].append(lun)
+
+    def reserved(self, pool):
+        """Gets the number and the total GiB of the warm LUNs in the pool."""
+        with self._lock:
+            counts = [(size, len(luns))
+                      for (pool_id, size), luns in self._luns.items()
+                      if pool_id == pool.get_id()]
+        return (sum(count for _size, count in counts),
+                sum(size * count for size, count in counts))
+
+
+class PerfSampler(object):
+    """IO metrics of the pools, smoothed over the samples.
+
+    `sample` sums up the IOPS and bandwidth of the LUNs in each pool, and
+    averages their response time weighted by IOPS. Each metric is smoothed by
+    the exponentially weighted moving average with the weight `alpha` of the
+    new sample. The busiest SP is reported for all the pools, since the LUNs
+    of a pool are owned by both SPs. The bandwidth of the Ethernet ports is
+    sampled too if `sample_ports`, to rank the iSCSI portals.
+    """
+
+    def __init__(self, client, alpha, sample_ports=False):
+        self.client = client
+        self.alpha = alpha
+        self.sample_ports = sample_ports
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._sp_utilization = None
+        self._ports = {}
+
+    def _smooth(self, old, new):
+        if old is None:
+            return new
+        return self.alpha * new + (1 - self.alpha) * old
+
+    def sample(self, pool_ids, lun_perf=None):
+        """Samples the metrics of the pools.
+
+        :param pool_ids: the IDs of the pools to sample.
+        :param lun_perf: the metrics of the LUNs returned by
+                         `UnityClient.get_lun_perf`, which are got if None.
+        """
+        if lun_perf is None:
+            lun_perf = self.client.get_lun_perf(pool_ids)
+        sums = {pool_id: [0.0, 0.0, 0.0] for pool_id in pool_ids}
+        for pool_id, iops, mbps, response_time in lun_perf.values():
+            if pool_id in sums:
+                sums[pool_id][0] += iops
+                sums[pool_id][1] += mbps
+                sums[pool_id][2] += iops * response_time
+        sp_utilization = max(
+            self.client.get_sp_utilization().values() or [0])
+        port_load = (self.client.get_ethernet_port_load()
+                     if self.sample_ports else {})
+        with self._lock:
+            for pool_id, (iops, mbps, weighted) in sums.items():
+                old = self._pools.get(pool_id, {})
+                self._pools[pool_id] = {
+                    'iops': self._smooth(old.get('iops'), iops),
+                    'mbps': self._smooth(old.get('mbps'), mbps),
+                    'response_time': self._smooth(
+                        old.get('response_time'),
+                        weighted / iops if iops else 0.0)}
+            self._sp_utilization = self._smooth(self._sp_utilization,
+                                                sp_utilization)
+            self._ports = {port_id: self._smooth(self._ports.get(port_id),
+                                                 load)
+                           for port_id, load in port_load.items()}
+
+    def get_port_load(self):
+        """Gets the smoothed bandwidth of each Ethernet port."""
+        with self._lock:
+            return dict(self._ports)
+
+    def get(self, pool):
+        """Gets the smoothed metrics of the pool as capabilities."""
+        with self._lock:
+            perf = self._pools.get(pool.get_id())
+            if perf is None:
+                return {}
+            return {'perf_iops': round(perf['iops'], 2),
+                    'perf_bandwidth_mbps': round(perf['mbps'], 2),
+                    'perf_response_time_us': round(perf['response_time'], 2),
+                    'perf_sp_utilization': round(self._sp_utilization, 2)}
+
+
+class LunTelemetry(object):
+    """Recent IO metrics of the LUNs of the volumes, for the hot volumes.
+
+    The last `size` samples of each tracked LUN are kept in a ring buffer
+    backed by an `array.array` of doubles, which holds the IOPS, bandwidth
+    and response time of each sample next to each other. The memory used is
+    fixed no matter how long the service runs. The ring of a LUN is dropped
+    after it misses `MAX_MISSES` samples in a row, like a deleted LUN.
+    """
+
+    FIELDS = 3
+    MAX_MISSES = 3
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        # {lun_id: volume_id}
+        self._volumes = {}
+        # {lun_id: [buffer, index of the next sample, count of samples,
+        #           count of the samples missed in a row]}
+        self._rings = {}
+
+    def track(self, lun_id, volume_id):
+        with self._lock:
+            self._volumes[lun_id] = volume_id
+
+    def untrack(self, lun_id):
+        with self._lock:
+            self._volumes.pop(lun_id, None)
+            self._rings.pop(lun_id, None)
+
+    def record(self, lun_perf):
+        """Records a sample of the tracked LUNs.
+
+        :param lun_perf: the metrics of the LUNs returned by
+                         `UnityClient.get_lun_perf`.
+        """
+        with self._lock:
+            for lun_id, ring in list(self._rings.items()):
+                if lun_id not in lun_perf:
+                    ring[3] += 1
+                    if ring[3] >= self.MAX_MISSES:
+                        del self._rings[lun_id]
+            for lun_id, (_pool_id, iops, mbps, response_time) in (
+                    lun_perf.items()):
+                if lun_id not in self._volumes:
+                    continue
+                ring = self._rings.get(lun_id)
+                if ring is None:
+                    ring = [array.array('d', [0.0]) *
+                            (self.size * self.FIELDS), 0, 0, 0]
+                    self._rings[lun_id] = ring
+                buf, index, count, _misses = ring
+                start = index * self.FIELDS
+                buf[start:start + self.FIELDS] = array.array(
+                    'd', (iops, mbps, response_time))
+                ring[1] = (index + 1) % self.size
+                ring[2] = min(count + 1, self.size)
+                ring[3] = 0
+
+    def top(self, count):
+        """Gets the volumes with the highest average IOPS.
+
+        :param count: the max count of the volumes to return.
+        :return: the list of the average metrics of the volumes, with the
+                 busiest volume first.
+        """
+        with self._lock:
+            averages = []
+            for lun_id, (buf, _index, filled, _misses) in (
+                    self._rings.items()):
+                volume_id = self._volumes.get(lun_id)
+                if volume_id is None or not filled:
+                    continue
+                # The unfilled slots are zeros, which add nothing to sums.
+                averages.append(
+                    (sum(buf[0::self.FIELDS]) / filled,
+                     sum(buf[1::self.FIELDS]) / filled,
+                     sum(buf[2::self.FIELDS]) / filled,
+                     volume_id))
+        averages.sort(key=lambda avg: avg[0], reverse=True)
+        return [{'volume_id': volume_id,
+                 'iops': round(iops, 2),
+                 'bandwidth_mbps': round(mbps, 2),
+                 'response_time_us': round(response_time, 2)}
+                for iops, mbps, response_time, volume_id
+                in averages[:count]]
+
+
+class SpBalancer(object):
+    """Chooses the SP to own each new LUN, to balance the load of the SPs.
+
+    The LUN count and CPU utilization of each SP are cached and refreshed in
+    background. The new LUN goes to the SP of the lowest LUN count scaled up
+    by its utilization. The cached count is increased on each choice so that
+    the LUNs created between the refreshes are spread too.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._utilization = {}
+
+    def refresh(self, pool_ids):
+        """Refreshes the LUN counts and the utilization of the SPs.
+
+        :param pool_ids: the IDs of the pools whose LUNs are counted.
+        """
+        counts = self.client.get_sp_lun_counts(pool_ids)
+        # Empty unless the performance metrics are enabled.
+        utilization = self.client.get_sp_utilization()
+        with self._lock:
+            self._counts = counts
+            self._utilization = utilization
+
+    def _score(self, sp_id):
+        return ((self._counts[sp_id] + 1) *
+                (1 + self._utilization.get(sp_id, 0) / 100.0))
+
+    def choose(self):
+        """Chooses the SP for a new LUN.
+
+        :return: the SP ID, or None to let the array choose if not refreshed
+                 yet.
+        """
+        with self._lock:
+            if not self._counts:
+                return None
+            sp_id = min(sorted(self._counts), key=self._score)
+            self._counts[sp_id] += 1
+            return sp_id
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+class ZoneMappingCache(object):
+    """Zone lookup service caching the fabric mappings for `ttl` seconds.
+
+    The mappings are keyed by the set of the initiator WWPNs and the set of
+    the target WWNs, so repeated attaches of the same host skip querying the
+    fabric switches. The mappings of a host are invalidated when its
+    connection fails.
+    """
+
+    def __init__(self, lookup_service, ttl):
+        self.lookup_service = lookup_service
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # {(initiators, targets): (expiration time, mapping)}
+        self._mappings = {}
+
+    @staticmethod
+    def _wwns(wwns):
+        return frozenset(wwn.lower() for wwn in wwns)
+
+    def get_device_mapping_from_network(self, initiator_wwns, target_wwns):
+        key = (self._wwns(initiator_wwns), self._wwns(target_wwns))
+        now = time.time()
+        with self._lock:
+            cached = self._mappings.get(key)
+            if cached is not None and cached[0] > now:
+                return copy.deepcopy(cached[1])
+        mapping = self.lookup_service.get_device_mapping_from_network(
+            initiator_wwns, target_wwns)
+        with self._lock:
+            for old_key, (expiration, _mapping) in list(
+                    self._mappings.items()):
+                if expiration <= now:
+                    del self._mappings[old_key]
+            self._mappings[key] = (now + self.ttl, mapping)
+        return copy.deepcopy(mapping)
+
+    def invalidate(self, initiator_wwns):
+        """Invalidates the mappings of any of the initiators."""
+        initiators = self._wwns(initiator_wwns)
+        with self._lock:
+            for key in list(self._mappings):
+                if key[0] & initiators:
+                    del self._mappings[key]
+
+
+class DeferredDeletes(object):
+    """LUNs and snapshots to delete in background.
+
+    The resources are recorded in a local queue file, which is written
+    atomically, before being renamed into the tombstone namespace of the
+    backend, so that no resource is lost if the service stops. `reap` deletes
+    one of them in the order of snapshots, thin clones and other LUNs. A
+    deletion failed more than `max_retries` times is retried after the
+    others.
+    """
+
+    PREFIX = 'tombstone-'
+
+    def __init__(self, client, path, max_retries, tag):
+        self.client = client
+        self.path = path
+        self.max_retries = max_retries
+        self.prefix = '%s%s-' % (self.PREFIX, tag)
+        self._lock = threading.Lock()
+        self._entries = []
+        self._seq = 0
+
+    def _save(self):
+        tmp_path = '%s.tmp' % self.path
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as ex:
+            # The resources are still renamed into the tombstone namespace,
+            # and found again by `load` if the service restarts.
+            LOG.error(_LE('Failed to save the deferred deletions to %(path)s. '
+                          'Error: %(err)s.'), {'path': self.path, 'err': ex})
+
+    def load(self, pool_ids, even_attached=False):
+        """Loads the queue, and the tombstones missing in it.
+
+        :param pool_ids: the IDs of the pools to find the tombstones in.
+        :param even_attached: whether to delete the tombstone snapshots even
+                              attached.
+        """
+        fileutils.ensure_tree(os.path.dirname(self.path))
+        with self._lock:
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    self._entries = json.load(f)
+            self._seq = max([e['seq'] for e in self._entries] or [0])
+        queued = {(e['type'], e['id']) for e in self._entries}
+        for content in self.client.get_lun_contents(pool_ids,
+                                                    name_prefix=self.prefix):
+            if ('lun', content['id']) in queued:
+                continue
+            lun = self.client.get_lun(lun_id=content['id'])
+            if lun is None:
+                continue
+            LOG.info(_LI('Found tombstone LUN %s missing in the queue.'),
+                     content['name'])
+            self.add('lun', content['id'], is_clone=lun.is_thin_clone)
+        for content in self.client.get_snap_contents(pool_ids,
+                                                     name_prefix=self.prefix):
+            if ('snap', content['id']) not in queued:
+                LOG.info(_LI('Found tombstone snapshot %s missing in the '
+                             'queue.'), content['name'])
+                self.add('snap', content['id'], even_attached=even_attached)
+
+    def add(self, res_type, res_id, is_clone=False, even_attached=False):
+        """Records a LUN or snapshot to delete.
+
+        :param res_type: 'lun' or 'snap'.
+        :param res_id: the ID of the LUN or snapshot.
+        :param is_clone: whether the LUN is a thin clone.
+        :param even_attached: whether to delete the snapshot even attached.
+        """
+        with self._lock:
+            self._seq += 1
+            self._entries.append({'type': res_type, 'id': res_id,
+                                  'is_clone': is_clone,
+                                  'even_attached': even_attached,
+                                  'attempts': 0, 'seq': self._seq})
+            self._save()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _order(self, entry):
+        return (entry['attempts'] > self.max_retries,
+                entry['type'] != 'snap', not entry['is_clone'],
+                entry['attempts'], entry['seq'])
+
+    def _delete(self, entry):
+        if entry['type'] == 'lun':
+            self.client.delete_lun(entry['id'])
+        else:
+            self.client.delete_snap(
+                self.client.get_snap(snap_id=entry['id']),
+                even_attached=entry['even_attached'])
+
+    def reap(self):
+        """Deletes the first LUN or snapshot in the queue."""
+        with self._lock:
+            if not self._entries:
+                return
+            entry = min(self._entries, key=self._order)
+        try:
+            self._delete(entry)
+        except Exception as ex:
+            with self._lock:
+                entry['attempts'] += 1
+                if entry['attempts'] > self.max_retries:
+                    LOG.error(_LE('Failed to delete %(type)s %(id)s after '
+                                  '%(count)s retries, will retry it after '
+                                  'the others. Error: %(err)s.'),
+                              {'type': entry['type'], 'id': entry['id'],
+                               'count': entry['attempts'] - 1, 'err': ex})
+                else:
+                    LOG.warning(_LW('Failed to delete %(type)s %(id)s, will '
+                                    'retry it. Error: %(err)s.'),
+                                {'type': entry['type'], 'id': entry['id'],
+                                 'err': ex})
+                self._save()
+            return
+        LOG.debug('Deferred deletion of %(type)s %(id)s is done.',
+                  {'type': entry['type'], 'id': entry['id']})
+        with self._lock:
+            self._entries.remove(entry)
+            self._save()
 
 
 class CommonAdapter(object):
     protocol = 'unknown'
     driver_name = 'UnityAbstractDriver'
     driver_volume_type = 'unknown'
+    # Name prefixes of the LUNs and snapshots created by the driver itself.
+    INTERNAL_LUN_PREFIXES = (WarmLuns.PREFIX, DeferredDeletes.PREFIX,
+                             'image-', 'tmp-image-', 'hidden-')
+    INTERNAL_SNAP_PREFIXES = (DeferredDeletes.PREFIX, 'snap_clone_')
 
     def __init__(self, version=None):
         self.version = version
@@ -127,6 +933,7 @@ class CommonAdapter(object):
         self.configured_pool_names = None
         self.reserved_percentage = None
         self.max_over_subscription_ratio = None
+        self.over_subscription_data_reduction = False
         self.volume_backend_name = None
         self.ip = None
         self.username = None
@@ -139,6 +946,25 @@ class CommonAdapter(object):
         self._client = None
         self.allowed_ports = None
         self.force_delete_attached_snapshots = False
+        self.clone_snapshots = None
+        self.group_clone_workers = None
+        self.image_cache = None
+        self.warm_luns = None
+        self._warm_luns_refiller = None
+        self.deferred_deletes = None
+        self._deferred_deletes_reaper = None
+        self.perf_sampler = None
+        self._perf_sampler_timer = None
+        self.hot_volume_count = 0
+        self.lun_telemetry = None
+        self.sp_balancer = None
+        self._sp_balancer_refresher = None
+        # Tag of the backend in the names of its tombstones and warm LUNs.
+        self.backend_tag = None
+        # LUN IDs and pool names by volume name, listed in bulk at the
+        # service start and taken once by `get_lun_id` and `get_pool_name`.
+        self._lun_ids = {}
+        self._pool_names = {}
 
     def do_setup(self, driver, conf):
         self.driver = driver
@@ -147,6 +973,8 @@ class CommonAdapter(object):
         self.reserved_percentage = self.config.reserved_percentage
         self.max_over_subscription_ratio = (
             self.config.max_over_subscription_ratio)
+        self.over_subscription_data_reduction = (
+            self.config.unity_over_subscription_data_reduction)
         self.volume_backend_name = (
             self.config.safe_get('volume_backend_name') or self.driver_name)
         self.ip = self.config.san_ip
@@ -164,19 +992,79 @@ class CommonAdapter(object):
                        'Upgrade to 4.1 or later.') % sys_version)
 
         self.storage_pools_map = self.get_managed_pools()
+        group_name = (self.config.config_group if self.config.config_group
+                      else 'DEFAULT')
+        self.backend_tag = utils.get_backend_tag(group_name)
 
         self.allowed_ports = self.validate_ports(self.config.unity_io_ports)
 
         self.force_delete_attached_snapshots = (
             self.config.force_delete_attached_snapshots)
 
-        group_name = (self.config.config_group if self.config.config_group
-                      else 'DEFAULT')
+        self.clone_snapshots = CloneSnapshots(
+            self.client, self.config.unity_clone_snapshot_share_window)
+        self.group_clone_workers = self.config.unity_group_clone_workers
+        if self.config.unity_job_batch_size > 1:
+            self.client.enable_jobs(self.config.unity_job_batch_size,
+                                    self.config.unity_job_batch_window,
+                                    timeout=self.config.unity_job_timeout)
+        if self.config.unity_image_cache_enabled:
+            self.image_cache = ImageCache(
+                self, self.config.unity_image_cache_max_count)
+        if self.config.unity_warm_lun_sizes:
+            self.warm_luns = WarmLuns(
+                self, self.config.unity_warm_lun_sizes,
+                self.config.unity_warm_lun_depth,
+                self.config.unity_warm_lun_min_free_percent)
+            self.warm_luns.load(
+                [pool.get_id() for pool in self.storage_pools_map.values()])
+            self._warm_luns_refiller = loopingcall.FixedIntervalLoopingCall(
+                self._refill_warm_luns)
+            self._warm_luns_refiller.start(
+                interval=self.config.unity_warm_lun_refill_interval,
+                initial_delay=0)
+
         folder_name = '%(group)s.%(sys_name)s' % {
             'group': group_name, 'sys_name': self.client.system.info.name}
         persist_path = os.path.join(cfg.CONF.state_path, 'unity', folder_name)
         storops.TCHelper.set_up(persist_path)
 
+        if self.config.unity_deferred_delete:
+            self.deferred_deletes = DeferredDeletes(
+                self.client, os.path.join(persist_path, 'deferred_deletes'),
+                self.config.unity_deferred_delete_max_retries,
+                self.backend_tag)
+            self.deferred_deletes.load(
+                [pool.get_id() for pool in self.storage_pools_map.values()],
+                even_attached=self.force_delete_attached_snapshots)
+            self._deferred_deletes_reaper = (
+                loopingcall.FixedIntervalLoopingCall(
+                    self.deferred_deletes.reap))
+            self._deferred_deletes_reaper.start(
+                interval=60.0 / self.config.unity_deferred_delete_rate)
+
+        if self.config.unity_perf_sample_interval:
+            self.client.enable_perf_stats(
+                self.config.unity_perf_sample_interval)
+            self.perf_sampler = PerfSampler(
+                self.client, self.config.unity_perf_smoothing_factor,
+                sample_ports=(self.protocol == PROTOCOL_ISCSI))
+            self.hot_volume_count = self.config.unity_hot_volume_count
+            if self.hot_volume_count:
+                self.lun_telemetry = LunTelemetry(
+                    self.config.unity_telemetry_samples)
+            self._perf_sampler_timer = loopingcall.FixedIntervalLoopingCall(
+                self._sample_perf)
+            self._perf_sampler_timer.start(
+                interval=self.config.unity_perf_sample_interval)
+
+        if self.config.unity_sp_balanced_placement:
+            self.sp_balancer = SpBalancer(self.client)
+            self._sp_balancer_refresher = (
+                loopingcall.FixedIntervalLoopingCall(self._refresh_sp_balance))
+            self._sp_balancer_refresher.start(
+                interval=self.config.unity_sp_balance_refresh_interval)
+
     def normalize_config(self, config):
         config.unity_storage_pool_names = utils.remove_empty(
             '%s.unity_storage_pool_names' % config.config_group,
@@ -238,7 +1126,8 @@ class CommonAdapter(object):
                 self.ip,
                 self.username,
                 self.password,
-                verify_cert=self.verify_cert)
+                verify_cert=self.verify_cert,
+                move_session_timeout=self.config.unity_move_session_timeout)
         return self._client
 
     @property
@@ -253,8 +1142,10 @@ class CommonAdapter(object):
         valid_names = utils.validate_pool_names(names, array_pools.name)
         return {p.name: p for p in array_pools if p.name in valid_names}
 
-    def makeup_model(self, lun, is_snap_lun=False):
+    def makeup_model(self, lun, is_snap_lun=False, volume_id=None):
         lun_type = 'snap_lun' if is_snap_lun else 'lun'
+        if volume_id is not None:
+            self._track_volume(lun.get_id(), volume_id)
         location = self._build_provider_location(lun_id=lun.get_id(),
                                                  lun_type=lun_type)
         return {
@@ -262,6 +1153,74 @@ class CommonAdapter(object):
             'provider_id': lun.get_id()
         }
 
+    def _track_volume(self, lun_id, volume_id):
+        if self.lun_telemetry is not None:
+            self.lun_telemetry.track(lun_id, volume_id)
+
+    def update_provider_info(self, volumes, snapshots):
+        """Backfills the IDs of the volumes and snapshots in bulk.
+
+        The LUNs and snapshots of the managed pools are listed page by page
+        and matched by name, instead of one query for each volume or
+        snapshot. The LUN IDs and pool names of the volumes without them are
+        also kept for their first `get_lun_id` and `get_pool_name` during
+        init_host, see `clear_listed_luns`.
+        """
+        snapshots_update = None
+        pool_ids = [pool.get_id() for pool in self.storage_pools_map.values()]
+        try:
+            names = {volume.name for volume in volumes
+                     if not volume.provider_location or not volume.host or
+                     utils.get_pool_name(volume) is None}
+            if names:
+                self._list_luns(names, pool_ids)
+        except Exception as ex:
+            LOG.warning(_LW('Failed to list the LUNs to update the provider '
+                            'info. Error: %s.'), ex)
+        volumes_update = self._get_volumes_update(volumes)
+
+        try:
+            if any(not snap.provider_id for snap in snapshots):
+                snap_ids = {content['name']: content['id'] for content in
+                            self.client.get_snap_contents(pool_ids)}
+                # Every snapshot without the provider ID needs an update,
+                # otherwise cinder fails to sync the snapshots.
+                snapshots_update = [
+                    {'id': snap.id, 'provider_id': snap_ids.get(snap.name)}
+                    for snap in snapshots if not snap.provider_id]
+        except Exception as ex:
+            LOG.warning(_LW('Failed to list the snapshots to update the '
+                            'provider info. Error: %s.'), ex)
+        return volumes_update, snapshots_update
+
+    def _list_luns(self, names, pool_ids):
+        pool_names = {pool.get_id(): name
+                      for name, pool in self.storage_pools_map.items()}
+        for content in self.client.get_lun_contents(pool_ids):
+            if content['name'] in names:
+                self._lun_ids[content['name']] = content['id']
+                self._pool_names[content['name']] = pool_names.get(
+                    content['pool']['id'])
+
+    def clear_listed_luns(self):
+        """Drops the LUN IDs and pool names listed at the service start."""
+        self._lun_ids.clear()
+        self._pool_names.clear()
+
+    def _get_volumes_update(self, volumes):
+        volumes_update = []
+        for volume in volumes:
+            lun_id = (utils.extract_provider_location(
+                volume.provider_location, 'id') or
+                self._lun_ids.get(volume.name))
+            if lun_id is None:
+                continue
+            self._track_volume(lun_id, volume.id)
+            if volume.provider_id != lun_id:
+                volumes_update.append({'id': volume.id,
+                                       'provider_id': lun_id})
+        return volumes_update
+
     def create_volume(self, volume):
         """Creates a volume.
 
@@ -273,18 +1232,89 @@ class CommonAdapter(object):
             'size': params.size,
             'description': params.description,
             'pool': params.pool,
-            'io_limit_policy': params.io_limit_policy}
+            'io_limit_policy': params.io_limit_policy,
+            'tiering_policy': params.tiering_policy}
 
         LOG.info(_LI('Create Volume: %(name)s, size: %(size)s, description: '
                      '%(description)s, pool: %(pool)s, io limit policy: '
-                     '%(io_limit_policy)s.'), log_params)
+                     '%(io_limit_policy)s, tiering policy: '
+                     '%(tiering_policy)s.'), log_params)
+
+        lun = None
+        # The warm LUNs are thin LUNs without data reduction.
+        if (self.warm_luns is not None
+                and params.provisioning == utils.PROVISIONING_THIN):
+            lun = self._take_warm_lun(params)
+        if lun is None:
+            lun = self.client.create_lun(
+                name=params.name,
+                size=params.size,
+                pool=params.pool,
+                description=params.description,
+                io_limit_policy=params.io_limit_policy,
+                tiering_policy=params.tiering_policy,
+                is_compression=params.is_compression,
+                is_thin=params.is_thin,
+                sp=self.choose_sp())
+        self._add_to_cg(params, lun)
+        return self.makeup_model(lun, volume_id=params.volume_id)
+
+    def _add_to_cg(self, params, lun):
+        if params.cg_id:
+            LOG.debug('Add LUN %(lun)s to CG %(cg)s.',
+                      {'lun': lun.get_id(), 'cg': params.cg_id})
+            self.client.update_cg(params.cg_id, [lun.get_id()], [])
+
+    def _take_warm_lun(self, params):
+        lun = self.warm_luns.take(params.pool, params.size)
+        if lun is None:
+            return None
+        try:
+            lun.modify(name=params.name, description=params.description,
+                       io_limit_policy=params.io_limit_policy,
+                       tiering_policy=params.tiering_policy)
+        except storops_ex.StoropsException as ex:
+            LOG.warning(_LW('Failed to take warm LUN %(lun)s for volume '
+                            '%(vol)s. Error: %(err)s.'),
+                        {'lun': lun.name, 'vol': params.name, 'err': ex})
+            utils.ignore_exception(self.client.delete_lun, lun.get_id())
+            return None
+        LOG.debug('Warm LUN %(lun)s is taken for volume %(vol)s.',
+                  {'lun': lun.get_id(), 'vol': params.name})
+        return lun
+
+    def _refill_warm_luns(self):
+        try:
+            pools = [pool for pool in self.client.get_pools()
+                     if pool.name in self.storage_pools_map]
+            self.warm_luns.refill(pools)
+        except Exception as ex:
+            LOG.warning(_LW('Failed to refill warm LUNs. Error: %s.'), ex)
 
-        return self.makeup_model(
-            self.client.create_lun(name=params.name,
-                                   size=params.size,
-                                   pool=params.pool,
-                                   description=params.description,
-                                   io_limit_policy=params.io_limit_policy))
+    def _sample_perf(self):
+        try:
+            pool_ids = [pool.get_id()
+                        for pool in self.storage_pools_map.values()]
+            lun_perf = self.client.get_lun_perf(pool_ids)
+            self.perf_sampler.sample(pool_ids, lun_perf)
+            if self.lun_telemetry is not None:
+                self.lun_telemetry.record(lun_perf)
+        except Exception as ex:
+            LOG.warning(_LW('Failed to sample IO metrics. Error: %s.'), ex)
+
+    def _refresh_sp_balance(self):
+        try:
+            self.sp_balancer.refresh(
+                [pool.get_id() for pool in self.storage_pools_map.values()])
+        except Exception as ex:
+            LOG.warning(_LW('Failed to refresh the LUN counts of SPs. '
+                            'Error: %s.'), ex)
+
+    def choose_sp(self):
+        """Chooses the SP to own a new LUN, None to let the array choose."""
+        if self.sp_balancer is None:
+            return None
+        return self.sp_balancer.choose()
 
     def delete_volume(self, volume):
         lun_id = self.get_lun_id(volume)
@@ -292,16 +1322,37 @@ class CommonAdapter(object):
             LOG.info(_LI('Backend LUN not found, skipping the deletion. '
                          'Volume: %(volume_name)s.'),
                      {'volume_name': volume.name})
+            return
+        if self.lun_telemetry is not None:
+            self.lun_telemetry.untrack(lun_id)
+        if self.deferred_deletes is not None:
+            self._defer_delete_lun(lun_id)
         else:
             self.client.delete_lun(lun_id)
 
+    def _defer_delete_lun(self, lun_id):
+        lun = self.client.get_lun(lun_id=lun_id)
+        if lun is None:
+            return
+        self.deferred_deletes.add('lun', lun_id, is_clone=lun.is_thin_clone)
+        utils.ignore_exception(
+            lun.modify, name=self.deferred_deletes.prefix + lun_id)
+        if lun.io_limit_policy is not None and lun.io_limit_policy.is_shared:
+            # The tombstone LUN leaves the shared policy of the project at
+            # once instead of at its deletion.
+            utils.ignore_exception(
+                self.client.update_lun_io_limit_policy, lun, None)
+        LOG.debug('Deletion of LUN %s is deferred.', lun_id)
+
     @cinder_utils.trace
-    def _initialize_connection(self, lun_or_snap, connector, vol_id):
+    def _initialize_connection(self, lun_or_snap, connector, vol_id,
+                               owner_sp=None):
         host = self.client.create_host(connector['host'])
         self.client.update_host_initiators(
             host, self.get_connector_uids(connector))
         hlu = self.client.attach(host, lun_or_snap)
-        data = self.get_connection_info(hlu, host, connector)
+        data = self.get_connection_info(hlu, host, connector,
+                                        owner_sp=owner_sp)
         data['target_discovered'] = True
         if vol_id is not None:
             data['volume_id'] = vol_id
@@ -315,7 +1366,9 @@ class CommonAdapter(object):
     @cinder_utils.trace
     def initialize_connection(self, volume, connector):
         lun = self.client.get_lun(lun_id=self.get_lun_id(volume))
-        return self._initialize_connection(lun, connector, volume.id)
+        return self._initialize_connection(
+            lun, connector, volume.id,
+            owner_sp=self.client.get_owner_sp(lun))
 
     @cinder_utils.trace
     def _terminate_connection(self, lun_or_snap, connector):
@@ -330,7 +1383,15 @@ class CommonAdapter(object):
     def get_connector_uids(self, connector):
         return None
 
-    def get_connection_info(self, hlu, host, connector):
+    def invalidate_zone_mapping(self, connector):
+        pass
+
+    def get_connection_info(self, hlu, host, connector, owner_sp=None):
+        """Gets the connection info of the targets.
+
+        The targets on the SP owning the LUN, `owner_sp`, are the optimized
+        paths of ALUA, so they are listed first and used as the primary.
+        """
         return {}
 
     def extend_volume(self, volume, new_size):
@@ -341,6 +1402,172 @@ class CommonAdapter(object):
             raise exception.VolumeBackendAPIException(data=msg)
         else:
             self.client.extend_lun(lun_id, new_size)
+            qos_specs = utils.get_backend_qos_specs(volume)
+            if utils.is_density_based_qos(qos_specs):
+                # Re-applies the policy to recompute its limits for the new
+                # size of the LUN.
+                try:
+                    self.client.update_lun_io_limit_policy(
+                        self.client.get_lun(lun_id=lun_id),
+                        self.client.get_io_limit_policy(
+                            qos_specs, project_id=volume.project_id))
+                except storops_ex.UnityNothingToModifyError:
+                    LOG.debug('IO limit policy of LUN %s is not changed.',
+                              lun_id)
+                except storops_ex.StoropsException as ex:
+                    # The LUN is extended already, not to fail the extension.
+                    LOG.warning(_LW('Failed to update the IO limit policy of '
+                                    'extended LUN %(lun)s. Error: %(err)s.'),
+                                {'lun': lun_id, 'err': ex})
+
+    def migrate_volume(self, volume, host):
+        """Moves the LUN of the volume to a pool of the same Unity.
+
+        Returns `(False, None)` to fall back to the host-assisted migration
+        if the destination is not on this Unity or the LUN cannot be moved by
+        the array, like thin clones and LUNs with thin clones.
+        """
+        location_info = host['capabilities'].get('location_info')
+        try:
+            dest_pool_name, serial = location_info.split('|')
+        except (AttributeError, ValueError):
+            LOG.debug('Invalid location info %s of destination host, falling '
+                      'back to host-assisted migration.', location_info)
+            return False, None
+        if serial != self.serial_number:
+            LOG.debug('Destination host is on another array %s, falling back '
+                      'to host-assisted migration.', serial)
+            return False, None
+
+        lun = self.client.get_lun(lun_id=self.get_lun_id(volume))
+        if lun.pool.name == dest_pool_name:
+            LOG.debug('LUN %(lun)s is already in pool %(pool)s.',
+                      {'lun': lun.get_id(), 'pool': dest_pool_name})
+            return True, None
+        dest_pool = self._get_movable_dest_pool(lun, dest_pool_name)
+        if dest_pool is None:
+            return False, None
+
+        LOG.info(_LI('Move LUN %(lun)s of volume %(vol)s to pool %(pool)s.'),
+                 {'lun': lun.get_id(), 'vol': volume.name,
+                  'pool': dest_pool_name})
+        if not self.client.migrate_lun(lun, dest_pool):
+            return False, None
+        return True, None
+
+    def _get_movable_dest_pool(self, lun, dest_pool_name):
+        """Gets the pool which the LUN can be moved to by the array.
+
+        :return: the destination `UnityPool`, or None if the LUN cannot be
+                 moved to it by the array.
+        """
+        if lun.is_thin_clone or lun.family_clone_count:
+            LOG.info(_LI('LUN %s is in a thin clone family which cannot be '
+                         'moved by array, falling back to host-assisted '
+                         'migration.'), lun.get_id())
+            return None
+        dest_pool = {p.name: p for p in self.client.get_pools()}.get(
+            dest_pool_name)
+        if dest_pool is None:
+            LOG.debug('Pool %s not found, falling back to host-assisted '
+                      'migration.', dest_pool_name)
+        return dest_pool
+
+    def retype(self, volume, new_type, diff, host):
+        """Changes the type of the volume in place on the LUN.
+
+        The data reduction, tiering policy and IO limit policy of the LUN are
+        changed in place, and the LUN is moved by the array only when the
+        pool changes. The LUN is moved first, so that nothing is changed if
+        the move fails. A change from or to thick provisioning needs a new
+        LUN.
+
+        :return: True if the volume is retyped without data copy through the
+                 host, otherwise False to let Block Storage migrate it.
+        """
+        lun = self.client.get_lun(lun_id=self.get_lun_id(volume))
+        dest_pool_name = vol_utils.extract_host(host['host'], 'pool')
+        dest_pool = None
+        if dest_pool_name != lun.pool.name:
+            dest_pool = self._get_movable_dest_pool(lun, dest_pool_name)
+            if dest_pool is None:
+                return False
+
+        old_provisioning = utils.get_provisioning_type(
+            utils.get_extra_spec(volume, utils.PROVISIONING_SPEC))
+        new_provisioning = utils.get_provisioning_type(
+            utils.get_extra_spec_of_type(new_type['id'],
+                                         utils.PROVISIONING_SPEC))
+        if (old_provisioning != new_provisioning
+                and utils.PROVISIONING_THICK in (old_provisioning,
+                                                 new_provisioning)):
+            LOG.debug('LUN %(lun)s cannot be converted from %(old)s to '
+                      '%(new)s in place, falling back to migration.',
+                      {'lun': lun.get_id(), 'old': old_provisioning,
+                       'new': new_provisioning})
+            return False
+
+        if dest_pool is not None:
+            LOG.info(_LI('Move LUN %(lun)s of volume %(vol)s to pool '
+                         '%(pool)s for retype.'),
+                     {'lun': lun.get_id(), 'vol': volume.name,
+                      'pool': dest_pool_name})
+            if not self.client.migrate_lun(
+                    lun, dest_pool, is_compression=(
+                        new_provisioning == utils.PROVISIONING_COMPRESSED)):
+                return False
+
+        old_tiering = utils.get_extra_spec(volume, utils.TIERING_POLICY_SPEC)
+        new_tiering = utils.get_extra_spec_of_type(new_type['id'],
+                                                   utils.TIERING_POLICY_SPEC)
+        if old_tiering != new_tiering:
+            tiering_policy = self.client.get_tiering_policy(
+                new_tiering or utils.DEFAULT_TIERING_POLICY)
+            LOG.info(_LI('Change tiering policy of LUN %(lun)s to '
+                         '%(policy)s.'),
+                     {'lun': lun.get_id(), 'policy': tiering_policy})
+            if not self._modify_for_retype(lun,
+                                           tiering_policy=tiering_policy):
+                return False
+
+        if dest_pool is None and old_provisioning != new_provisioning:
+            # The data reduction of a moved LUN is set by the move session.
+            is_compression = (
+                new_provisioning == utils.PROVISIONING_COMPRESSED)
+            LOG.info(_LI('Change data reduction of LUN %(lun)s to '
+                         '%(enabled)s.'),
+                     {'lun': lun.get_id(), 'enabled': is_compression})
+            if not self._modify_for_retype(lun,
+                                           is_compression=is_compression):
+                return False
+
+        old_qos_specs = utils.get_backend_qos_specs(volume)
+        new_qos_specs = utils.get_backend_qos_specs_of_type(new_type['id'])
+        if old_qos_specs != new_qos_specs:
+            LOG.info(_LI('Change QoS of LUN %(lun)s from %(old)s to '
+                         '%(new)s.'),
+                     {'lun': lun.get_id(), 'old': old_qos_specs,
+                      'new': new_qos_specs})
+            self.client.update_lun_io_limit_policy(
+                lun, self.client.get_io_limit_policy(
+                    new_qos_specs, project_id=volume.project_id))
+
+        LOG.info(_LI('Volume %(vol)s is retyped to %(type)s in place without '
+                     'data copy through host.'),
+                 {'vol': volume.name, 'type': new_type['id']})
+        return True
+
+    @staticmethod
+    def _modify_for_retype(lun, **kwargs):
+        try:
+            lun.modify(**kwargs)
+            return True
+        except storops_ex.StoropsException as err:
+            LOG.warning(_LW('Failed to modify LUN %(lun)s with %(attrs)s for '
+                            'retype, falling back to migration. Error: '
+                            '%(err)s.'),
+                        {'lun': lun.get_id(), 'attrs': kwargs, 'err': err})
+            return False
 
     def _get_target_pool(self, volume):
         return self.storage_pools_map[utils.get_pool_name(volume)]
@@ -353,13 +1580,19 @@ class CommonAdapter(object):
             version=self.version)
 
     def update_volume_stats(self):
-        return {
+        stats = {
             'volume_backend_name': self.volume_backend_name,
             'storage_protocol': self.protocol,
             'thin_provisioning_support': True,
-            'thick_provisioning_support': False,
+            'thick_provisioning_support': True,
             'pools': self.get_pools_stats(),
         }
+        if self.lun_telemetry is not None:
+            stats['hot_volumes'] = self.lun_telemetry.top(
+                self.hot_volume_count)
+        if self.sp_balancer is not None:
+            stats['sp_lun_counts'] = self.sp_balancer.get_stats()
+        return stats
 
     def get_pools_stats(self):
         self.storage_pools_map = self.get_managed_pools()
@@ -369,21 +1602,57 @@ class CommonAdapter(object):
     def pools(self):
         return self.storage_pools_map.values()
 
+    @staticmethod
+    def _get_data_reduction(pool):
+        """Gets the data reduction ratio and saved bytes of the pool.
+
+        The compression ones are used on the Unity before 4.3, which does not
+        report data reduction.
+        """
+        ratio = pool.data_reduction_ratio
+        saved = pool.data_reduction_size_saved
+        if ratio is None:
+            ratio = pool.compression_ratio
+            saved = pool.compression_size_saved
+        return ratio or 1.0, saved or 0
+
     def _get_pool_stats(self, pool):
-        return {
+        warm_luns, warm_luns_gb = (self.warm_luns.reserved(pool)
+                                   if self.warm_luns is not None else (0, 0))
+        data_reduction_ratio, saved = self._get_data_reduction(pool)
+        max_over_subscription_ratio = self.max_over_subscription_ratio
+        if self.over_subscription_data_reduction and data_reduction_ratio > 1:
+            max_over_subscription_ratio *= data_reduction_ratio
+        stats = {
             'pool_name': pool.name,
             'total_capacity_gb': utils.byte_to_gib(pool.size_total),
             'provisioned_capacity_gb': utils.byte_to_gib(
-                pool.size_subscribed),
+                pool.size_subscribed) - warm_luns_gb,
+            'warm_luns': warm_luns,
+            'warm_luns_capacity_gb': warm_luns_gb,
             'free_capacity_gb': utils.byte_to_gib(pool.size_free),
             'reserved_percentage': self.reserved_percentage,
             'location_info': ('%(pool_name)s|%(array_serial)s' %
                               {'pool_name': pool.name,
                                'array_serial': self.serial_number}),
             'thin_provisioning_support': True,
-            'thick_provisioning_support': False,
-            'max_over_subscription_ratio': (
-                self.max_over_subscription_ratio)}
+            'thick_provisioning_support': True,
+            'consistent_group_snapshot_enabled': True,
+            'fast_cache': pool.is_fast_cache_enabled,
+            'compression_support': pool.is_all_flash,
+            'data_reduction_ratio': data_reduction_ratio,
+            'data_reduction_saved_gb': utils.byte_to_gib(saved),
+            'max_over_subscription_ratio': max_over_subscription_ratio}
+        if self.perf_sampler is not None:
+            stats.update(self.perf_sampler.get(pool))
+        # The free capacity of each tier with disks, like
+        # `extreme_performance_tier_free_capacity_gb`.
+        for tier in pool.tiers:
+            if tier.size_total:
+                key = '%s_tier_free_capacity_gb' % tier.name.lower().replace(
+                    ' ', '_')
+                stats[key] = utils.byte_to_gib(tier.size_free)
+        return stats
 
     def get_lun_id(self, volume):
         """Retrieves id of the volume's backing LUN.
@@ -396,7 +1665,10 @@ class CommonAdapter(object):
         else:
             # In some cases, cinder will not update volume info in DB with
             # provider_location returned by us. We need to retrieve the id
-            # from array.
+            # from array, unless it is listed at the service start.
+            lun_id = self._lun_ids.pop(volume.name, None)
+            if lun_id is not None:
+                return lun_id
             lun = self.client.get_lun(name=volume.name)
             return lun.get_id() if lun is not None else None
 
@@ -418,9 +1690,68 @@ class CommonAdapter(object):
         :param snapshot: the snapshot to delete.
         """
         snap = self.client.get_snap(name=snapshot.name)
+        if snap is not None and self.deferred_deletes is not None:
+            self._defer_delete_snap(
+                snap, even_attached=self.force_delete_attached_snapshots)
+            return
         self.client.delete_snap(
             snap, even_attached=self.force_delete_attached_snapshots)
 
+    def _defer_delete_snap(self, snap, even_attached=False):
+        self.deferred_deletes.add('snap', snap.get_id(),
+                                  even_attached=even_attached)
+        utils.ignore_exception(
+            snap.modify, name=self.deferred_deletes.prefix + snap.get_id())
+        LOG.debug('Deletion of snapshot %s is deferred.', snap.get_id())
+
+    def revert_to_snapshot(self, volume, snapshot):
+        """Reverts the LUN of the volume to the snapshot by the array.
+
+        Unity takes a backup snapshot of the LUN before restoring it. The
+        backup snapshot is deleted in background, by the deferred deletions
+        if enabled, and a failed deletion does not fail the revert.
+        """
+        snap = self.client.get_snap(snapshot.name)
+        if snap is None:
+            raise exception.SnapshotNotFound(snapshot_id=snapshot.id)
+        LOG.info(_LI('Revert volume %(vol)s to snapshot %(snap)s.'),
+                 {'vol': volume.name, 'snap': snapshot.name})
+        backup_snap = self.client.restore_snap(snap)
+        if backup_snap is None:
+            return
+        if self.deferred_deletes is not None:
+            self._defer_delete_snap(backup_snap)
+        else:
+            LOG.debug('Delete backup snapshot %s in background.',
+                      backup_snap.name)
+            greenthread.spawn_n(utils.ignore_exception,
+                                self.client.delete_snap, backup_snap)
+
+    def get_snapshot_diff(self, snapshot, base_snapshot):
+        """Gets the extents changed in the snapshot since the base snapshot.
+
+        :return: list of the (offset, length) in bytes of the extents, or None
+                 if the changes are unknown and the whole snapshot needs to be
+                 read.
+        """
+        if snapshot.volume_id != base_snapshot.volume_id:
+            LOG.debug('Snapshots %(snap)s and %(base)s are not of the same '
+                      'volume.',
+                      {'snap': snapshot.name, 'base': base_snapshot.name})
+            return None
+        snap = self.client.get_snap(snapshot.name)
+        base_snap = self.client.get_snap(base_snapshot.name)
+        if snap is None or base_snap is None:
+            return None
+        try:
+            return list(self.client.get_snap_diff(base_snap, snap))
+        except storops_ex.StoropsException as ex:
+            LOG.info(_LI('Failed to get the differences between snapshots '
+                         '%(snap)s and %(base)s. Error: %(err)s.'),
+                     {'snap': snapshot.name, 'base': base_snapshot.name,
+                      'err': ex})
+            return None
+
     def _get_referenced_lun(self, existing_ref):
         if 'source-id' in existing_ref:
             lun = self.client.get_lun(lun_id=existing_ref['source-id'])
@@ -462,6 +1793,7 @@ class CommonAdapter(object):
         """
         lun = self._get_referenced_lun(existing_ref)
         lun.modify(name=volume.name)
+        self._track_volume(lun.get_id(), volume.id)
         return {
             'provider_location':
                 self._build_provider_location(lun_id=lun.get_id(),
@@ -488,6 +1820,121 @@ class CommonAdapter(object):
 
         return utils.byte_to_gib(lun.size_total)
 
+    @staticmethod
+    def _order_by(sort_keys, sort_dirs, size_field):
+        fields = {'size': size_field, 'reference': 'id'}
+        order_by = [(fields[key], sort_dir)
+                    for key, sort_dir in zip(sort_keys or [], sort_dirs or [])]
+        if 'id' not in [field for field, _dir in order_by]:
+            # Makes the order total, for the marker of the next page.
+            order_by.append(('id', 'asc'))
+        return order_by
+
+    @staticmethod
+    def _managed_ids(cinder_resources):
+        """Maps the backend IDs and names to the cinder resource IDs."""
+        managed = {}
+        for resource in cinder_resources:
+            managed[resource.name] = resource.id
+            backend_id = utils.extract_provider_location(
+                resource.provider_location, 'id')
+            if backend_id is not None:
+                managed[backend_id] = resource.id
+        return managed
+
+    def _make_manageable(self, content, size, managed, prefixes):
+        cinder_id = managed.get(content['id'], managed.get(content['name']))
+        reason = None
+        if cinder_id is not None:
+            reason = _('Already managed.')
+        elif content['name'].startswith(prefixes):
+            reason = _('Internal resource of the driver.')
+        elif content.get('hostAccess'):
+            reason = _('Attached to hosts.')
+        return {'reference': {'source-id': content['id']},
+                'size': int(math.ceil(utils.byte_to_gib(size))),
+                'safe_to_manage': reason is None,
+                'reason_not_safe': reason,
+                'cinder_id': cinder_id,
+                'extra_info': None}
+
+    def get_manageable_volumes(self, cinder_volumes, marker, limit, offset,
+                               sort_keys, sort_dirs):
+        """Lists the LUNs in the managed pools, page by page.
+
+        The LUNs are sorted and paged by the array, with only the fields
+        needed, so that they are listed in constant memory.
+        """
+        managed = self._managed_ids(cinder_volumes)
+        contents = self.client.get_lun_contents(
+            [pool.get_id() for pool in self.storage_pools_map.values()],
+            order_by=self._order_by(sort_keys, sort_dirs, 'sizeTotal'))
+        entries = (self._make_manageable(content, content['sizeTotal'],
+                                         managed, self.INTERNAL_LUN_PREFIXES)
+                   for content in contents)
+        return utils.paginate_manageable(entries, marker, limit, offset)
+
+    def get_manageable_snapshots(self, cinder_snapshots, marker, limit,
+                                 offset, sort_keys, sort_dirs):
+        """Lists the snapshots of the LUNs in the managed pools, page by page.
+
+        See `get_manageable_volumes`.
+        """
+        managed = self._managed_ids(cinder_snapshots)
+        contents = self.client.get_snap_contents(
+            [pool.get_id() for pool in self.storage_pools_map.values()],
+            order_by=self._order_by(sort_keys, sort_dirs, 'size'))
+
+        def _entries():
+            for content in contents:
+                if not content.get('lun'):
+                    # The snapshots of consistency groups are of no LUN.
+                    continue
+                entry = self._make_manageable(content, content['size'],
+                                              managed,
+                                              self.INTERNAL_SNAP_PREFIXES)
+                entry['source_reference'] = {'source-id': content['lun']['id']}
+                yield entry
+
+        return utils.paginate_manageable(_entries(), marker, limit, offset)
+
+    def _get_referenced_snap(self, snapshot, existing_ref):
+        if 'source-id' in existing_ref:
+            snap = self.client.get_snap(snap_id=existing_ref['source-id'])
+        elif 'source-name' in existing_ref:
+            snap = self.client.get_snap(name=existing_ref['source-name'])
+        else:
+            reason = _('Reference must contain source-id or source-name key.')
+            raise exception.ManageExistingInvalidReference(
+                existing_ref=existing_ref, reason=reason)
+        if snap is None or not snap.existed:
+            raise exception.ManageExistingInvalidReference(
+                existing_ref=existing_ref,
+                reason=_("Snapshot doesn't exist."))
+        if snap.storage_resource.get_id() != self.get_lun_id(
+                snapshot.volume):
+            raise exception.ManageExistingInvalidReference(
+                existing_ref=existing_ref,
+                reason=_('The snapshot is not of the LUN of volume %s.') %
+                snapshot.volume.name)
+        return snap
+
+    def manage_existing_snapshot(self, snapshot, existing_ref):
+        """Manages an existing snapshot of the LUN of the snapshot's volume.
+
+        The snapshot is renamed to `snapshot.name`, like `manage_existing`.
+        """
+        snap = self._get_referenced_snap(snapshot, existing_ref)
+        snap.modify(name=snapshot.name)
+        location = self._build_provider_location(lun_type='snapshot',
+                                                 lun_id=snap.get_id())
+        return {'provider_location': location,
+                'provider_id': snap.get_id()}
+
+    def manage_existing_snapshot_get_size(self, snapshot, existing_ref):
+        snap = self._get_referenced_snap(snapshot, existing_ref)
+        return int(math.ceil(utils.byte_to_gib(snap.size)))
+
     def _disconnect_device(self, conn):
         conn['connector'].disconnect_volume(conn['conn']['data'],
                                             conn['device'])
@@ -524,24 +1971,34 @@ class CommonAdapter(object):
                                       True) as attach_info:
                 yield attach_info
 
-    def _dd_copy(self, vol_params, src_snap, src_lun=None):
+    def _dd_copy(self, vol_params, src_snap, src_lun=None, sp=None):
         """Creates a volume via copying a Unity snapshot.
 
         It attaches the `volume` and `snap`, then use `dd` to copy the
         data from the Unity snapshot to the `volume`.
+
+        :param sp: the SP to own the new LUN, chosen if not specified.
         """
+        if sp is None:
+            sp = self.choose_sp()
         dest_lun = self.client.create_lun(
             name=vol_params.name, size=vol_params.size, pool=vol_params.pool,
             description=vol_params.description,
-            io_limit_policy=vol_params.io_limit_policy)
+            io_limit_policy=vol_params.io_limit_policy,
+            tiering_policy=vol_params.tiering_policy,
+            is_compression=vol_params.is_compression,
+            is_thin=vol_params.is_thin,
+            sp=sp)
         src_id = src_snap.get_id()
         try:
             conn_props = cinder_utils.brick_get_connector_properties()
 
             with self._connect_resource(dest_lun, conn_props,
                                         vol_params.volume_id) as dest_info, \
-                    self._connect_resource(src_snap, conn_props,
-                                           src_id) as src_info:
+                    self.clone_snapshots.attach(
+                        src_snap,
+                        functools.partial(self._connect_resource, src_snap,
+                                          conn_props, src_id)) as src_info:
                 if src_lun is None:
                     # If size is not specified, need to get the size from LUN
                     # of snapshot.
@@ -567,7 +2024,15 @@ class CommonAdapter(object):
 
         return dest_lun
 
-    def _thin_clone(self, vol_params, src_snap, src_lun=None):
+    def _thin_clone(self, vol_params, src_snap, src_lun=None, sp=None):
+        # Chosen once, since the fallback paths create the LUN again.
+        if sp is None:
+            sp = self.choose_sp()
+        if not vol_params.is_thin:
+            LOG.debug('Volume %s is thick, copy it via dd instead of thin '
+                      'clone.', vol_params.name)
+            return self._dd_copy(vol_params, src_snap, src_lun=src_lun,
+                                 sp=sp)
         tc_src = src_snap if src_lun is None else src_lun
         try:
             LOG.debug('Try to thin clone from %s.', tc_src.name)
@@ -575,7 +2040,9 @@ class CommonAdapter(object):
                 tc_src, vol_params.name,
                 description=vol_params.description,
                 io_limit_policy=vol_params.io_limit_policy,
-                new_size_gb=vol_params.size)
+                new_size_gb=vol_params.size,
+                tiering_policy=vol_params.tiering_policy,
+                sp=sp)
         except storops_ex.UnityThinCloneLimitExceededError:
             LOG.info(_LI('Number of thin clones of base LUN exceeds system '
                          'limit, dd-copy a new one and thin clone from it.'))
@@ -583,7 +2050,8 @@ class CommonAdapter(object):
             hidden = copy.copy(vol_params)
             hidden.name = 'hidden-%s' % vol_params.name
             hidden.description = 'hidden-%s' % vol_params.description
-            copied_lun = self._dd_copy(hidden, src_snap, src_lun=src_lun)
+            copied_lun = self._dd_copy(hidden, src_snap, src_lun=src_lun,
+                                       sp=sp)
             LOG.debug('Notify storops the dd action of lun: %(src_name)s. And '
                       'the newly copied lun is: %(copied)s.',
                       {'src_name': tc_src.name, 'copied': copied_lun.name})
@@ -594,33 +2062,76 @@ class CommonAdapter(object):
                 copied_lun, vol_params.name,
                 description=vol_params.description,
                 io_limit_policy=vol_params.io_limit_policy,
-                new_size_gb=vol_params.size)
+                new_size_gb=vol_params.size,
+                tiering_policy=vol_params.tiering_policy,
+                sp=sp)
+        except storops_ex.UnityCGMemberActionNotSupportError:
+            # Thin clone not supported on the LUNs in consistency groups and
+            # their snapshots
+            LOG.debug('Thin clone of %s in consistency group is not '
+                      'supported, copy it via dd.', tc_src.name)
+            lun = self._dd_copy(vol_params, src_snap, src_lun=src_lun,
+                                sp=sp)
         except storops_ex.SystemAPINotSupported:
             # Thin clone not support on array version before Merlin
-            lun = self._dd_copy(vol_params, src_snap, src_lun=src_lun)
+            lun = self._dd_copy(vol_params, src_snap, src_lun=src_lun,
+                                sp=sp)
             LOG.debug(
                 'Volume copied via dd because array OE is too old to support '
                 'thin clone api. source snap: %(src_snap)s, lun: %(src_lun)s.',
                 {'src_snap': src_snap.name,
                  'src_lun': 'Unknown' if src_lun is None else src_lun.name})
+        else:
+            if lun.is_compression_enabled != vol_params.is_compression:
+                lun = self._set_clone_compression(lun, vol_params, src_snap,
+                                                  src_lun=src_lun, sp=sp)
         return lun
 
+    def _set_clone_compression(self, lun, vol_params, src_snap,
+                               src_lun=None, sp=None):
+        """Sets the data reduction of the thin clone as its volume type.
+
+        The thin clone keeps the data reduction of its source. It is copied
+        via dd instead if the array fails to change it.
+        """
+        try:
+            LOG.info(_LI('Change data reduction of thin clone %(lun)s to '
+                         '%(enabled)s.'),
+                     {'lun': lun.get_id(),
+                      'enabled': vol_params.is_compression})
+            lun.modify(is_compression=vol_params.is_compression)
+            return lun
+        except storops_ex.StoropsException as err:
+            LOG.info(_LI('Failed to change data reduction of thin clone '
+                         '%(lun)s, copy it via dd instead. Error: %(err)s.'),
+                     {'lun': lun.get_id(), 'err': err})
+        self.client.delete_lun(lun.get_id())
+        return self._dd_copy(vol_params, src_snap, src_lun=src_lun, sp=sp)
+
     def create_volume_from_snapshot(self, volume, snapshot):
         snap = self.client.get_snap(snapshot.name)
-        return self.makeup_model(
-            self._thin_clone(VolumeParams(self, volume), snap),
-            is_snap_lun=True)
+        vol_params = VolumeParams(self, volume)
+        lun = self._thin_clone(vol_params, snap)
+        self._add_to_cg(vol_params, lun)
+        return self.makeup_model(lun, is_snap_lun=True, volume_id=volume.id)
 
     def create_cloned_volume(self, volume, src_vref):
         """Creates cloned volume.
 
         1. Take an internal snapshot of source volume, and attach it.
+           Note: the snapshot is shared by the clones of the same source
+           volume requested within `unity_clone_snapshot_share_window`.
         2. Thin clone from the snapshot to a new volume.
            Note: there are several cases the thin clone will downgrade to `dd`,
            2.1 Source volume is attached (in-use).
            2.2 Array OE version doesn't support thin clone.
            2.3 The current LUN family reaches the thin clone limits.
-        3. Delete the internal snapshot created in step 1.
+        3. Release the internal snapshot used in step 1. It is deleted if no
+           other clone uses it.
+
+        The source volume in a consistency group is copied via `dd` from an
+        internal snapshot of its group instead, since the array neither takes
+        nor thin clones the snapshots of the member LUNs alone.
         """
 
         src_lun_id = self.get_lun_id(src_vref)
@@ -631,15 +2142,18 @@ class CommonAdapter(object):
         src_lun = self.client.get_lun(lun_id=src_lun_id)
         src_snap_name = 'snap_clone_%s' % volume.id
 
-        create_snap_func = functools.partial(self.client.create_snap,
-                                             src_lun_id, src_snap_name)
         vol_params = VolumeParams(self, volume)
-        with utils.assure_cleanup(create_snap_func,
-                                  self.client.delete_snap,
-                                  True) as src_snap:
-            LOG.debug('Internal snapshot for clone is created, '
+        src_cg_id = VolumeParams(self, src_vref).cg_id
+        if src_cg_id:
+            lun = self._copy_cg_member(vol_params, src_cg_id, src_lun,
+                                       src_snap_name)
+            self._add_to_cg(vol_params, lun)
+            return self.makeup_model(lun, volume_id=volume.id)
+
+        with self.clone_snapshots.use(src_lun_id, src_snap_name) as src_snap:
+            LOG.debug('Internal snapshot for clone is ready, '
                       'name: %(name)s, id: %(id)s.',
-                      {'name': src_snap_name,
+                      {'name': src_snap.name,
                        'id': src_snap.get_id()})
             if src_vref.volume_attachment:
                 lun = self._dd_copy(vol_params, src_snap, src_lun=src_lun)
@@ -647,18 +2161,229 @@ class CommonAdapter(object):
                           '%(name)s is attached: %(attach)s.',
                           {'name': src_vref.name,
                            'attach': src_vref.volume_attachment})
-                return self.makeup_model(lun)
+                is_snap_lun = False
             else:
                 lun = self._thin_clone(vol_params, src_snap, src_lun=src_lun)
-                return self.makeup_model(lun, is_snap_lun=True)
+                is_snap_lun = True
+        self._add_to_cg(vol_params, lun)
+        return self.makeup_model(lun, is_snap_lun=is_snap_lun,
+                                 volume_id=volume.id)
+
+    def _copy_cg_member(self, vol_params, cg_id, src_lun, snap_name):
+        """Copies a member LUN of a consistency group via dd.
+
+        The LUN is copied from its snapshot in an internal snapshot of the
+        group, which is deleted after the copy.
+        """
+        create_snap_func = functools.partial(
+            self.client.create_cg_snap, cg_id, snap_name=snap_name)
+        with utils.assure_cleanup(create_snap_func,
+                                  self.client.delete_snap,
+                                  True) as cg_snap:
+            LOG.debug('Internal snapshot of CG %(cg)s for clone is created, '
+                      'name: %(name)s, id: %(id)s.',
+                      {'cg': cg_id, 'name': cg_snap.name,
+                       'id': cg_snap.get_id()})
+            member_snap = next(
+                snap
+                for snap in self.client.filter_snaps_in_cg_snap(
+                    cg_snap.get_id())
+                if snap.lun.get_id() == src_lun.get_id())
+            return self._dd_copy(vol_params, member_snap, src_lun=src_lun)
+
+    def clone_image(self, context, volume, image_meta, image_service):
+        """Creates a volume from the image LUN cached in its pool.
+
+        Returns `(None, False)` to fall back to the generic image copy if the
+        image cache is disabled, the volume is not thin, or the volume is
+        smaller than the image LUN.
+        """
+        if self.image_cache is None:
+            return None, False
+        vol_params = VolumeParams(self, volume)
+        if vol_params.provisioning != utils.PROVISIONING_THIN:
+            # The thin clones keep the provisioning of the image LUN.
+            return None, False
+        lun = self.image_cache.clone(context, vol_params,
+                                     image_meta, image_service)
+        if lun is None:
+            return None, False
+        return (self.makeup_model(lun, is_snap_lun=True, volume_id=volume.id),
+                True)
 
     def get_pool_name(self, volume):
+        pool_name = self._pool_names.pop(volume.name, None)
+        if pool_name is not None:
+            return pool_name
         return self.client.get_pool_name(volume.name)
 
+    def create_group(self, group):
+        """Creates a consistency group on Unity for a generic group.
+
+        :param group: group information
+        """
+        description = group.description if group.description else group.name
+        LOG.info(_LI('Create group: %(name)s, description: %(description)s.'),
+                 {'name': group.id, 'description': description})
+        self.client.create_cg(group.id, description=description)
+        return {'status': fields.GroupStatus.AVAILABLE}
+
+    def delete_group(self, group, volumes):
+        """Deletes the consistency group and the LUNs in it.
+
+        :param group: the group to delete
+        :param volumes: the volumes in the group
+        """
+        self.client.delete_cg(group.id)
+        return None, None
+
+    def update_group(self, group, add_volumes, remove_volumes):
+        """Adds or removes the LUNs of the volumes in the group."""
+        add_lun_ids = set(map(self.get_lun_id, add_volumes or []))
+        remove_lun_ids = set(map(self.get_lun_id, remove_volumes or []))
+        self.client.update_cg(group.id, add_lun_ids, remove_lun_ids)
+        return {'status': fields.GroupStatus.AVAILABLE}, None, None
+
+    def create_group_snapshot(self, group_snapshot, snapshots):
+        """Creates one snapshot of the consistency group on Unity.
+
+        The snapshots of the member LUNs are taken at the same time by the
+        array, so they are crash-consistent together.
+        """
+        cg_snap = self.client.create_cg_snap(group_snapshot.group_id,
+                                             snap_name=group_snapshot.id)
+        member_snaps = {
+            snap.lun.get_id(): snap
+            for snap in self.client.filter_snaps_in_cg_snap(cg_snap.get_id())}
+
+        snapshots_model_update = []
+        for snapshot in snapshots or []:
+            update = {'id': snapshot.id,
+                      'status': fields.SnapshotStatus.AVAILABLE}
+            snap = member_snaps.get(self.get_lun_id(snapshot.volume))
+            if snap is not None:
+                update['provider_location'] = self._build_provider_location(
+                    lun_type='snapshot', lun_id=snap.get_id())
+                update['provider_id'] = snap.get_id()
+            snapshots_model_update.append(update)
+        return ({'status': fields.GroupStatus.AVAILABLE},
+                snapshots_model_update)
+
+    def delete_group_snapshot(self, group_snapshot, snapshots):
+        """Deletes the snapshot of the consistency group.
+
+        The snapshots of the member LUNs are deleted with it.
+        """
+        cg_snap = self.client.get_snap(group_snapshot.id)
+        self.client.delete_snap(cg_snap)
+        return None, None
+
+    def create_group_from_src(self, group, volumes, group_snapshot=None,
+                              snapshots=None, source_group=None,
+                              source_vols=None):
+        """Creates a group from a group snapshot or a source group.
+
+        When the source is a group, an internal snapshot of its consistency
+        group is taken and deleted after the members are cloned.
+        """
+        if group_snapshot is not None:
+            cg_snap = self.client.get_snap(group_snapshot.id)
+            src_lun_ids = {snap.id: self.get_lun_id(snap.volume)
+                           for snap in snapshots}
+            return self._clone_group(
+                group, volumes, cg_snap,
+                {vol.id: src_lun_ids[vol.snapshot_id] for vol in volumes})
+
+        src_lun_ids = {vol.id: self.get_lun_id(vol) for vol in source_vols}
+        create_snap_func = functools.partial(
+            self.client.create_cg_snap, source_group.id,
+            snap_name='snap_clone_%s' % group.id)
+        with utils.assure_cleanup(create_snap_func,
+                                  self.client.delete_snap,
+                                  True) as cg_snap:
+            LOG.debug('Internal snapshot for group clone is created, '
+                      'name: %(name)s, id: %(id)s.',
+                      {'name': cg_snap.name, 'id': cg_snap.get_id()})
+            return self._clone_group(
+                group, volumes, cg_snap,
+                {vol.id: src_lun_ids[vol.source_volid] for vol in volumes})
+
+    def _clone_group(self, group, volumes, cg_snap, src_lun_ids):
+        """Copies the member snapshots of a group snapshot in parallel via dd.
+
+        The array does not thin clone the member snapshots of a consistency
+        group snapshot.
+
+        :param group: the group to create.
+        :param volumes: the volumes to create in the group.
+        :param cg_snap: the `UnitySnap` of the source consistency group.
+        :param src_lun_ids: the map from the volume ID to the ID of its source
+                            LUN.
+        """
+        member_snaps = {
+            snap.lun.get_id(): snap
+            for snap in self.client.filter_snaps_in_cg_snap(cg_snap.get_id())}
+
+        # All the volumes are in the pool of the group, and the ones of the
+        # same volume type share the io limit policy.
+        target_pool = self._get_target_pool(volumes[0]) if volumes else None
+        policies = {}
+        workers = greenpool.GreenPool(self.group_clone_workers)
+        threads = []
+        for volume in volumes:
+            vol_params = VolumeParams(self, volume)
+            vol_params.pool = target_pool
+            if volume.volume_type_id not in policies:
+                policies[volume.volume_type_id] = vol_params.io_limit_policy
+            vol_params.io_limit_policy = policies[volume.volume_type_id]
+            member_snap = member_snaps[src_lun_ids[volume.id]]
+            threads.append((volume, workers.spawn(self._dd_copy,
+                                                  vol_params, member_snap)))
+
+        cloned, failed = [], []
+        for volume, thread in threads:
+            try:
+                cloned.append((volume, thread.wait()))
+            except Exception as ex:
+                LOG.error(_LE('Failed to clone volume %(vol_id)s of group '
+                              '%(group_id)s. Error: %(err)s.'),
+                          {'vol_id': volume.id, 'group_id': group.id,
+                           'err': ex})
+                failed.append(volume.id)
+        if failed:
+            for _volume, lun in cloned:
+                utils.ignore_exception(self.client.delete_lun, lun.get_id())
+            raise exception.VolumeBackendAPIException(
+                data=_('Failed to create volumes %(vol_ids)s of group '
+                       '%(group_id)s.') % {'vol_ids': failed,
+                                           'group_id': group.id})
+
+        try:
+            self.client.create_cg(group.id, lun_add=[lun for _volume, lun
+                                                     in cloned])
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                for _volume, lun in cloned:
+                    utils.ignore_exception(self.client.delete_lun,
+                                           lun.get_id())
+        volumes_model_update = []
+        for volume, lun in cloned:
+            update = self.makeup_model(lun, volume_id=volume.id)
+            update.update({'id': volume.id,
+                           'status': fields.VolumeStatus.AVAILABLE})
+            volumes_model_update.append(update)
+        return ({'status': fields.GroupStatus.AVAILABLE},
+                volumes_model_update)
+
     @cinder_utils.trace
     def initialize_connection_snapshot(self, snapshot, connector):
         snap = self.client.get_snap(snapshot.name)
-        return self._initialize_connection(snap, connector, snapshot.id)
+        # The snapshot is accessed through the SP owning its LUN. The storage
+        # resource of the snapshot is not the LUN for the snapshots of CGs.
+        lun = self.client.get_lun(lun_id=self.get_lun_id(snapshot.volume))
+        return self._initialize_connection(
+            snap, connector, snapshot.id,
+            owner_sp=self.client.get_owner_sp(lun))
 
     @cinder_utils.trace
     def terminate_connection_snapshot(self, snapshot, connector):
@@ -677,12 +2402,40 @@ class ISCSIAdapter(CommonAdapter):
     def get_connector_uids(self, connector):
         return utils.extract_iscsi_uids(connector)
 
-    def get_connection_info(self, hlu, host, connector):
+    def _rank_targets(self, targets, connector, owner_sp):
+        """Ranks the iSCSI targets, the best first.
+
+        The portals in the subnet of the connector's IP are preferred, since
+        the others are reached through routers. Then the portals of the SP
+        owning the LUN, and the ones of the less busy Ethernet ports if the
+        metrics are sampled.
+        """
+        port_load = ({} if self.perf_sampler is None
+                     else self.perf_sampler.get_port_load())
+
+        def _key(target):
+            return (not utils.is_same_subnet(connector.get('ip'),
+                                             target['ip'], target['netmask']),
+                    target['sp'] != owner_sp,
+                    port_load.get(target['port'], 0))
+
+        # The sort is stable, so the array order is kept on ties.
+        targets = sorted(targets, key=_key)
+        # Chooses the primary target randomly among the best ones, to spread
+        # the hosts if they are not told apart.
+        best = [t for t in targets if _key(t) == _key(targets[0])]
+        return targets, random.choice(best)
+
+    def get_connection_info(self, hlu, host, connector, owner_sp=None):
         targets = self.client.get_iscsi_target_info(self.allowed_ports)
         if not targets:
             msg = _("There is no accessible iSCSI targets on the system.")
             raise exception.VolumeBackendAPIException(data=msg)
-        one_target = random.choice(targets)
+        targets, one_target = self._rank_targets(targets, connector, owner_sp)
+        targets = utils.cap_targets_by_sp(
+            targets, self.config.unity_iscsi_max_portals)
+        if one_target not in targets:
+            one_target = targets[0]
         portals = [a['portal'] for a in targets]
         iqns = [a['iqn'] for a in targets]
         data = {
@@ -708,6 +2461,10 @@ class FCAdapter(CommonAdapter):
     def do_setup(self, driver, config):
         super(FCAdapter, self).do_setup(driver, config)
         self.lookup_service = utils.create_lookup_service()
+        if (self.lookup_service is not None
+                and self.config.unity_fc_zone_cache_ttl):
+            self.lookup_service = ZoneMappingCache(
+                self.lookup_service, self.config.unity_fc_zone_cache_ttl)
 
     def get_all_ports(self):
         return self.client.get_fc_ports()
@@ -719,8 +2476,12 @@ class FCAdapter(CommonAdapter):
     def auto_zone_enabled(self):
         return self.lookup_service is not None
 
-    def get_connection_info(self, hlu, host, connector):
-        targets = self.client.get_fc_target_info(
+    def invalidate_zone_mapping(self, connector):
+        if connector and isinstance(self.lookup_service, ZoneMappingCache):
+            self.lookup_service.invalidate(connector.get('wwpns') or [])
+
+    def get_connection_info(self, hlu, host, connector, owner_sp=None):
+        targets = self.client.get_fc_targets(
             host, logged_in_only=(not self.auto_zone_enabled),
             allowed_ports=self.allowed_ports)
 
@@ -729,11 +2490,25 @@ class FCAdapter(CommonAdapter):
                     "system.")
             raise exception.VolumeBackendAPIException(data=msg)
 
+        max_count = self.config.unity_fc_max_targets
         if self.auto_zone_enabled:
-            data = self._get_fc_zone_info(connector['wwpns'], targets)
+            mapping = self.lookup_service.get_device_mapping_from_network(
+                connector['wwpns'], list(targets))
+            wwns = utils.select_fc_targets(
+                targets, max_count, owner_sp=owner_sp,
+                fabrics=utils.get_zone_fabrics(mapping),
+                seed=connector.get('host', ''))
+            if max_count:
+                # Zones only the selected targets.
+                mapping = utils.filter_zone_mapping(mapping, wwns)
+            data = self._get_fc_zone_info(connector['wwpns'], wwns,
+                                          mapping=mapping)
         else:
+            wwns = utils.select_fc_targets(targets, max_count,
+                                           owner_sp=owner_sp,
+                                           seed=connector.get('host', ''))
             data = {
-                'target_wwn': targets,
+                'target_wwn': wwns,
             }
         data['target_lun'] = hlu
         return data
@@ -758,10 +2533,15 @@ class FCAdapter(CommonAdapter):
                                                      targets)
         return ret
 
-    def _get_fc_zone_info(self, initiator_wwns, target_wwns):
-        mapping = self.lookup_service.get_device_mapping_from_network(
-            initiator_wwns, target_wwns)
+    def _get_fc_zone_info(self, initiator_wwns, target_wwns, mapping=None):
+        if mapping is None:
+            mapping = self.lookup_service.get_device_mapping_from_network(
+                initiator_wwns, target_wwns)
         targets, itor_tgt_map = utils.convert_to_itor_tgt_map(mapping)
+        # Keeps the order of `target_wwns`, the ones of the owning SP first.
+        # The initiator target map is only for zoning, so it is left as is.
+        order = {wwn.lower(): i for i, wwn in enumerate(target_wwns)}
+        targets.sort(key=lambda wwn: order.get(wwn.lower(), len(order)))
         return {
             'target_wwn': targets,
             'initiator_target_map': itor_tgt_map,
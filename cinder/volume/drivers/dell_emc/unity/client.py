@@ -13,27 +13,174 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import functools
+import threading
+import time
+
 from oslo_log import log
 from oslo_utils import excutils
 from oslo_utils import importutils
+from oslo_utils import units
+from six.moves import urllib
 
 storops = importutils.try_import('storops')
 if storops:
     from storops import exception as storops_ex
+    from storops.unity.resource import job as job_resource
+    from storops.unity.resource import move_session
 else:
     # Set storops_ex to be None for unit test
     storops_ex = None
+    job_resource = None
+    move_session = None
 
 from cinder import coordination
 from cinder import exception
-from cinder.i18n import _, _LW
+from cinder.i18n import _, _LE, _LI, _LW
 from cinder.volume.drivers.dell_emc.unity import utils
 
 LOG = log.getLogger(__name__)
 
+SNAP_DIFF_PAGE_SIZE = 1024
+MANAGEABLE_PAGE_SIZE = 500
+
+
+class JobCoalescer(object):
+    """Groups concurrent independent operations into Unity jobs.
+
+    The operations submitted within `window` seconds, at most `batch_size` of
+    them, are sent as the tasks of one asynchronous job, which is polled
+    until it ends. If the job does not complete, the operations are run one
+    by one to get the result or error of each. If the job does not end in
+    `timeout` seconds, the operations fail.
+    """
+
+    def __init__(self, client, batch_size, window, timeout=None):
+        self.client = client
+        self.batch_size = batch_size
+        self.window = window
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._queue = []
+
+    def _take_batch(self):
+        batch = self._queue[:self.batch_size]
+        del self._queue[:self.batch_size]
+        return batch
+
+    def submit(self, task, on_complete, fallback):
+        """Runs an operation as a task of a job.
+
+        :param task: the job task of the operation, a dict with `object`,
+                     `action` and `parametersIn`.
+        :param on_complete: the function to get the result of the operation
+                            from the `parametersOut` of the completed task.
+        :param fallback: the function to run the operation alone.
+        :return: the result of the operation.
+        """
+        item = {'task': task, 'on_complete': on_complete,
+                'fallback': fallback, 'done': threading.Event(),
+                'result': None, 'error': None}
+        with self._lock:
+            self._queue.append(item)
+            is_first = len(self._queue) == 1
+            batch = (self._take_batch()
+                     if len(self._queue) >= self.batch_size else None)
+        if batch is None and is_first:
+            # The first operation waits for others to join the batch.
+            time.sleep(self.window)
+            with self._lock:
+                batch = self._take_batch()
+        if batch:
+            self._run(batch)
+        item['done'].wait()
+        if item['error'] is not None:
+            raise item['error']
+        return item['result']
+
+    def _run(self, batch):
+        try:
+            outs = self._run_job([item['task'] for item in batch])
+        except exception.VolumeBackendAPIException as ex:
+            LOG.error(_LE('Job of %(count)s operations fails. Error: '
+                          '%(err)s.'), {'count': len(batch), 'err': ex})
+            for item in batch:
+                item['error'] = ex
+                item['done'].set()
+            return
+        except Exception as ex:
+            LOG.warning(_LW('Failed to submit job of %(count)s operations. '
+                            'Error: %(err)s.'),
+                        {'count': len(batch), 'err': ex})
+            outs = None
+        for i, item in enumerate(batch):
+            try:
+                if outs is None:
+                    item['result'] = item['fallback']()
+                else:
+                    item['result'] = item['on_complete'](outs[i])
+            except Exception as ex:
+                item['error'] = ex
+            finally:
+                item['done'].set()
+
+    def _run_job(self, tasks):
+        """Runs the tasks in a job.
+
+        :return: the list of `parametersOut` of the tasks, or None if the job
+                 does not complete.
+        """
+        if len(tasks) == 1:
+            # A single operation is run alone without the overhead of a job.
+            return None
+        cli = self.client.get_rest_cli()
+        body = {'description': 'Batched operations of Block Storage.',
+                'tasks': [dict(task, name='task_%s' % i)
+                          for i, task in enumerate(tasks)]}
+        resp = cli.rest_post('/api/types/job/instances?timeout=0', body)
+        job = job_resource.UnityJob(_id=resp.resource_id, cli=cli)
+        LOG.debug('Job %(job)s of %(count)s tasks is submitted.',
+                  {'job': job.get_id(), 'count': len(tasks)})
+
+        def _check_job():
+            job.update()
+            # A suspended job may resume, and a rolling back one may still
+            # apply some of its tasks.
+            if job.state in (storops.JobStateEnum.QUEUED,
+                             storops.JobStateEnum.RUNNING,
+                             storops.JobStateEnum.SUSPENDED,
+                             storops.JobStateEnum.ROLLING_BACK):
+                return None
+            return job.state == storops.JobStateEnum.COMPLETED
+
+        completed = utils.poll_with_backoff(_check_job, interval=0.1,
+                                            max_interval=2,
+                                            timeout=self.timeout)
+        if completed is None:
+            # The job may still run, so its operations are not run again.
+            msg = (_('Job %(job)s does not end in %(timeout)s seconds.') %
+                   {'job': job.get_id(), 'timeout': self.timeout})
+            raise exception.VolumeBackendAPIException(data=msg)
+        if not completed:
+            LOG.info(_LI('Job %(job)s ends with state %(state)s, run its '
+                         'operations one by one.'),
+                     {'job': job.get_id(), 'state': job.state})
+            return None
+        try:
+            # The tasks are `UnityJobTask` resources of storops.
+            outs = {task.name: task.parameters_out or {}
+                    for task in job.tasks}
+            return [outs['task_%s' % i] for i in range(len(tasks))]
+        except (AttributeError, KeyError) as ex:
+            # The operations are applied already, so not run again.
+            msg = (_('Failed to get the outputs of completed job %(job)s. '
+                     'Error: %(err)s.') % {'job': job.get_id(), 'err': ex})
+            raise exception.VolumeBackendAPIException(data=msg)
+
 
 class UnityClient(object):
-    def __init__(self, host, username, password, verify_cert=True):
+    def __init__(self, host, username, password, verify_cert=True,
+                 move_session_timeout=None):
         if storops is None:
             msg = _('Python package storops is not installed which '
                     'is required to run Unity driver.')
@@ -44,6 +191,17 @@ class UnityClient(object):
         self.password = password
         self.verify_cert = verify_cert
         self.host_cache = {}
+        self.jobs = None
+        self.move_session_timeout = move_session_timeout
+
+    def enable_jobs(self, batch_size, window, timeout=None):
+        """Groups the concurrent LUN and snapshot operations into jobs."""
+        self.jobs = JobCoalescer(self, batch_size, window, timeout=timeout)
+
+    def _submit(self, task, on_complete, fallback):
+        if self.jobs is None:
+            return fallback()
+        return self.jobs.submit(task, on_complete, fallback)
 
     @property
     def system(self):
@@ -56,8 +214,17 @@ class UnityClient(object):
     def get_serial(self):
         return self.system.serial_number
 
+    def get_rest_cli(self):
+        """Gets the REST client of storops.
+
+        It is only used for the Unity REST APIs which storops does not wrap,
+        like jobs, move sessions and snapshot differences.
+        """
+        return self.system._cli
+
     def create_lun(self, name, size, pool, description=None,
-                   io_limit_policy=None):
+                   io_limit_policy=None, tiering_policy=None,
+                   is_compression=False, is_thin=True, sp=None):
         """Creates LUN on the Unity system.
 
         :param name: lun name
@@ -65,12 +232,51 @@ class UnityClient(object):
         :param pool: UnityPool object represent to pool to place the lun
         :param description: lun description
         :param io_limit_policy: io limit on the LUN
+        :param tiering_policy: `TieringPolicyEnum` of the LUN
+        :param is_compression: whether to enable data reduction on the LUN
+        :param is_thin: whether the LUN is thin, otherwise fully allocated
+        :param sp: ID of the SP to own the LUN, chosen by the array if None
         :return: UnityLun object
         """
+        lun_params = {'pool': {'id': pool.get_id()}, 'size': size * units.Gi}
+        if io_limit_policy is not None:
+            lun_params['ioLimitParameters'] = {
+                'ioLimitPolicy': {'id': io_limit_policy.get_id()}}
+        if tiering_policy is not None:
+            lun_params['fastVPParameters'] = {
+                'tieringPolicy': tiering_policy.index}
+        if is_compression:
+            lun_params['isCompressionEnabled'] = True
+        if not is_thin:
+            lun_params['isThinEnabled'] = False
+        if sp is not None:
+            lun_params['defaultNode'] = self.get_node(sp).index
+        task = {'object': 'storageResource', 'action': 'createLun',
+                'parametersIn': {'name': name, 'description': description,
+                                 'lunParameters': lun_params}}
+        return self._submit(
+            task,
+            lambda out: self.system.get_lun(_id=out['storageResource']['id']),
+            functools.partial(self._create_lun, name, size, pool,
+                              description=description,
+                              io_limit_policy=io_limit_policy,
+                              tiering_policy=tiering_policy,
+                              is_compression=is_compression,
+                              is_thin=is_thin, sp=sp))
+
+    def _create_lun(self, name, size, pool, description=None,
+                    io_limit_policy=None, tiering_policy=None,
+                    is_compression=False, is_thin=True, sp=None):
         try:
+            # Compression is only passed if enabled, since it is not
+            # supported by the pools which are not all flash.
             lun = pool.create_lun(lun_name=name, size_gb=size,
                                   description=description,
-                                  io_limit_policy=io_limit_policy)
+                                  io_limit_policy=io_limit_policy,
+                                  tiering_policy=tiering_policy,
+                                  is_compression=is_compression or None,
+                                  is_thin=is_thin,
+                                  sp=None if sp is None else self.get_node(sp))
         except storops_ex.UnityLunNameInUseError:
             LOG.debug("LUN %s already exists. Return the existing one.",
                       name)
@@ -78,7 +284,8 @@ class UnityClient(object):
         return lun
 
     def thin_clone(self, lun_or_snap, name, io_limit_policy=None,
-                   description=None, new_size_gb=None):
+                   description=None, new_size_gb=None, tiering_policy=None,
+                   sp=None):
         try:
             lun = lun_or_snap.thin_clone(
                 name=name, io_limit_policy=io_limit_policy,
@@ -87,6 +294,18 @@ class UnityClient(object):
             LOG.debug("LUN(thin clone) %s already exists. "
                       "Return the existing one.", name)
             lun = self.system.get_lun(name=name)
+        if tiering_policy is not None:
+            # Thin clone API does not accept the tiering policy.
+            lun.modify(tiering_policy=tiering_policy)
+        if sp is not None:
+            # Thin clone API does not accept the SP either. The ownership is
+            # only for balancing, so the clone is kept even if it fails.
+            try:
+                lun.modify(sp=self.get_node(sp))
+            except storops_ex.StoropsException as ex:
+                LOG.warning(_LW('Failed to move LUN %(lun)s to %(sp)s. '
+                                'Error: %(err)s.'),
+                            {'lun': lun.get_id(), 'sp': sp, 'err': ex})
         if new_size_gb is not None and new_size_gb > lun.total_size_gb:
             lun = self.extend_lun(lun.get_id(), new_size_gb)
         return lun
@@ -96,6 +315,12 @@ class UnityClient(object):
 
         :param lun_id: id of the LUN
         """
+        task = {'object': 'storageResource', 'action': 'delete',
+                'parametersIn': {'id': lun_id}}
+        self._submit(task, lambda out: None,
+                     functools.partial(self._delete_lun, lun_id))
+
+    def _delete_lun(self, lun_id):
         try:
             lun = self.system.get_lun(_id=lun_id)
             lun.delete()
@@ -123,6 +348,91 @@ class UnityClient(object):
                     {'id': lun_id, 'name': name})
         return lun
 
+    def enable_perf_stats(self, interval):
+        """Starts the background query of the real-time IO metrics."""
+        self.system.enable_perf_stats(interval=interval)
+
+    def get_lun_perf(self, pool_ids):
+        """Gets the latest IO metrics of the LUNs in the pools.
+
+        Only the IDs and pools of the LUNs are listed page by page. storops
+        calculates the metrics from the counters of the system, without
+        querying each LUN. The LUNs without metrics yet are skipped.
+
+        :param pool_ids: the IDs of the pools of the LUNs.
+        :return: dict of LUN ID to tuple of its pool ID, IOPS, bandwidth in
+                 MBPS and response time in microseconds.
+        """
+        ret = {}
+        if not pool_ids:
+            return ret
+        for content in self._get_paged(
+                'lun', ['id', 'pool'],
+                the_filter=self._pool_filter('pool.id', pool_ids)):
+            lun = self.system.get_lun(_id=content['id'])
+            read_iops, write_iops = lun.read_iops, lun.write_iops
+            if read_iops is None or write_iops is None:
+                continue
+            ret[content['id']] = (content['pool']['id'],
+                                  read_iops + write_iops,
+                                  (lun.read_mbps or 0) + (lun.write_mbps or 0),
+                                  lun.response_time or 0)
+        return ret
+
+    def get_ethernet_port_load(self):
+        """Gets the latest bandwidth of the Ethernet ports.
+
+        The ports without metrics yet are skipped.
+
+        :return: dict of port ID to its bandwidth in bytes per second.
+        """
+        ret = {}
+        for port in self.get_ethernet_ports():
+            read_rate, write_rate = port.read_bytes_rate, port.write_bytes_rate
+            if read_rate is None or write_rate is None:
+                continue
+            ret[port.get_id()] = read_rate + write_rate
+        return ret
+
+    def get_sp_utilization(self):
+        """Gets the CPU utilization percentage of each SP."""
+        return {sp.get_id(): sp.utilization for sp in self.system.get_sp()
+                if sp.utilization is not None}
+
+    @staticmethod
+    def get_node(sp_id):
+        """Gets the `NodeEnum` of the SP ID."""
+        return {'spa': storops.NodeEnum.SPA,
+                'spb': storops.NodeEnum.SPB}[sp_id]
+
+    @staticmethod
+    def get_owner_sp(lun):
+        """Gets the ID of the SP currently owning the LUN, None if unknown."""
+        if lun is None:
+            return None
+        return {storops.NodeEnum.SPA: 'spa',
+                storops.NodeEnum.SPB: 'spb'}.get(lun.current_node)
+
+    def get_sp_lun_counts(self, pool_ids):
+        """Gets the count of the LUNs in the pools owned by each SP.
+
+        Only the IDs and current SPs of the LUNs are listed page by page.
+
+        :param pool_ids: the IDs of the pools of the LUNs.
+        """
+        counts = {'spa': 0, 'spb': 0}
+        if not pool_ids:
+            return counts
+        sp_ids = {storops.NodeEnum.SPA: 'spa', storops.NodeEnum.SPB: 'spb'}
+        for content in self._get_paged(
+                'lun', ['id', 'currentNode'],
+                the_filter=self._pool_filter('pool.id', pool_ids)):
+            sp_id = sp_ids.get(
+                storops.NodeEnum.parse(content.get('currentNode')))
+            if sp_id is not None:
+                counts[sp_id] += 1
+        return counts
+
     def extend_lun(self, lun_id, size_gib):
         lun = self.system.get_lun(lun_id)
         try:
@@ -132,6 +442,63 @@ class UnityClient(object):
                       lun_id)
         return lun
 
+    def migrate_lun(self, lun, dest_pool, is_thin=None, is_compression=None):
+        """Moves the LUN to another pool of the Unity system.
+
+        It creates a move session and polls it with backoff until it ends.
+        The LUN keeps its ID and host access during the move.
+
+        :param lun: the `UnityLun` to move.
+        :param dest_pool: the destination `UnityPool`.
+        :param is_thin: whether the moved LUN is thin. The LUN keeps its
+                        provisioning if None.
+        :param is_compression: whether to enable data reduction on the moved
+                               LUN. The LUN keeps its setting if None.
+        :return: True if the move completes, otherwise False.
+        """
+        if is_thin is None:
+            is_thin = lun.is_thin_enabled
+        if is_compression is None:
+            is_compression = lun.is_compression_enabled
+        try:
+            session = move_session.UnityMoveSession.create(
+                self.get_rest_cli(), lun, dest_pool, is_dest_thin=is_thin,
+                is_data_reduction_applied=is_compression)
+        except storops_ex.UnityException as ex:
+            LOG.warning(_LW('Failed to create move session of LUN %(lun)s to '
+                            'pool %(pool)s. Error: %(err)s.'),
+                        {'lun': lun.get_id(), 'pool': dest_pool.name,
+                         'err': ex})
+            return False
+
+        def _check_session():
+            session.update()
+            if session.state == storops.MoveSessionStateEnum.COMPLETED:
+                return True
+            if session.state in (storops.MoveSessionStateEnum.FAILED,
+                                 storops.MoveSessionStateEnum.CANCELLED):
+                LOG.warning(_LW('Move session %(id)s of LUN %(lun)s ends '
+                                'with state %(state)s.'),
+                            {'id': session.get_id(), 'lun': lun.get_id(),
+                             'state': session.state})
+                return False
+            LOG.debug('Move session %(id)s of LUN %(lun)s: %(progress)s%%.',
+                      {'id': session.get_id(), 'lun': lun.get_id(),
+                       'progress': session.progress})
+            return None
+
+        moved = utils.poll_with_backoff(_check_session,
+                                        timeout=self.move_session_timeout)
+        if moved is None:
+            LOG.warning(_LW('Move session %(id)s of LUN %(lun)s does not end '
+                            'in %(timeout)s seconds, cancel it.'),
+                        {'id': session.get_id(), 'lun': lun.get_id(),
+                         'timeout': self.move_session_timeout})
+            utils.ignore_exception(self.get_rest_cli().action, 'moveSession',
+                                   session.get_id(), 'cancel')
+            return False
+        return moved
+
     def get_pools(self):
         """Gets all storage pools on the Unity system.
 
@@ -146,6 +513,17 @@ class UnityClient(object):
         :param name: the name of the snapshot. The Unity system will give one
                      if `name` is None.
         """
+        params = {'storageResource': {'id': src_lun_id},
+                  'isAutoDelete': False}
+        if name is not None:
+            params['name'] = name
+        task = {'object': 'snap', 'action': 'create', 'parametersIn': params}
+        return self._submit(task,
+                            lambda out: self.system.get_snap(_id=out['id']),
+                            functools.partial(self._create_snap, src_lun_id,
+                                              name=name))
+
+    def _create_snap(self, src_lun_id, name=None):
         try:
             lun = self.get_lun(lun_id=src_lun_id)
             snap = lun.create_snap(name, is_auto_delete=False)
@@ -159,12 +537,22 @@ class UnityClient(object):
             snap = self.get_snap(name=name)
         return snap
 
-    @staticmethod
-    def delete_snap(snap, even_attached=False):
+    def delete_snap(self, snap, even_attached=False):
         if snap is None:
             LOG.debug("Snap to delete is None, skipping deletion.")
             return
+        if even_attached:
+            # The attached snapshot needs to be detached first.
+            self._delete_snap(snap, even_attached=True)
+            return
+
+        task = {'object': 'snap', 'action': 'delete',
+                'parametersIn': {'id': snap.get_id()}}
+        self._submit(task, lambda out: None,
+                     functools.partial(self._delete_snap, snap))
 
+    @staticmethod
+    def _delete_snap(snap, even_attached=False):
         try:
             snap.delete(even_attached=even_attached)
         except storops_ex.UnityResourceNotFoundError as err:
@@ -178,15 +566,114 @@ class UnityClient(object):
                                 "which is in use. Message: %(err)s"),
                             {'snap_name': snap.name, 'err': err})
 
-    def get_snap(self, name=None):
+    @staticmethod
+    def restore_snap(snap, delete_backup=False):
+        """Restores the LUN of the snapshot to the snapshot.
+
+        :param snap: the `UnitySnap` to restore.
+        :param delete_backup: whether to delete the backup snapshot taken by
+                              Unity before restoring, after the restore.
+        :return: the backup `UnitySnap` taken by Unity before restoring.
+        """
+        return snap.restore(delete_backup=delete_backup)
+
+    def get_snap(self, name=None, snap_id=None):
         try:
-            return self.system.get_snap(name=name)
+            return self.system.get_snap(_id=snap_id, name=name)
         except storops_ex.UnityResourceNotFoundError as err:
             LOG.warning(
                 _LW("Snapshot %(name)s doesn't exist. Message: %(err)s"),
-                {'name': name, 'err': err})
+                {'name': name or snap_id, 'err': err})
         return None
 
+    def get_snap_diff(self, base_snap, snap):
+        """Gets the extents changed between two snapshots of the same LUN.
+
+        The extents are fetched from the array page by page, at most
+        `SNAP_DIFF_PAGE_SIZE` of them in one page.
+
+        :param base_snap: the older `UnitySnap`.
+        :param snap: the newer `UnitySnap`.
+        :return: generator of the (offset, length) in bytes of the extents.
+        """
+        offset = 0
+        while offset is not None:
+            resp = self.get_rest_cli().action(
+                'snap', snap.get_id(), 'getSnapDiff',
+                baseSnap={'id': base_snap.get_id()},
+                startOffset=offset, maxExtents=SNAP_DIFF_PAGE_SIZE)
+            content = resp.first_content
+            for extent in content.get('extents', []):
+                yield extent['offset'], extent['length']
+            offset = content.get('nextOffset')
+
+    def _get_paged(self, type_name, fields, the_filter=None, order_by=None):
+        """Gets the resources page by page, with only the fields given.
+
+        :param type_name: the REST type of the resources, like `lun`.
+        :param fields: the list of the fields to get.
+        :param the_filter: the filter expression of the REST API.
+        :param order_by: the list of the `(field, 'asc' or 'desc')` to sort.
+        :return: generator of the content dicts of the resources.
+        """
+        query = {'fields': ','.join(fields), 'compact': 'true',
+                 'per_page': MANAGEABLE_PAGE_SIZE}
+        if the_filter:
+            query['filter'] = the_filter
+        if order_by:
+            query['orderby'] = ','.join('%s %s' % key for key in order_by)
+        page = 1
+        while True:
+            query['page'] = page
+            resp = self.get_rest_cli().rest_get(
+                '/api/types/%s/instances?%s' % (type_name,
+                                                urllib.parse.urlencode(query)))
+            contents = resp.contents
+            for content in contents:
+                yield content
+            if len(contents) < MANAGEABLE_PAGE_SIZE:
+                return
+            page += 1
+
+    @staticmethod
+    def _pool_filter(field, pool_ids):
+        return ' or '.join('%s eq "%s"' % (field, pool_id)
+                           for pool_id in pool_ids)
+
+    def get_lun_contents(self, pool_ids, order_by=None, name_prefix=None):
+        """Gets the brief info of the LUNs in the pools, page by page.
+
+        :param name_prefix: only the LUNs with names starting with it are
+                            returned if specified.
+        :return: generator of the dicts of `id`, `name`, `sizeTotal`, `pool`
+                 and `hostAccess` of the LUNs.
+        """
+        if not pool_ids:
+            return iter([])
+        the_filter = self._pool_filter('pool.id', pool_ids)
+        if name_prefix:
+            the_filter = '(%s) and name lk "%s%%"' % (the_filter, name_prefix)
+        return self._get_paged(
+            'lun', ['id', 'name', 'sizeTotal', 'pool', 'hostAccess'],
+            the_filter=the_filter, order_by=order_by)
+
+    def get_snap_contents(self, pool_ids, order_by=None, name_prefix=None):
+        """Gets the brief info of the snapshots of the LUNs in the pools.
+
+        :param name_prefix: only the snapshots with names starting with it are
+                            returned if specified.
+        :return: generator of the dicts of `id`, `name`, `size`, `lun` and
+                 `hostAccess` of the snapshots, page by page.
+        """
+        if not pool_ids:
+            return iter([])
+        the_filter = self._pool_filter('lun.pool.id', pool_ids)
+        if name_prefix:
+            the_filter = '(%s) and name lk "%s%%"' % (the_filter, name_prefix)
+        return self._get_paged(
+            'snap', ['id', 'name', 'size', 'lun', 'hostAccess'],
+            the_filter=the_filter, order_by=order_by)
+
     @coordination.synchronized('{self.host}-{name}')
     def create_host(self, name):
         """Provides existing host if exists else create one."""
@@ -261,7 +748,11 @@ class UnityClient(object):
         portals = self.system.get_iscsi_portal()
         portals = portals.shadow_copy(port_ids=allowed_ports)
         return [{'portal': utils.convert_ip_to_portal(p.ip_address),
-                 'iqn': p.iscsi_node.name}
+                 'iqn': p.iscsi_node.name,
+                 'sp': p.ethernet_port.storage_processor.get_id(),
+                 'port': p.ethernet_port.get_id(),
+                 'ip': p.ip_address,
+                 'netmask': p.netmask or p.v6_prefix_length}
                 for p in portals]
 
     def get_fc_ports(self):
@@ -279,13 +770,23 @@ class UnityClient(object):
         This function removes the colons and returns the last 16 bits:
         5006016C09200925.
         """
-        wwns = set()
+        return sorted(self.get_fc_targets(host, logged_in_only=logged_in_only,
+                                          allowed_ports=allowed_ports))
+
+    def get_fc_targets(self, host=None, logged_in_only=False,
+                       allowed_ports=None):
+        """Gets the FC ports of the array with their SPs.
+
+        :return: dict of the port WWN, in the format of `get_fc_target_info`,
+                 to the ID of the SP of the port.
+        """
+        wwns = {}
         if logged_in_only:
             for paths in filter(None, host.fc_host_initiators.paths):
                 paths = paths.shadow_copy(is_logged_in=True)
                 # `paths.fc_port` is just a list, not a UnityFcPortList,
                 # so use filter instead of shadow_copy here.
-                wwns.update(p.wwn.upper()
+                wwns.update((p.wwn.upper(), p.storage_processor.get_id())
                             for p in filter(
                                 lambda fcp: (allowed_ports is None or
                                              fcp.get_id() in allowed_ports),
@@ -293,26 +794,144 @@ class UnityClient(object):
         else:
             ports = self.get_fc_ports()
             ports = ports.shadow_copy(port_ids=allowed_ports)
-            wwns.update(p.wwn.upper() for p in ports)
-        return [wwn.replace(':', '')[16:] for wwn in wwns]
-
-    def create_io_limit_policy(self, name, max_iops=None, max_kbps=None):
+            wwns.update((p.wwn.upper(), p.storage_processor.get_id())
+                        for p in ports)
+        return {wwn.replace(':', '')[16:]: sp_id
+                for wwn, sp_id in wwns.items()}
+
+    def create_io_limit_policy(self, name, max_iops=None, max_kbps=None,
+                               max_iops_density=None, max_kbps_density=None,
+                               burst_rate=None, burst_time=None,
+                               burst_frequency=None, is_shared=False):
+        """Creates the IO limit policy, or gets it if the name is in use.
+
+        The policy is density-based, whose limits are per GB of the LUN, if
+        `max_iops_density` or `max_kbps_density` is set, otherwise it has
+        the absolute limits. The burst settings are passed only if set. The
+        limits of a shared policy apply to the total of all its LUNs.
+        """
+        if max_iops_density is not None or max_kbps_density is not None:
+            kwargs = {
+                'policy_type': storops.IOLimitPolicyTypeEnum.DENSITY_BASED,
+                'max_iops_density': max_iops_density,
+                'max_kbps_density': max_kbps_density}
+        else:
+            kwargs = {'max_iops': max_iops, 'max_kbps': max_kbps}
+        burst = {'burst_rate': burst_rate, 'burst_time': burst_time,
+                 'burst_frequency': burst_frequency}
+        kwargs.update({k: v for k, v in burst.items() if v is not None})
+        if is_shared:
+            kwargs['is_shared'] = True
         try:
-            limit = self.system.create_io_limit_policy(
-                name, max_iops=max_iops, max_kbps=max_kbps)
+            limit = self.system.create_io_limit_policy(name, **kwargs)
         except storops_ex.UnityPolicyNameInUseError:
             limit = self.system.get_io_limit_policy(name=name)
         return limit
 
-    def get_io_limit_policy(self, qos_specs):
+    def get_io_limit_policy(self, qos_specs, project_id=None):
+        """Gets the IO limit policy of the QoS specs.
+
+        The shared QoS specs have one shared policy for each project, named
+        after both of them.
+        """
         limit_policy = None
         if qos_specs is not None:
+            is_shared = qos_specs.get(utils.QOS_IS_SHARED, False)
+            name = qos_specs['id']
+            if is_shared:
+                name = '%s-%s' % (name, project_id)
             limit_policy = self.create_io_limit_policy(
-                qos_specs['id'],
+                name,
                 qos_specs.get(utils.QOS_MAX_IOPS),
-                qos_specs.get(utils.QOS_MAX_BWS))
+                qos_specs.get(utils.QOS_MAX_BWS),
+                max_iops_density=qos_specs.get(utils.QOS_MAX_IOPS_DENSITY),
+                max_kbps_density=qos_specs.get(utils.QOS_MAX_BWS_DENSITY),
+                burst_rate=qos_specs.get(utils.QOS_BURST_RATE),
+                burst_time=qos_specs.get(utils.QOS_BURST_TIME),
+                burst_frequency=qos_specs.get(utils.QOS_BURST_FREQUENCY),
+                is_shared=is_shared)
         return limit_policy
 
+    @staticmethod
+    def update_lun_io_limit_policy(lun, io_limit_policy):
+        """Applies the IO limit policy to the LUN, or removes it if None."""
+        if io_limit_policy is not None:
+            lun.modify(io_limit_policy=io_limit_policy)
+        elif lun.io_limit_policy is not None:
+            lun.io_limit_policy.remove_from_storage(lun)
+
+    @staticmethod
+    def get_tiering_policy(spec_value):
+        """Gets the `TieringPolicyEnum` of the tiering extra spec value."""
+        name = utils.get_tiering_policy_name(spec_value)
+        return None if name is None else getattr(storops.TieringPolicyEnum,
+                                                 name)
+
     def get_pool_name(self, lun_name):
         lun = self.system.get_lun(name=lun_name)
         return lun.pool_name
+
+    def create_cg(self, name, description=None, lun_add=None):
+        """Creates consistency group on the Unity system.
+
+        :param name: consistency group name
+        :param description: consistency group description
+        :param lun_add: list of `UnityLun` objects to put in the group
+        :return: `UnityConsistencyGroup` object
+        """
+        try:
+            cg = self.system.create_cg(name, description=description,
+                                       lun_add=lun_add)
+        except storops_ex.UnityConsistencyGroupNameInUseError:
+            LOG.debug('CG %s already exists. Return the existing one.', name)
+            cg = self.system.get_cg(name=name)
+        return cg
+
+    def get_cg(self, name):
+        try:
+            return self.system.get_cg(name=name)
+        except storops_ex.UnityResourceNotFoundError:
+            LOG.info(_LI('CG %s not found.'), name)
+        return None
+
+    def delete_cg(self, name):
+        """Deletes consistency group and the LUNs in it."""
+        cg = self.get_cg(name)
+        if cg is None:
+            LOG.debug('CG %s to delete is not found, skipping deletion.',
+                      name)
+            return
+        cg.delete()
+
+    def update_cg(self, name, add_lun_ids, remove_lun_ids):
+        cg = self.get_cg(name)
+        if cg is None:
+            msg = _('CG %s to update is not found.') % name
+            raise exception.VolumeBackendAPIException(data=msg)
+        cg.update_lun(add_luns=[self.get_lun(lun_id=lun_id)
+                                for lun_id in add_lun_ids],
+                      remove_luns=[self.get_lun(lun_id=lun_id)
+                                   for lun_id in remove_lun_ids])
+
+    def create_cg_snap(self, cg_name, snap_name=None):
+        """Creates a snapshot of all the LUNs in the consistency group.
+
+        :param cg_name: the name of the consistency group.
+        :param snap_name: the name of the snapshot.
+        :return: `UnitySnap` object of the group snapshot. The snapshots of
+                 the member LUNs are in the snap group of it.
+        """
+        cg = self.get_cg(cg_name)
+        if cg is None:
+            msg = _('CG %s to snapshot is not found.') % cg_name
+            raise exception.VolumeBackendAPIException(data=msg)
+        try:
+            return cg.create_snap(name=snap_name, is_auto_delete=False)
+        except storops_ex.UnitySnapNameInUseError:
+            LOG.debug('Snap %s of CG already exists. Return the existing '
+                      'one.', snap_name)
+            return self.get_snap(name=snap_name)
+
+    def filter_snaps_in_cg_snap(self, cg_snap_id):
+        """Gets the snapshots of the member LUNs of a group snapshot."""
+        return self.system.get_snap(snap_group=cg_snap_id).list
@@ -16,12 +16,15 @@
 """Cinder Driver for Unity"""
 
 from oslo_config import cfg
+from oslo_config import types
 from oslo_log import log as logging
 
 from cinder import interface
 from cinder.volume import driver
 from cinder.volume.drivers.dell_emc.unity import adapter
+from cinder.volume.drivers.dell_emc.unity import utils
 from cinder.volume.drivers.san.san import san_opts
+from cinder.volume import utils as vol_utils
 from cinder.zonemanager import utils as zm_utils
 
 LOG = logging.getLogger(__name__)
@@ -42,7 +45,144 @@ UNITY_OPTS = [
                 help='To force delete the snapshot from Unity even when it is '
                      'attached to hosts. Be careful to set it to True. If the '
                      'snapshot is attached, force deleting it could cause data'
-                     'unaccessble and/or data loss. By default, it is False.')]
+                     'unaccessble and/or data loss. By default, it is False.'),
+    cfg.IntOpt('unity_clone_snapshot_share_window',
+               default=0,
+               min=0,
+               help='Time in seconds during which the internal snapshot '
+                    'taken on a source volume for cloning is shared by the '
+                    'other clones of the same source volume. The snapshot is '
+                    'deleted when the last clone using it finishes. 0 means '
+                    'each clone takes its own snapshot.'),
+    cfg.IntOpt('unity_group_clone_workers',
+               default=4,
+               min=1,
+               help='Maximum number of volumes copied via dd in parallel '
+                    'when creating a group from a group snapshot or a '
+                    'source group.'),
+    cfg.BoolOpt('unity_image_cache_enabled',
+                default=False,
+                help='To cache images as LUNs in the storage pools. Volumes '
+                     'created from an image are thin cloned from the image '
+                     'LUN in the same pool. By default, it is False.'),
+    cfg.IntOpt('unity_image_cache_max_count',
+               default=16,
+               min=1,
+               help='Maximum number of image LUNs cached in each storage '
+                    'pool. The least recently used image LUNs without thin '
+                    'clones are evicted when the limit is reached.'),
+    cfg.ListOpt('unity_warm_lun_sizes',
+                item_type=types.Integer(min=1),
+                default=None,
+                help='A comma-separated list of volume sizes in GiB. Thin '
+                     'LUNs of these sizes are created in advance in each '
+                     'storage pool, and taken when volumes of the same size '
+                     'are created. By default, no LUN is created in '
+                     'advance.'),
+    cfg.IntOpt('unity_warm_lun_depth',
+               default=2,
+               min=1,
+               help='Number of LUNs created in advance for each size in '
+                    'unity_warm_lun_sizes in each storage pool.'),
+    cfg.IntOpt('unity_warm_lun_min_free_percent',
+               default=20,
+               min=0,
+               max=100,
+               help='LUNs are not created in advance in the storage pools '
+                    'with less free capacity in percentage.'),
+    cfg.IntOpt('unity_warm_lun_refill_interval',
+               default=60,
+               min=1,
+               help='Interval in seconds to create the LUNs taken from the '
+                    'ones created in advance.'),
+    cfg.IntOpt('unity_job_batch_size',
+               default=1,
+               min=1,
+               help='Maximum number of concurrent LUN and snapshot creations '
+                    'and deletions sent to Unity in one job. 1 means each '
+                    'operation is sent alone.'),
+    cfg.FloatOpt('unity_job_batch_window',
+                 default=0.05,
+                 min=0,
+                 help='Time in seconds to wait for concurrent operations to '
+                      'join a job before sending it.'),
+    cfg.IntOpt('unity_job_timeout',
+               default=300,
+               min=1,
+               help='Time in seconds to wait for a job of batched operations '
+                    'to end. The operations fail if it is reached.'),
+    cfg.IntOpt('unity_move_session_timeout',
+               default=86400,
+               min=1,
+               help='Time in seconds to wait for the array to move a LUN '
+                    'between pools. The move is cancelled if it is reached.'),
+    cfg.BoolOpt('unity_deferred_delete',
+                default=False,
+                help='To rename the deleted LUNs and snapshots and delete '
+                     'them in background.'),
+    cfg.IntOpt('unity_deferred_delete_rate',
+               default=30,
+               min=1,
+               help='Maximum number of deferred LUN and snapshot deletions '
+                    'per minute.'),
+    cfg.IntOpt('unity_deferred_delete_max_retries',
+               default=5,
+               min=0,
+               help='Number of retries of a failed deferred deletion '
+                    'before it is retried after the other deletions.'),
+    cfg.BoolOpt('unity_over_subscription_data_reduction',
+                default=False,
+                help='To multiply the max_over_subscription_ratio of each '
+                     'pool by its data reduction ratio.'),
+    cfg.IntOpt('unity_perf_sample_interval',
+               default=0,
+               min=0,
+               help='Interval in seconds to sample the IO metrics of the '
+                    'pools, which are reported in the pool stats. 0 means '
+                    'not to sample.'),
+    cfg.FloatOpt('unity_perf_smoothing_factor',
+                 default=0.3,
+                 min=0,
+                 max=1,
+                 help='Weight of the latest sample in the smoothed IO '
+                      'metrics.'),
+    cfg.IntOpt('unity_hot_volume_count',
+               default=0,
+               min=0,
+               help='Count of the busiest volumes reported as hot volumes in '
+                    'the stats. 0 means not to report. Requires '
+                    'unity_perf_sample_interval.'),
+    cfg.IntOpt('unity_telemetry_samples',
+               default=60,
+               min=1,
+               help='Count of the latest IO metric samples of each volume '
+                    'used to find the hot volumes.'),
+    cfg.BoolOpt('unity_sp_balanced_placement',
+                default=False,
+                help='To choose the SP owning each new LUN by the LUN count '
+                     'and utilization of the SPs.'),
+    cfg.IntOpt('unity_sp_balance_refresh_interval',
+               default=300,
+               min=1,
+               help='Interval in seconds to refresh the LUN count and '
+                    'utilization of the SPs for the balanced placement.'),
+    cfg.IntOpt('unity_iscsi_max_portals',
+               default=0,
+               min=0,
+               help='Max count of the iSCSI portals in the connection info, '
+                    'the best ranked ones of each SP are kept. 0 means no '
+                    'limit.'),
+    cfg.IntOpt('unity_fc_max_targets',
+               default=0,
+               min=0,
+               help='Max count of the FC target ports of each attachment, '
+                    'balanced across the SPs and fabrics. 0 means no '
+                    'limit.'),
+    cfg.IntOpt('unity_fc_zone_cache_ttl',
+               default=0,
+               min=0,
+               help='Seconds to cache the fabric mappings of the FC zone '
+                    'lookup service. 0 means not to cache.')]
 
 CONF.register_opts(UNITY_OPTS)
 
@@ -61,9 +201,34 @@ class UnityDriver(driver.TransferVD,
         00.05.03 - Fixed bug 1798529: add option for force deleting attached
                    snapshots
         00.05.04 - Fixed bug which create volume related logs failed to print
+        00.05.05 - Share internal clone snapshots of the same source volume
+        00.05.06 - Add generic group and group snapshot support
+        00.05.07 - Add parallel group creation from source
+        00.05.08 - Add array-native image volume cache
+        00.05.09 - Add array-assisted volume migration
+        00.05.10 - Add in-place retype
+        00.05.11 - Add revert to snapshot via snapshot restore
+        00.05.12 - Add snapshot differential for incremental backup
+        00.05.13 - Add warm LUNs created in advance
+        00.05.14 - Add batched job submission
+        00.05.15 - Add deferred volume deletion
+        00.05.16 - Add density-based and burst QoS specs
+        00.05.17 - Add shared QoS specs per project
+        00.05.18 - Add tiering policy extra spec and tier capacity stats
+        00.05.19 - Add compressed provisioning and data reduction stats
+        00.05.20 - Add thick provisioning
+        00.05.21 - Add IO metrics to pool stats
+        00.05.22 - Add hot volume report
+        00.05.23 - Add SP balanced LUN placement
+        00.05.24 - Order targets by the owning SP
+        00.05.25 - Rank iSCSI portals by subnet and port load
+        00.05.26 - Cap FC targets per attachment
+        00.05.27 - Cache FC zone lookups
+        00.05.28 - Add manageable volumes and snapshots listing
+        00.05.29 - Update provider info in bulk at the service start
     """
 
-    VERSION = '00.05.04'
+    VERSION = '00.05.29'
     VENDOR = 'Dell EMC'
     # ThirdPartySystems wiki page
     CI_WIKI_NAME = "EMC_UNITY_CI"
@@ -98,6 +263,12 @@ class UnityDriver(driver.TransferVD,
         """Creates a cloned volume."""
         return self.adapter.create_cloned_volume(volume, src_vref)
 
+    def clone_image(self, context, volume,
+                    image_location, image_meta, image_service):
+        """Creates a volume from the image cached on the array."""
+        return self.adapter.clone_image(context, volume, image_meta,
+                                        image_service)
+
     def extend_volume(self, volume, new_size):
         """Extend a volume."""
         self.adapter.extend_volume(volume, new_size)
@@ -106,6 +277,14 @@ class UnityDriver(driver.TransferVD,
         """Deletes a volume."""
         self.adapter.delete_volume(volume)
 
+    def migrate_volume(self, context, volume, host):
+        """Migrates a volume to a pool of the same Unity via LUN move."""
+        return self.adapter.migrate_volume(volume, host)
+
+    def retype(self, context, volume, new_type, diff, host):
+        """Changes the type of a volume in place on the LUN."""
+        return self.adapter.retype(volume, new_type, diff, host)
+
     def create_snapshot(self, snapshot):
         """Creates a snapshot."""
         self.adapter.create_snapshot(snapshot)
@@ -114,6 +293,10 @@ class UnityDriver(driver.TransferVD,
         """Deletes a snapshot."""
         self.adapter.delete_snapshot(snapshot)
 
+    def revert_to_snapshot(self, context, volume, snapshot):
+        """Reverts a volume to a snapshot."""
+        self.adapter.revert_to_snapshot(volume, snapshot)
+
     def ensure_export(self, context, volume):
         """Driver entry point to get the export info for an existing volume."""
         pass
@@ -130,6 +313,7 @@ class UnityDriver(driver.TransferVD,
         """Make sure volume is exported."""
         pass
 
+    @utils.invalidate_zone_mapping_on_error
     @zm_utils.AddFCZone
     def initialize_connection(self, volume, connector):
         """Initializes the connection and returns connection info.
@@ -170,6 +354,7 @@ class UnityDriver(driver.TransferVD,
         """
         return self.adapter.initialize_connection(volume, connector)
 
+    @utils.invalidate_zone_mapping_on_error
     @zm_utils.RemoveFCZone
     def terminate_connection(self, volume, connector, **kwargs):
         """Disallow connection from connector."""
@@ -193,6 +378,15 @@ class UnityDriver(driver.TransferVD,
         stats['vendor_name'] = self.VENDOR
         self._stats = stats
 
+    def update_provider_info(self, volumes, snapshots):
+        """Backfills the IDs of the volumes and snapshots in bulk."""
+        return self.adapter.update_provider_info(volumes, snapshots)
+
+    def set_initialized(self):
+        super(UnityDriver, self).set_initialized()
+        # The LUNs listed by update_provider_info are only used by init_host.
+        self.adapter.clear_listed_luns()
+
     def manage_existing(self, volume, existing_ref):
         """Manages an existing LUN in the array.
 
@@ -205,6 +399,31 @@ class UnityDriver(driver.TransferVD,
         """Returns size of volume to be managed by manage_existing."""
         return self.adapter.manage_existing_get_size(volume, existing_ref)
 
+    def get_manageable_volumes(self, cinder_volumes, marker, limit, offset,
+                               sort_keys, sort_dirs):
+        """Lists the LUNs in the managed pools."""
+        return self.adapter.get_manageable_volumes(
+            cinder_volumes, marker, limit, offset, sort_keys, sort_dirs)
+
+    def manage_existing_snapshot(self, snapshot, existing_ref):
+        """Manages an existing snapshot of the volume's LUN."""
+        return self.adapter.manage_existing_snapshot(snapshot, existing_ref)
+
+    def manage_existing_snapshot_get_size(self, snapshot, existing_ref):
+        """Returns size of snapshot to be managed."""
+        return self.adapter.manage_existing_snapshot_get_size(snapshot,
+                                                              existing_ref)
+
+    def get_manageable_snapshots(self, cinder_snapshots, marker, limit,
+                                 offset, sort_keys, sort_dirs):
+        """Lists the snapshots of the LUNs in the managed pools."""
+        return self.adapter.get_manageable_snapshots(
+            cinder_snapshots, marker, limit, offset, sort_keys, sort_dirs)
+
+    def unmanage_snapshot(self, snapshot):
+        """Unmanages a snapshot."""
+        pass
+
     def get_pool(self, volume):
         """Returns the pool name of a volume."""
         return self.adapter.get_pool_name(volume)
@@ -216,6 +435,15 @@ class UnityDriver(driver.TransferVD,
     def backup_use_temp_snapshot(self):
         return True
 
+    def get_snapshot_diff(self, context, snapshot, base_snapshot):
+        """Gets the extents changed in a snapshot since a base snapshot.
+
+        The extents are the (offset, length) in bytes, which are read only
+        for an incremental backup. None means the whole snapshot needs to be
+        read.
+        """
+        return self.adapter.get_snapshot_diff(snapshot, base_snapshot)
+
     def create_export_snapshot(self, context, snapshot, connector):
         """Creates the mount point of the snapshot for backup.
 
@@ -235,3 +463,50 @@ class UnityDriver(driver.TransferVD,
 
     def terminate_connection_snapshot(self, snapshot, connector, **kwargs):
         return self.adapter.terminate_connection_snapshot(snapshot, connector)
+
+    def create_group(self, context, group):
+        """Creates a generic group.
+
+        Only the group with consistent group snapshot enabled is created as
+        a consistency group on Unity, others are handled by the generic
+        implementation.
+        """
+        if not vol_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        return self.adapter.create_group(group)
+
+    def delete_group(self, context, group, volumes):
+        """Deletes a generic group and the volumes in it."""
+        if not vol_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        return self.adapter.delete_group(group, volumes)
+
+    def update_group(self, context, group,
+                     add_volumes=None, remove_volumes=None):
+        """Adds or removes volumes of a generic group."""
+        if not vol_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        return self.adapter.update_group(group, add_volumes, remove_volumes)
+
+    def create_group_snapshot(self, context, group_snapshot, snapshots):
+        """Creates a snapshot of a generic group."""
+        if not vol_utils.is_group_a_cg_snapshot_type(group_snapshot):
+            raise NotImplementedError()
+        return self.adapter.create_group_snapshot(group_snapshot, snapshots)
+
+    def delete_group_snapshot(self, context, group_snapshot, snapshots):
+        """Deletes a snapshot of a generic group."""
+        if not vol_utils.is_group_a_cg_snapshot_type(group_snapshot):
+            raise NotImplementedError()
+        return self.adapter.delete_group_snapshot(group_snapshot, snapshots)
+
+    def create_group_from_src(self, context, group, volumes,
+                              group_snapshot=None, snapshots=None,
+                              source_group=None, source_vols=None):
+        """Creates a generic group from a group snapshot or a source group."""
+        if not vol_utils.is_group_a_cg_snapshot_type(group):
+            raise NotImplementedError()
+        return self.adapter.create_group_from_src(
+            group, volumes, group_snapshot=group_snapshot,
+            snapshots=snapshots, source_group=source_group,
+            source_vols=source_vols)
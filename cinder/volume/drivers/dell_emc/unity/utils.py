@@ -15,11 +15,21 @@
 
 from __future__ import division
 
+import collections
 import contextlib
 from distutils import version
 import functools
+import hashlib
+import itertools
+import json
+import math
+import time
+
+import netaddr
 from oslo_log import log as logging
+from oslo_utils import excutils
 from oslo_utils import fnmatch
+from oslo_utils import strutils
 from oslo_utils import units
 import six
 
@@ -33,6 +43,31 @@ LOG = logging.getLogger(__name__)
 BACKEND_QOS_CONSUMERS = frozenset(['back-end', 'both'])
 QOS_MAX_IOPS = 'maxIOPS'
 QOS_MAX_BWS = 'maxBWS'
+QOS_MAX_IOPS_DENSITY = 'maxIOPSDensity'
+QOS_MAX_BWS_DENSITY = 'maxBWSDensity'
+QOS_BURST_RATE = 'burstRate'
+QOS_BURST_TIME = 'burstTime'
+QOS_BURST_FREQUENCY = 'burstFrequency'
+QOS_IS_SHARED = 'isShared'
+TIERING_POLICY_SPEC = 'storagetype:tiering'
+# Maps the values of the tiering policy extra spec to the names of
+# `storops.TieringPolicyEnum`.
+TIERING_POLICIES = {
+    'StartHighThenAuto': 'AUTOTIER_HIGH',
+    'Auto': 'AUTOTIER',
+    'HighestAvailable': 'HIGHEST',
+    'LowestAvailable': 'LOWEST',
+    'NoMovement': 'NO_DATA_MOVEMENT',
+}
+DEFAULT_TIERING_POLICY = 'StartHighThenAuto'
+PROVISIONING_SPEC = 'provisioning:type'
+PROVISIONING_THIN = 'thin'
+PROVISIONING_THICK = 'thick'
+PROVISIONING_COMPRESSED = 'compressed'
+PROVISIONING_TYPES = (PROVISIONING_THIN, PROVISIONING_THICK,
+                      PROVISIONING_COMPRESSED)
+QOS_DENSITY_KEYS = (QOS_MAX_IOPS_DENSITY, QOS_MAX_BWS_DENSITY)
+QOS_BURST_KEYS = (QOS_BURST_RATE, QOS_BURST_TIME, QOS_BURST_FREQUENCY)
 
 
 def dump_provider_location(location_dict):
@@ -139,6 +174,22 @@ def convert_ip_to_portal(ip):
     return '%s:3260' % ip
 
 
+def is_same_subnet(ip, portal_ip, netmask):
+    """Checks whether the IP is in the subnet of the iSCSI portal.
+
+    :param ip: the IP to check, like the IP of the connector.
+    :param portal_ip: the IP of the portal.
+    :param netmask: the netmask or prefix length of the portal.
+    """
+    if not (ip and portal_ip and netmask):
+        return False
+    try:
+        return (netaddr.IPAddress(ip) in
+                netaddr.IPNetwork('%s/%s' % (portal_ip, netmask)))
+    except (netaddr.AddrFormatError, ValueError):
+        return False
+
+
 def convert_to_itor_tgt_map(zone_mapping):
     """Function to process data from lookup service.
 
@@ -168,13 +219,173 @@ def convert_to_itor_tgt_map(zone_mapping):
     return target_wwns, itor_tgt_map
 
 
+def invalidate_zone_mapping_on_error(func):
+    """Invalidates the cached zone mapping of the connector on failures.
+
+    It decorates the connection methods of the driver outside of the zone
+    manager decorators, so that the zoning errors are caught too.
+    """
+    @functools.wraps(func)
+    def _wrapper(driver, volume, connector, **kwargs):
+        try:
+            return func(driver, volume, connector, **kwargs)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                driver.adapter.invalidate_zone_mapping(connector)
+
+    return _wrapper
+
+
+def get_zone_fabrics(zone_mapping):
+    """Gets the fabric of each target from the zone lookup service data.
+
+    :param zone_mapping: the data from the zone lookup service, see
+                         `convert_to_itor_tgt_map`.
+    :return: dict of the lower case target WWN to its fabric name.
+    """
+    return {target.lower(): san_name
+            for san_name, one_map in zone_mapping.items()
+            for target in one_map['target_port_wwn_list']}
+
+
+def filter_zone_mapping(zone_mapping, target_wwns):
+    """Keeps only the targets in `target_wwns` in the zone mapping."""
+    wanted = set(wwn.lower() for wwn in target_wwns)
+    ret = {}
+    for san_name, one_map in zone_mapping.items():
+        ret[san_name] = {
+            'initiator_port_wwn_list': one_map['initiator_port_wwn_list'],
+            'target_port_wwn_list': [
+                target for target in one_map['target_port_wwn_list']
+                if target.lower() in wanted]}
+    return ret
+
+
+def select_fc_targets(targets, max_count, owner_sp=None, fabrics=None,
+                      seed=''):
+    """Selects the FC targets of an attachment.
+
+    At most `max_count` targets are selected, balanced across the SPs and
+    the fabrics. The targets of an SP on a fabric are ranked by a stable hash
+    of `seed` and the WWN, so that the hosts are spread over the ports. The
+    targets on no fabric are dropped if `fabrics` is not empty, since the
+    host cannot reach them.
+
+    :param targets: dict of the target WWN to the ID of its SP.
+    :param max_count: max count of the targets, 0 for no limit.
+    :param owner_sp: ID of the SP owning the LUN, whose targets are first.
+    :param fabrics: dict of the lower case target WWN to its fabric.
+    :param seed: the seed of the hash, like the host name.
+    :return: list of the selected WWNs, the ones of `owner_sp` first.
+    """
+    def _owner_first(wwns):
+        return sorted(wwns, key=lambda wwn: targets[wwn] != owner_sp)
+
+    fabrics = fabrics or {}
+    if fabrics:
+        targets = {wwn: sp_id for wwn, sp_id in targets.items()
+                   if wwn.lower() in fabrics}
+
+    if not max_count or len(targets) <= max_count:
+        return _owner_first(sorted(targets))
+
+    groups = collections.defaultdict(list)
+    for wwn in targets:
+        groups[(targets[wwn], fabrics.get(wwn.lower(), ''))].append(wwn)
+    for wwns in groups.values():
+        wwns.sort(key=lambda wwn: hashlib.md5(
+            ('%s-%s' % (seed, wwn)).encode('utf-8')).hexdigest())
+
+    selected = []
+    sp_counts = collections.Counter()
+    fabric_counts = collections.Counter()
+    pair_counts = collections.Counter()
+    while len(selected) < max_count:
+        # Takes from the SP and fabric with the fewest selected targets.
+        sp_id, fabric = min(
+            (key for key, wwns in groups.items() if wwns),
+            key=lambda key: (sp_counts[key[0]] + fabric_counts[key[1]],
+                             pair_counts[key], key[0] != owner_sp, key))
+        selected.append(groups[(sp_id, fabric)].pop(0))
+        sp_counts[sp_id] += 1
+        fabric_counts[fabric] += 1
+        pair_counts[(sp_id, fabric)] += 1
+    return _owner_first(selected)
+
+
+def cap_targets_by_sp(targets, max_count):
+    """Keeps the first targets, balanced across the SPs.
+
+    Each SP keeps at least one target if `max_count` allows, so that the
+    attachment keeps paths during the failover or upgrade of an SP.
+
+    :param targets: list of the ranked target dicts with the `sp` key.
+    :param max_count: max count of the targets, 0 for no limit.
+    :return: list of the kept targets, in the order of `targets`.
+    """
+    if not max_count or len(targets) <= max_count:
+        return list(targets)
+    by_sp = collections.OrderedDict()
+    for i, target in enumerate(targets):
+        by_sp.setdefault(target['sp'], []).append(i)
+    per_sp = int(math.ceil(max_count / len(by_sp)))
+    # The best target of each SP first, then the others up to `per_sp`.
+    kept = set(sorted(indexes[0] for indexes in by_sp.values())[:max_count])
+    counts = collections.Counter(targets[i]['sp'] for i in kept)
+    for i, target in enumerate(targets):
+        if len(kept) >= max_count:
+            break
+        if i not in kept and counts[target['sp']] < per_sp:
+            kept.add(i)
+            counts[target['sp']] += 1
+    return [target for i, target in enumerate(targets) if i in kept]
+
+
+def paginate_manageable(entries, marker, limit, offset):
+    """Pages the manageable volumes or snapshots in constant memory.
+
+    It works like `cinder.volume.utils.paginate_entries_list`, except that
+    the entries are an iterator sorted already, like by the array.
+
+    :param entries: iterator of the sorted entries.
+    :param marker: the reference of the last entry of the previous page.
+    :param limit: max count of the entries to return.
+    :param offset: count of the entries to skip after the marker.
+    """
+    if marker:
+        if not isinstance(marker, dict):
+            try:
+                marker = json.loads(marker)
+            except ValueError:
+                msg = (_('marker %s can not be analysed, please use json like '
+                         'format') % marker)
+                raise exception.InvalidInput(reason=msg)
+        for entry in entries:
+            if entry['reference'] == marker:
+                break
+        else:
+            msg = _('marker not found: %s') % marker
+            raise exception.InvalidInput(reason=msg)
+    offset = offset or 0
+    stop = None if limit is None else offset + limit
+    return list(itertools.islice(entries, offset, stop))
+
+
+def get_backend_tag(name):
+    """Gets the short tag of the backend to put in its internal names."""
+    return hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+
+
 def get_pool_name(volume):
     return vol_utils.extract_host(volume.host, 'pool')
 
 
 def get_extra_spec(volume, spec_key):
+    return get_extra_spec_of_type(volume.volume_type_id, spec_key)
+
+
+def get_extra_spec_of_type(type_id, spec_key):
     spec_value = None
-    type_id = volume.volume_type_id
     if type_id is not None:
         extra_specs = volume_types.get_volume_type_extra_specs(type_id)
         if spec_key in extra_specs:
@@ -182,6 +393,32 @@ def get_extra_spec(volume, spec_key):
     return spec_value
 
 
+def get_tiering_policy_name(spec_value):
+    """Gets the tiering policy name of the tiering extra spec value."""
+    if spec_value is None:
+        return None
+    if spec_value not in TIERING_POLICIES:
+        msg = (_('Invalid value %(value)s of extra spec %(key)s, which '
+                 'should be one of %(values)s.') %
+               {'value': spec_value, 'key': TIERING_POLICY_SPEC,
+                'values': sorted(TIERING_POLICIES)})
+        raise exception.InvalidVolumeType(reason=msg)
+    return TIERING_POLICIES[spec_value]
+
+
+def get_provisioning_type(spec_value):
+    """Gets the provisioning type of the extra spec value, thin if None."""
+    if spec_value is None:
+        return PROVISIONING_THIN
+    if spec_value not in PROVISIONING_TYPES:
+        msg = (_('Invalid value %(value)s of extra spec %(key)s, which '
+                 'should be one of %(values)s.') %
+               {'value': spec_value, 'key': PROVISIONING_SPEC,
+                'values': list(PROVISIONING_TYPES)})
+        raise exception.InvalidVolumeType(reason=msg)
+    return spec_value
+
+
 def ignore_exception(func, *args, **kwargs):
     try:
         func(*args, **kwargs)
@@ -231,12 +468,41 @@ def assure_cleanup(enter_func, exit_func, use_enter_return):
                 ignore_exception(exit_func)
 
 
+def poll_with_backoff(func, interval=1, max_interval=60, factor=2,
+                      timeout=None):
+    """Calls `func` until it returns a value other than None.
+
+    :param func: the function to call.
+    :param interval: the seconds to wait before the second call.
+    :param max_interval: the maximum seconds to wait between two calls.
+    :param factor: the interval is multiplied by it after each call.
+    :param timeout: the seconds to give up after, no limit if None.
+    :return: the first value returned by `func` which is not None, or None if
+             `timeout` is reached.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        ret = func()
+        if ret is not None:
+            return ret
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            interval = min(interval, remaining)
+        time.sleep(interval)
+        interval = min(interval * factor, max_interval)
+
+
 def create_lookup_service():
     return zm_utils.create_lookup_service()
 
 
 def get_backend_qos_specs(volume):
-    type_id = volume.volume_type_id
+    return get_backend_qos_specs_of_type(volume.volume_type_id)
+
+
+def get_backend_qos_specs_of_type(type_id):
     if type_id is None:
         return None
 
@@ -253,16 +519,31 @@ def get_backend_qos_specs(volume):
     if consumer not in BACKEND_QOS_CONSUMERS:
         return None
 
-    max_iops = qos_specs['specs'].get(QOS_MAX_IOPS)
-    max_bws = qos_specs['specs'].get(QOS_MAX_BWS)
-    if max_iops is None and max_bws is None:
+    specs = qos_specs['specs']
+    max_iops = specs.get(QOS_MAX_IOPS)
+    max_bws = specs.get(QOS_MAX_BWS)
+    if (max_iops is None and max_bws is None
+            and all(specs.get(key) is None for key in QOS_DENSITY_KEYS)):
         return None
 
-    return {
+    ret = {
         'id': qos_specs['id'],
         QOS_MAX_IOPS: max_iops,
         QOS_MAX_BWS: max_bws,
     }
+    # The density and burst keys are only included when set, so that the
+    # specs of absolute limits are unchanged.
+    ret.update({key: specs[key] for key in QOS_DENSITY_KEYS + QOS_BURST_KEYS
+                if specs.get(key) is not None})
+    if strutils.bool_from_string(specs.get(QOS_IS_SHARED)):
+        ret[QOS_IS_SHARED] = True
+    return ret
+
+
+def is_density_based_qos(qos_specs):
+    """Checks whether the QoS specs have limits per GB of the volume."""
+    return qos_specs is not None and any(
+        qos_specs.get(key) is not None for key in QOS_DENSITY_KEYS)
 
 
 def remove_empty(option, value_list):